@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+from fastapi import HTTPException
+
+from app.models.schemas import CvatSyncResponse, GeoCoordinate, SurveyInfo
+from app.services import shared_state
+from app.services.analysis_service import run_batch_analysis
+from app.services.change_service import refresh_changes
+from app.services.cvat_service import sync_cvat_data
+from app.services.export_service import FORMATS, export_to_file
+from app.services.geo_service import register_global_origin
+from app.services.import_service import import_export_archive
+from app.services.mosaic_service import build_mosaic
+from app.services.preannotate_service import run_preannotation
+from app.services.survey_service import set_survey
+
+# Headless entry point (`cleanly`, or `python -m app.cli`): every command runs
+# directly against the service layer and db/, no API server needed. With
+# --report, per-stage wall times and counts are written as JSON.
+
+
+class _Report:
+    def __init__(self, command: str):
+        self.started = time.perf_counter()
+        self.data: dict = {
+            "command": command,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "cpus": os.cpu_count(),
+            "stages": {},
+            "counts": {},
+        }
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.data["stages"][name] = round(time.perf_counter() - start, 3)
+
+    def finish(self, status: str) -> dict:
+        self.data["status"] = status
+        self.data["total_s"] = round(time.perf_counter() - self.started, 3)
+        return self.data
+
+
+def _record_surveys(args: argparse.Namespace, result: CvatSyncResponse, report: _Report) -> None:
+    if args.site and args.surveyed_on:
+        info = SurveyInfo(site=args.site, surveyed_on=args.surveyed_on)
+        for task_id in {img.task_id for img in result.images}:
+            set_survey(task_id, info)
+    with report.stage("changes"):
+        refreshed = refresh_changes()
+    report.data["counts"]["survey_diffs"] = refreshed
+    if refreshed:
+        print(f"Recomputed {refreshed} survey diffs")
+
+
+def _cmd_sync(args: argparse.Namespace, report: _Report) -> None:
+    def job_done(task_id: int, done: int, total: int) -> None:
+        print(f"task {task_id}: job {done}/{total}")
+
+    with report.stage("sync"):
+        result = asyncio.run(sync_cvat_data(args.task_id, job_done))
+    print(f"Synced {len(result.images)} images, {result.annotations_count} annotations")
+    report.data["counts"].update(images=len(result.images), annotations=result.annotations_count)
+    _record_surveys(args, result, report)
+
+
+def _cmd_import(args: argparse.Namespace, report: _Report) -> None:
+    with report.stage("import"):
+        result = import_export_archive(Path(args.archive), args.task_id)
+    print(f"Imported {len(result.images)} images, {result.annotations_count} annotations from {args.archive}")
+    report.data["counts"].update(images=len(result.images), annotations=result.annotations_count)
+    _record_surveys(args, result, report)
+
+
+def _cmd_analyze(args: argparse.Namespace, report: _Report) -> None:
+    def chunk_done(stats: dict) -> None:
+        print(f"{stats['images']} images, {stats['annotations']} annotations, "
+              f"{stats['weight_kg']:.1f} kg ({stats['images_per_s']:.1f} images/s)")
+
+    with report.stage("analyze"):
+        stats = run_batch_analysis(args.task_id, args.workers, args.chunk_size, chunk_done)
+    print(f"Done: {stats['images']} images analysed on {stats['workers']} workers, {stats['weight_kg']:.1f} kg")
+    report.data["counts"].update(stats)
+
+
+def _cmd_georef(args: argparse.Namespace, report: _Report) -> None:
+    with report.stage("georef"):
+        count = register_global_origin(GeoCoordinate(lat=args.lat, lng=args.lng), args.resolution_cm)
+    print(f"Georeferenced {count} images from origin {args.lat}, {args.lng}")
+    report.data["counts"]["images_georeferenced"] = count
+
+
+def _cmd_export(args: argparse.Namespace, report: _Report) -> None:
+    with report.stage("export"):
+        count = export_to_file(args.format, Path(args.output), args.site)
+    print(f"Exported {count} detections to {args.output}")
+    report.data["counts"]["detections"] = count
+
+
+def _cmd_preannotate(args: argparse.Namespace, report: _Report) -> None:
+    def batch_done(stats: dict) -> None:
+        print(
+            f"{stats['images']} images, {stats['tiles']} tiles, {stats['proposed']} proposed shapes "
+            f"({stats['tiles_per_s']:.1f} tiles/s)"
+        )
+
+    with report.stage("preannotate"):
+        stats = run_preannotation(args.task_id, args.workers, args.batch_size, args.restart, batch_done)
+    print(f"Done: {stats['images']} images pre-annotated, {stats['skipped']} already done, "
+          f"{stats['tiles_per_s']:.1f} tiles/s")
+    report.data["counts"].update(stats)
+
+
+def _cmd_mosaic(args: argparse.Namespace, report: _Report) -> None:
+    with report.stage("mosaic"):
+        info = build_mosaic(args.task_id, lambda z, n: print(f"zoom {z}: {n} tiles"))
+    print(f"Built mosaic for task {args.task_id}: {info['tiles']} tiles, "
+          f"zoom {info['min_zoom']}-{info['max_zoom']} in {info['build_s']:.1f}s")
+    report.data["counts"]["tiles"] = info["tiles"]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="cleanly", description="Cleanly backend command line.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--report", type=Path, default=None, help="Write a JSON timing report to this path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_sync = sub.add_parser("sync", parents=[common], help="Pull images and annotations from CVAT (resumable).")
+    p_sync.add_argument("--task-id", type=int, default=None, help="Only this task (default: every task)")
+    p_sync.add_argument("--site", default=None, help="Record the synced task(s) as a survey of this site")
+    p_sync.add_argument("--surveyed-on", type=date.fromisoformat, default=None, help="Survey date (YYYY-MM-DD)")
+    p_sync.set_defaults(func=_cmd_sync)
+
+    p_import = sub.add_parser("import", parents=[common], help="Import a CVAT XML or COCO export zip into db/.")
+    p_import.add_argument("archive", help="Path to the export .zip")
+    p_import.add_argument("--task-id", type=int, default=None, help="Task id (required for COCO exports)")
+    p_import.add_argument("--site", default=None, help="Record the imported task(s) as a survey of this site")
+    p_import.add_argument("--surveyed-on", type=date.fromisoformat, default=None, help="Survey date (YYYY-MM-DD)")
+    p_import.set_defaults(func=_cmd_import)
+
+    p_analyze = sub.add_parser("analyze", parents=[common], help="Compute area and weight for every image.")
+    p_analyze.add_argument("--task-id", type=int, action="append", default=None,
+                           help="Only this task (repeatable)")
+    p_analyze.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    p_analyze.add_argument("--chunk-size", type=int, default=64, help="Images per worker task")
+    p_analyze.set_defaults(func=_cmd_analyze)
+
+    p_georef = sub.add_parser("georef", parents=[common], help="Georeference every image from a mosaic origin.")
+    p_georef.add_argument("--lat", type=float, required=True, help="Origin latitude (bottom-left of the mosaic)")
+    p_georef.add_argument("--lng", type=float, required=True, help="Origin longitude")
+    p_georef.add_argument("--resolution-cm", type=float, default=0.5, help="Ground resolution in cm per pixel")
+    p_georef.set_defaults(func=_cmd_georef)
+
+    p_export = sub.add_parser("export", parents=[common], help="Export georeferenced detections to a GIS file.")
+    p_export.add_argument("output", help="Output path")
+    p_export.add_argument("--format", choices=list(FORMATS), default="gpkg")
+    p_export.add_argument("--site", default=None, help="Only this site's surveys")
+    p_export.set_defaults(func=_cmd_export)
+
+    p_pre = sub.add_parser("preannotate", parents=[common],
+                           help="Propose shapes for unlabelled images (CPU, resumable).")
+    p_pre.add_argument("--task-id", type=int, default=None, help="Only this task")
+    p_pre.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    p_pre.add_argument("--batch-size", type=int, default=32, help="Frames per batch and checkpoint")
+    p_pre.add_argument("--restart", action="store_true", help="Ignore the checkpoint and redo every image")
+    p_pre.set_defaults(func=_cmd_preannotate)
+
+    p_mosaic = sub.add_parser("mosaic", parents=[common], help="Build the imagery tile pyramid for a task.")
+    p_mosaic.add_argument("task_id", type=int)
+    p_mosaic.set_defaults(func=_cmd_mosaic)
+
+    args = parser.parse_args(argv)
+    report = _Report(args.command)
+    with report.stage("load_state"):
+        shared_state.load_all()
+    status = 0
+    try:
+        args.func(args, report)
+    except HTTPException as exc:
+        print(f"error: {exc.detail}", file=sys.stderr)
+        report.data["error"] = exc.detail
+        status = 1
+    if args.report:
+        args.report.write_text(json.dumps(report.finish("ok" if status == 0 else "error"), indent=2))
+        print(f"Timing report written to {args.report}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
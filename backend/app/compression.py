@@ -0,0 +1,131 @@
+import gzip
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# br/gzip negotiation for every response that is not already encoded.
+# Cached JSON (response_cache) arrives precompressed and passes straight
+# through; images, zips and other already-compressed media are left alone.
+
+MINIMUM_SIZE = 1024
+_INCOMPRESSIBLE_PREFIXES = ("image/", "video/", "audio/")
+_INCOMPRESSIBLE_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/octet-stream",
+    "application/vnd.apache.parquet",
+    "application/geopackage+sqlite3",
+}
+
+
+def pick_encoding(accept_encoding: str) -> str:
+    """Prefer br, then gzip, from an Accept-Encoding header (q=0 means refused)."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=5)
+        else:
+            self._gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._br.finish() if self.encoding == "br" else self._gz.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+class CompressionMiddleware:
+    """Compress eligible responses with br or gzip, buffered or streaming."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compressor: _Compressor | None = None
+        passthrough = False
+
+        async def wrapped_send(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                passthrough = (
+                    "content-encoding" in headers
+                    or media_type.startswith(_INCOMPRESSIBLE_PREFIXES)
+                    or media_type in _INCOMPRESSIBLE_TYPES
+                    or message["status"] in (204, 304)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message  # held until we know the body size
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    # Small single-chunk body: not worth compressing
+                    await send(start)
+                    start, passthrough = None, True
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                # Streaming response: compress chunk by chunk
+                del headers["Content-Length"]
+                compressor = _Compressor(encoding)
+                await send(start)
+                start = None
+
+            chunk = compressor.process(body) if body else b""
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, wrapped_send)
@@ -11,11 +11,43 @@ class Settings(BaseSettings):
     cvat_username: str = ""
     cvat_password: str = ""
 
-    # OpenAI
+    # OpenAI; base URL empty = api.openai.com (point it at loadtest.fake_openai for load tests)
     openai_api_key: str = ""
+    openai_base_url: str = ""
+    # LLM gateway: concurrent upstream calls per worker, per-attempt timeout, retries of transient errors
+    llm_concurrency: int = 8
+    llm_timeout_s: float = 60.0
+    llm_retries: int = 3
+    llm_backoff_s: float = 1.0
+    # Cached completions (db/llm_cache/): entries kept, and age after which one is refetched
+    llm_cache_max_entries: int = 1000
+    llm_cache_max_age_days: float = 30.0
 
     # App
     frontend_url: str = "http://localhost:3000"
+    # Where state is persisted; empty = db/ at the repo root (load tests point it at a scratch dir)
+    db_dir: str = ""
+    # Max delay before a worker sees db/ writes made by another worker
+    state_refresh_interval_s: float = 1.0
+    # Decoded images/annotations kept per worker; least recently used sites are evicted beyond it
+    partition_memory_mb: int = 256
+
+    # Pre-annotation: label given to proposed shapes, 0 workers = one per CPU
+    preannotate_label: str = "inconnu"
+    preannotate_workers: int = 0
+
+    # Frame prefetching: concurrent CVAT downloads, queue bound, hotspot images to warm
+    prefetch_enabled: bool = True
+    prefetch_concurrency: int = 4
+    prefetch_queue_size: int = 1000
+    prefetch_hotspots: int = 50
+    # Decoded (.npy) frames kept on disk for mosaics; least recently used deleted beyond it
+    decoded_frames_mb: int = 4096
+
+    # Opt-in profiling: empty token = profiler middleware and /admin/profiling not installed
+    profiling_token: str = ""
+    profiling_interval_ms: float = 1.0
+    profiling_max_window_s: float = 300.0
 
     model_config = {"env_file": ".env"}
 
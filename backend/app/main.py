@@ -1,23 +1,34 @@
+from app import startup  # first, so the import breakdown covers everything below
+
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.compression import CompressionMiddleware
 from app.config import settings
-from app.routers import agent, auth, cvat, analysis, map, planning, employees, dashboard
-from app.services.cvat_service import load_from_disk as load_cvat
-from app.services.geo_service import load_from_disk as load_geo, register_global_origin, get_global_origin
+from app.routers import agent, auth, cvat, analysis, map, planning, employees, dashboard, export, surveys
+from app.services import llm_gateway
+from app.services.geo_service import georeference_new_images
+from app.services.prefetch_service import prefetch_hotspots, start_prefetcher, stop_prefetcher
+from app.services.shared_state import load_all, refresh_if_stale
+from app.services.partitions import get_partition_stats
+from app.services.single_flight import get_single_flight_stats
+
+startup.finish_imports()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    load_cvat()
-    load_geo()
-    # Auto-compute georefs from global origin if it was persisted
-    origin = get_global_origin()
-    if origin:
-        register_global_origin(origin)
+    load_all()
+    # Georefs are persisted; only derive them for images synced since the origin was set
+    georeference_new_images()
+    start_prefetcher()
+    await prefetch_hotspots()
+    startup.mark_ready()
     yield
+    await stop_prefetcher()
+    await llm_gateway.close()
 
 
 app = FastAPI(
@@ -27,6 +38,7 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,6 +47,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def refresh_shared_state(request: Request, call_next):
+    # Other uvicorn workers may have synced or georeferenced since our last request
+    refresh_if_stale()
+    return await call_next(request)
+
+
 app.include_router(agent.router)
 app.include_router(auth.router)
 app.include_router(cvat.router)
@@ -43,8 +63,42 @@ app.include_router(map.router)
 app.include_router(planning.router)
 app.include_router(employees.router)
 app.include_router(dashboard.router)
+app.include_router(export.router)
+app.include_router(surveys.router)
+
+# Profiling is opt-in: without a token neither the middleware nor its routes exist
+if settings.profiling_token:
+    from app.profiling import ProfilingMiddleware
+    from app.routers import profiling
+
+    app.add_middleware(ProfilingMiddleware)
+    app.include_router(profiling.router)
 
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/health/coalescing")
+async def coalescing_stats():
+    """Single-flight counters for this worker: calls, executions and calls coalesced onto another's."""
+    return get_single_flight_stats()
+
+
+@app.get("/health/llm")
+async def llm_stats():
+    """LLM gateway counters per purpose (calls, cache hits, retries, tokens, latency) and recent calls."""
+    return llm_gateway.get_llm_stats()
+
+
+@app.get("/health/partitions")
+async def partition_stats():
+    """Site partitions with decoded data resident in this worker, most recently used first, and evictions."""
+    return get_partition_stats()
+
+
+@app.get("/health/startup")
+async def startup_stats():
+    """Boot time, import-time breakdown by package and resident memory of this worker."""
+    return startup.startup_report()
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from datetime import date
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
 
 
 # --- Auth ---
@@ -15,6 +18,9 @@ class LoginResponse(BaseModel):
 # --- CVAT ---
 class CvatSyncRequest(BaseModel):
     task_id: int | None = None  # sync specific task, or all if None
+    # Optional survey metadata recorded for the synced task(s)
+    site: str | None = None
+    surveyed_on: date | None = None
 
 
 class CvatImage(BaseModel):
@@ -29,8 +35,60 @@ class CvatAnnotation(BaseModel):
     id: int
     image_id: int
     label: str
-    points: list[list[float]]  # polygon vertices [[x,y], ...]
+    points: list[list[float]]  # outline vertices [[x,y], ...]
     pixel_area: float | None = None
+    shape_type: str = "polygon"  # CVAT shape type: polygon, rectangle, ellipse, mask, ...
+    proposed: bool = False  # machine pre-annotation awaiting human review
+
+
+class CvatImagePage(BaseModel):
+    items: list[dict]  # image rows, projected to the requested fields
+    next_cursor: str | None = None
+
+
+class MosaicNeighbor(BaseModel):
+    image_id: int
+    d_col: int  # grid offset from the requested image; +col is east, +row is north
+    d_row: int
+
+
+class ImageNeighbors(BaseModel):
+    image_id: int
+    task_id: int
+    col: int
+    row: int
+    x_px: int  # offset in the task's mosaic
+    y_px: int
+    neighbors: list[MosaicNeighbor]
+
+
+class MosaicGridInfo(BaseModel):
+    task_id: int
+    tile_width: int
+    tile_height: int
+    cols: int
+    rows: int
+    tiles: int
+    collisions: int  # frames sharing a grid cell with another
+    extent_px: list[int]  # x0, y0, x1, y1
+
+
+class ImageGeometry(BaseModel):
+    image_id: int
+    task_id: int
+    polygons: int
+    valid: int
+    repaired: int  # invalid outline (e.g. self-intersecting), area measured after make_valid
+    degenerate: int  # fewer than 3 vertices or no area, counted as 0 px
+    flagged_ids: list[int] = []  # annotation ids of the repaired and degenerate polygons
+
+
+class GeometryReport(BaseModel):
+    polygons: int
+    valid: int
+    repaired: int
+    degenerate: int
+    images: list[ImageGeometry]  # images with at least one repaired or degenerate polygon
 
 
 class CvatSyncResponse(BaseModel):
@@ -50,6 +108,114 @@ class AnalysisResult(BaseModel):
     annotations: list[CvatAnnotation]
 
 
+# --- Density model ---
+class SiteDensityOverride(BaseModel):
+    ground_resolution_cm: float | None = None
+    label_density_g_cm2: dict[str, float] = {}
+
+
+# A sampled quantity: fixed at `mode`, uniform or triangular on [low, high], or lognormal with median `mode`
+class Distribution(BaseModel):
+    kind: Literal["fixed", "uniform", "triangular", "lognormal"] = "fixed"
+    low: float = 1.0
+    mode: float = 1.0
+    high: float = 1.0
+    sigma: float = Field(0.0, ge=0)  # lognormal: standard deviation of log(value)
+
+    @model_validator(mode="after")
+    def _check_bounds(self) -> "Distribution":
+        if self.kind == "uniform" and self.low > self.high:
+            raise ValueError("expected low <= high")
+        if self.kind == "triangular" and not self.low <= self.mode <= self.high:
+            raise ValueError("expected low <= mode <= high")
+        return self
+
+
+class UncertaintyModel(BaseModel):
+    draws: int = Field(2000, ge=100, le=100_000)
+    confidence: float = Field(0.9, gt=0, lt=1)  # central interval reported
+    seed: int = 0
+    # Multiplier on ground resolution, one draw per survey (CVAT task)
+    resolution_factor: Distribution = Distribution(kind="lognormal", sigma=0.05)
+    # Multiplier on surface density, one draw per label shared by all surveys
+    density_factor: Distribution = Distribution(kind="lognormal", sigma=0.3)
+    # Buried mass as a fraction of surface mass, one draw per survey
+    buried_fraction: Distribution = Distribution(kind="triangular", low=0.3, mode=0.5, high=0.7)
+
+
+class DensityModel(BaseModel):
+    ground_resolution_cm: float = 0.5  # cm per pixel
+    default_density_g_cm2: float = 0.48  # surface density for labels without their own
+    label_density_g_cm2: dict[str, float] = {}
+    site_overrides: dict[str, SiteDensityOverride] = {}  # keyed by survey site; a task's site comes from its survey
+    uncertainty: UncertaintyModel = UncertaintyModel()
+
+
+class WeightInterval(BaseModel):
+    low_kg: float
+    median_kg: float
+    high_kg: float
+
+
+class ZoneUncertainty(BaseModel):
+    image_id: int
+    task_id: int
+    surface: WeightInterval
+    total: WeightInterval  # surface plus buried
+
+
+class SurveyUncertainty(BaseModel):
+    task_ids: list[int]  # tasks flown on the same day at the same site form one survey
+    site: str | None = None
+    surveyed_on: date | None = None
+    surface: WeightInterval
+    buried: WeightInterval
+    total: WeightInterval
+
+
+class WeightUncertainty(BaseModel):
+    draws: int
+    confidence: float
+    surface: WeightInterval
+    buried: WeightInterval
+    total: WeightInterval
+    surveys: list[SurveyUncertainty]
+    zones: list[ZoneUncertainty]  # highest median surface weight first
+
+
+# --- Surveys / change detection ---
+class SurveyInfo(BaseModel):
+    site: str  # surveys of the same site are compared with each other
+    surveyed_on: date
+
+
+class Survey(SurveyInfo):
+    task_id: int  # recorded per CVAT task; a site's tasks flown on the same day form one survey
+
+
+class ZoneChange(BaseModel):
+    lat: float
+    lng: float
+    weight_before_g: float
+    weight_after_g: float
+    delta_g: float
+
+
+class SurveyChange(BaseModel):
+    site: str
+    before_task_ids: list[int]
+    after_task_ids: list[int]
+    before_date: date
+    after_date: date
+    new: int
+    removed: int
+    persisting: int
+    weight_before_g: float
+    weight_after_g: float
+    delta_g: float
+    zones: list[ZoneChange]  # largest absolute weight change first
+
+
 # --- Map / GeoJSON ---
 class GeoCoordinate(BaseModel):
     lat: float
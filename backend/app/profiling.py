@@ -0,0 +1,246 @@
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.services.store import db_path
+
+# Opt-in sampling profiler. Nothing here is imported or installed unless
+# PROFILING_TOKEN is set (see main.py), so a normal deployment pays nothing.
+#
+# A sampler thread snapshots every thread's Python stack each
+# profiling_interval_ms with sys._current_frames(). Profiles are written to
+# db/profiles/<id>.speedscope.json (open in https://www.speedscope.app) with a
+# <id>.json sidecar holding the route, duration and seconds per category.
+#
+# Per request: send `X-Profile: 1` (or `?profile=1`) plus `X-Profile-Token`;
+# the response carries `X-Profile-Id`. For a time window, POST
+# /admin/profiling/window; only the worker that receives it is profiled.
+# Samples cover all threads of the worker, so concurrent requests show up too.
+
+PROFILE_DIR = db_path("profiles")
+MAX_PROFILES = 200  # oldest are pruned
+
+# Innermost matching frame decides a sample's category
+_CATEGORIES = (
+    ("shapely", ("/shapely/",)),
+    ("pydantic", ("/pydantic/", "/pydantic_core/")),
+    ("json_persistence", ("/app/services/store.py", "/app/services/snapshot_columns.py", "/json/", "/orjson/")),
+    ("external_calls", ("/httpx/", "/httpcore/", "/urllib3/", "/openai/", "/cvat_sdk/", "/ssl.py", "/socket.py")),
+)
+# Leaf functions of a thread that is parked, not working
+_IDLE = {"wait", "select", "_worker"}
+
+
+def check_token(token: str | None) -> bool:
+    return bool(settings.profiling_token) and token is not None and hmac.compare_digest(token, settings.profiling_token)
+
+
+class Sampler:
+    """Background thread collecting stack samples until stop()."""
+
+    def __init__(self, interval_s: float | None = None):
+        self.interval_s = interval_s or settings.profiling_interval_ms / 1000
+        self.samples: Counter[tuple[str, tuple[tuple[str, str, int], ...]]] = Counter()  # (thread, stack) -> count
+        self.started = 0.0
+        self.elapsed_s = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        self._stop.set()
+        self._thread.join()
+        self.elapsed_s = time.perf_counter() - self.started
+        return self
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or names.get(ident) == "profiler":
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                if stack and stack[0][0] in _IDLE:
+                    continue
+                self.samples[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+
+
+def _category(stack: tuple[tuple[str, str, int], ...]) -> str:
+    for _, filename, _ in reversed(stack):
+        filename = filename.replace("\\", "/")
+        for category, markers in _CATEGORIES:
+            if any(m in filename for m in markers):
+                return category
+    return "other"
+
+
+def _speedscope(sampler: Sampler, name: str) -> dict:
+    frames: list[dict] = []
+    frame_index: dict[tuple[str, str], int] = {}
+    profiles: dict[str, dict] = {}
+    for (thread, stack), count in sampler.samples.items():
+        indices = []
+        for func, filename, _ in stack:
+            key = (func, filename)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": func, "file": filename})
+            indices.append(frame_index[key])
+        profile = profiles.setdefault(thread, {
+            "type": "sampled", "name": f"{name} [{thread}]", "unit": "seconds",
+            "startValue": 0, "endValue": 0.0, "samples": [], "weights": [],
+        })
+        weight = count * sampler.interval_s
+        profile["samples"].append(indices)
+        profile["weights"].append(weight)
+        profile["endValue"] += weight
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "cleanly",
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values()),
+    }
+
+
+def save_profile(sampler: Sampler, name: str, profile_id: str | None = None) -> dict:
+    """Write a finished sampler as speedscope JSON plus a summary sidecar; returns the summary."""
+    profile_id = profile_id or uuid.uuid4().hex[:12]
+    categories: Counter[str] = Counter()
+    for (_, stack), count in sampler.samples.items():
+        categories[_category(stack)] += count * sampler.interval_s
+    summary = {
+        "id": profile_id,
+        "name": name,
+        "created_at": time.time(),
+        "duration_s": round(sampler.elapsed_s, 4),
+        "thread_s": round(sum(categories.values()), 4),  # summed over threads, can exceed duration_s
+        "categories_s": {k: round(v, 4) for k, v in categories.most_common()},
+        "pid": os.getpid(),
+    }
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    for suffix, data in ((".speedscope.json", _speedscope(sampler, name)), (".json", summary)):
+        path = PROFILE_DIR / f"{profile_id}{suffix}"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, path)
+    _prune()
+    return summary
+
+
+def _prune() -> None:
+    sidecars = sorted(
+        (p for p in PROFILE_DIR.glob("*.json") if not p.name.endswith(".speedscope.json")),
+        key=lambda p: p.stat().st_mtime,
+    )
+    for old in sidecars[:-MAX_PROFILES]:
+        old.unlink(missing_ok=True)
+        old.with_name(old.name.replace(".json", ".speedscope.json")).unlink(missing_ok=True)
+
+
+def list_profiles() -> list[dict]:
+    if not PROFILE_DIR.exists():
+        return []
+    summaries = []
+    for path in PROFILE_DIR.glob("*.json"):
+        if path.name.endswith(".speedscope.json"):
+            continue
+        try:
+            summaries.append(json.loads(path.read_text()))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return sorted(summaries, key=lambda s: s["created_at"], reverse=True)
+
+
+def profile_path(profile_id: str) -> Path | None:
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}.speedscope.json"
+    return path if path.exists() else None
+
+
+# --- Time window (one at a time per worker) ---
+
+_window: tuple[Sampler, str, threading.Timer] | None = None
+_window_lock = threading.Lock()
+
+
+def start_window(seconds: float) -> str | None:
+    """Profile this worker for `seconds`; returns the profile id, or None if a window is running."""
+    global _window
+    with _window_lock:
+        if _window is not None:
+            return None
+        profile_id = uuid.uuid4().hex[:12]
+        timer = threading.Timer(seconds, stop_window)
+        timer.daemon = True
+        _window = (Sampler().start(), profile_id, timer)
+        timer.start()
+        return profile_id
+
+
+def stop_window() -> dict | None:
+    """End the running window early (or on its timer) and save it."""
+    global _window
+    with _window_lock:
+        if _window is None:
+            return None
+        sampler, profile_id, timer = _window
+        _window = None
+    timer.cancel()
+    return save_profile(sampler.stop(), f"window {profile_id}", profile_id)
+
+
+class ProfilingMiddleware:
+    """Profile single requests that ask for it with a valid token."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        wanted = headers.get("x-profile") == "1" or QueryParams(scope.get("query_string", b"")).get("profile") == "1"
+        if not wanted:
+            await self.app(scope, receive, send)
+            return
+        if not check_token(headers.get("x-profile-token")):
+            await JSONResponse({"detail": "Invalid profiling token."}, status_code=403)(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+
+        async def tagged_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", profile_id.encode()))
+            await send(message)
+
+        sampler = Sampler().start()
+        try:
+            await self.app(scope, receive, tagged_send)
+        finally:
+            sampler.stop()
+            await asyncio.to_thread(save_profile, sampler, f"{scope['method']} {scope['path']}", profile_id)
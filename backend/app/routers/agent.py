@@ -15,6 +15,7 @@ class ChatRequest(BaseModel):
     message: str
     map_context: dict | None = None
     history: list[HistoryMessage] | None = None
+    site: str | None = None  # answer from this site's surveys only
 
 
 class ChatResponse(BaseModel):
@@ -28,5 +29,5 @@ async def agent_chat(body: ChatRequest):
         if body.history
         else None
     )
-    reply = await chat(body.message, body.map_context, history_dicts)
+    reply = await chat(body.message, body.map_context, history_dicts, body.site)
     return ChatResponse(reply=reply)
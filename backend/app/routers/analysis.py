@@ -1,11 +1,24 @@
 from fastapi import APIRouter
 
-from app.models.schemas import AnalysisResult
+from app.models.schemas import AnalysisResult, DensityModel
 from app.services.analysis_service import compute_analysis, get_analysis
+from app.services.density_model import get_density_model, set_density_model
 
 router = APIRouter(prefix="/analysis", tags=["analysis"])
 
 
+@router.get("/density-model", response_model=DensityModel)
+async def read_density_model():
+    """Return the ground resolution and per-label density coefficients."""
+    return get_density_model()
+
+
+@router.put("/density-model", response_model=DensityModel)
+async def update_density_model(model: DensityModel):
+    """Replace the density model; every weight estimate re-derives from it."""
+    return set_density_model(model)
+
+
 @router.post("/{image_id}", response_model=AnalysisResult)
 async def run_analysis(image_id: int):
     """Compute trash area and weight for an image's annotations."""
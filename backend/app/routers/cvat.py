@@ -1,32 +1,193 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+import asyncio
+import shutil
+import tempfile
+from datetime import date
+from pathlib import Path
 
-from app.models.schemas import CvatAnnotation, CvatImage, CvatSyncRequest, CvatSyncResponse
-from app.services.cvat_service import get_cached_annotations, get_cached_images, get_frame_data, sync_cvat_data
+from fastapi import APIRouter, File, Form, Query, Request, UploadFile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+from app.models.schemas import (
+    CvatAnnotation,
+    CvatImagePage,
+    CvatSyncRequest,
+    CvatSyncResponse,
+    GeometryReport,
+    ImageNeighbors,
+    MosaicGridInfo,
+    SurveyInfo,
+)
+from app.services.change_service import refresh_changes
+from app.services.cvat_service import (
+    get_cached_annotations,
+    get_data_version,
+    sync_cvat_data,
+)
+from app.services.density_model import get_model_version
+from app.services.frame_cache import cached_frame, cached_frame_path, frame_media_type
+from app.services.geo_service import get_georef_version
+from app.services.geometry_service import get_report
+from app.services.import_service import import_export_archive
+from app.services.image_index import parse_fields, query_annotations, query_images
+from app.services.mosaic_index import get_grid_info, get_image_neighbors, tiles_in_rect
+from app.services.prefetch_service import (
+    get_prefetch_stats,
+    prefetch_hotspots,
+    prefetch_listing,
+    prefetch_neighbours,
+    record_frame_request,
+)
+from app.services.response_cache import cached_json_response
+from app.services.survey_service import get_survey_version, set_survey
 
 router = APIRouter(prefix="/cvat", tags=["cvat"])
 
 
 @router.post("/sync", response_model=CvatSyncResponse)
 async def sync(request: CvatSyncRequest):
-    """Pull images and annotations from CVAT."""
-    return await sync_cvat_data(request.task_id)
+    """Pull images and annotations from CVAT.
+
+    Only the pulled tasks are replaced. With `site` and `surveyed_on`, the
+    pulled tasks are recorded as that site's survey and change detection
+    against earlier surveys is refreshed.
+    """
+    result = await sync_cvat_data(request.task_id)
+    _record_survey(result, request.site, request.surveyed_on)
+    await asyncio.to_thread(refresh_changes)
+    return result
+
+
+def _record_survey(result: CvatSyncResponse, site: str | None, surveyed_on: date | None) -> None:
+    if site and surveyed_on:
+        info = SurveyInfo(site=site, surveyed_on=surveyed_on)
+        for task_id in {img.task_id for img in result.images}:
+            set_survey(task_id, info)
+
+
+@router.post("/import", response_model=CvatSyncResponse)
+async def import_archive(
+    archive: UploadFile = File(...),
+    task_id: int | None = Form(None),
+    site: str | None = Form(None),
+    surveyed_on: date | None = Form(None),
+):
+    """Import a CVAT-for-images XML or COCO JSON export zip (offline alternative to /sync).
 
+    `site` and `surveyed_on` record the imported tasks as a survey, as for /sync.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "export.zip"
+        # Spool the upload to disk in chunks; the importer then streams from the zip
+        with path.open("wb") as out:
+            await asyncio.to_thread(shutil.copyfileobj, archive.file, out, 1024 * 1024)
+        result = await asyncio.to_thread(import_export_archive, path, task_id)
+    _record_survey(result, site, surveyed_on)
+    await asyncio.to_thread(refresh_changes)
+    return result
 
-@router.get("/images", response_model=list[CvatImage])
-async def list_images():
-    """Return all previously synced images."""
-    return list(get_cached_images().values())
+
+@router.get("/images", response_model=CvatImagePage)
+async def list_images(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    sort: str = "name",
+    task_id: int | None = None,
+    site: str | None = None,
+    has_annotations: bool | None = None,
+    label: str | None = None,
+    min_weight_g: float | None = None,
+    georeferenced: bool | None = None,
+    fields: str | None = None,
+):
+    """Return one page of synced images, filtered, sorted and projected."""
+    projection = parse_fields(fields)
+    query = dict(
+        limit=limit, cursor=cursor, sort=sort, task_id=task_id, site=site,
+        has_annotations=has_annotations, label=label, min_weight_g=min_weight_g,
+        georeferenced=georeferenced,
+    )
+    response = await cached_json_response(
+        request, f"cvat:images?{request.url.query}",
+        (get_data_version(), get_georef_version(), get_model_version(), get_survey_version()),
+        lambda: query_images(**query, fields=projection),
+    )
+    # Warm frames for this page and the next once the response is sent, before the browser asks for them
+    response.background = BackgroundTask(_warm_listing, query)
+    return response
+
+
+async def _warm_listing(query: dict) -> None:
+    await prefetch_listing(**query)
+    await prefetch_hotspots()
 
 
 @router.get("/annotations/{image_id}", response_model=list[CvatAnnotation])
-async def list_annotations(image_id: int):
-    """Return cached annotations (with pixel areas) for a synced image."""
-    return get_cached_annotations(image_id)
+async def list_annotations(
+    image_id: int,
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=10_000),
+    cursor: str | None = None,
+    label: str | None = None,
+    fields: str | None = None,
+):
+    """Return cached annotations (with pixel areas) for a synced image.
+
+    When `limit` is set and more annotations remain, the next cursor is
+    returned in the X-Next-Cursor header.
+    """
+    if limit is None and cursor is None and label is None and fields is None:
+        return await cached_json_response(
+            request, f"cvat:annotations:{image_id}", get_data_version(),
+            lambda: get_cached_annotations(image_id),
+        )
+
+    def build() -> tuple[list[dict], dict[str, str]]:
+        items, next_cursor = query_annotations(image_id, limit=limit, cursor=cursor, label=label, fields=fields)
+        return items, {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+    return await cached_json_response(
+        request, f"cvat:annotations:{image_id}?{request.url.query}", get_data_version(), build, with_headers=True,
+    )
+
+
+@router.get("/geometry", response_model=GeometryReport)
+async def geometry_report(task_id: int | None = None, site: str | None = None):
+    """Polygon validation counts from ingestion, with the images holding repaired or degenerate shapes."""
+    return get_report(task_id, site)
 
 
 @router.get("/images/{task_id}/frames/{frame}")
 async def get_frame(task_id: int, frame: int):
-    """Proxy a frame image from CVAT."""
-    data, content_type = get_frame_data(task_id, frame)
-    return StreamingResponse(iter([data]), media_type=content_type)
+    """Serve a frame from the local frame cache, fetching it from CVAT on a miss."""
+    path = cached_frame(task_id, frame)
+    record_frame_request(task_id, frame, hit=path is not None)
+    if path is None:
+        path = await asyncio.to_thread(cached_frame_path, task_id, frame)
+    prefetch_neighbours(task_id, frame)
+    return FileResponse(path, media_type=frame_media_type(path), headers={"Cache-Control": "private, max-age=3600"})
+
+
+@router.get("/images/{image_id}/neighbors", response_model=ImageNeighbors)
+async def image_neighbors(image_id: int, radius: int = Query(1, ge=1, le=10)):
+    """Frames within `radius` grid cells of an image in its task's mosaic."""
+    return get_image_neighbors(image_id, radius)
+
+
+@router.get("/tasks/{task_id}/grid", response_model=MosaicGridInfo)
+async def task_grid(task_id: int):
+    """Tile size, grid dimensions and pixel extent of a task's mosaic."""
+    return get_grid_info(task_id)
+
+
+@router.get("/tasks/{task_id}/grid/tiles", response_model=list[int])
+async def task_grid_tiles(task_id: int, x0: int, y0: int, x1: int, y1: int):
+    """Ids of the frames intersecting the mosaic-pixel rectangle [x0, x1) x [y0, y1)."""
+    return tiles_in_rect(task_id, x0, y0, x1, y1)
+
+
+@router.get("/prefetch/stats")
+async def prefetch_stats():
+    """Frame cache hit/miss counters and prefetch queue metrics."""
+    return get_prefetch_stats()
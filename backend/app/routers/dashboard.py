@@ -1,64 +1,113 @@
-from fastapi import APIRouter
+import asyncio
 
-from app.services.cvat_service import get_cached_images, get_cached_annotations
-from app.services.analysis_service import AREA_PER_PIXEL_CM2, WEIGHT_PER_PIXEL_G
-from app.services.geo_service import get_all_georefs, get_map_features, get_global_origin
+from fastapi import APIRouter, Request
+
+from app.models.schemas import WeightUncertainty
+from app.services.change_service import get_changes_version, get_trends
+from app.services.cvat_service import Dataset, get_dataset
+from app.services.density_model import area_cm2, get_model_version, label_weight_g
+from app.services.geo_service import get_all_georefs, get_georef_version, get_map_features, get_global_origin
+from app.services.response_cache import cached_json_response
+from app.services.survey_service import get_survey_version
+from app.services.topojson import negotiate_geo_format, to_topojson
+from app.services.uncertainty_service import get_uncertainty, get_uncertainty_version
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 
+@router.get("/trends")
+async def dashboard_trends(request: Request, site: str | None = None):
+    """Per site: detections and weight per survey over time, and the diffs between surveys."""
+    return await cached_json_response(
+        request, f"dashboard:trends:{site}", get_changes_version(), lambda: get_trends(site),
+    )
+
+
+@router.get("/uncertainty", response_model=WeightUncertainty)
+async def dashboard_uncertainty(request: Request, site: str | None = None):
+    """Monte Carlo weight intervals (surface, buried, total) overall, per survey and per zone."""
+    return await cached_json_response(
+        request, f"dashboard:uncertainty:{site}", get_uncertainty_version(), lambda: get_uncertainty(site),
+    )
+
+
 @router.get("/summary")
-async def dashboard_summary():
-    """Aggregate stats from all cached CVAT data."""
-    images = get_cached_images()
+async def dashboard_summary(request: Request, format: str | None = None, site: str | None = None):
+    """Aggregate stats from all cached CVAT data, or from one site's surveys.
+
+    Detections come as GeoJSON under `geojson`, or as quantised TopoJSON under
+    `topology` with `format=topojson`. Cached per data version.
+    """
+    fmt = negotiate_geo_format(format, request.headers.get("accept", ""))
+    dataset = get_dataset(site)
+    response = await cached_json_response(
+        request, f"dashboard:summary:{fmt}:{site}",
+        (dataset.version, get_georef_version(), get_model_version(), get_survey_version()),
+        lambda: _build_summary(dataset, fmt, site),
+    )
+    response.headers["Vary"] = "Accept-Encoding, Accept"
+    return response
+
+
+async def _build_summary(dataset: Dataset, fmt: str, site: str | None = None) -> dict:
+    """Build the summary payload from one dataset snapshot (or site view of it)."""
+    images = dataset.images
     georefs = get_all_georefs()
 
     total_annotations = 0
-    total_pixel_area = 0.0
+    total_area_cm2 = 0.0
+    total_weight_g = 0.0
+    surveyed_area_cm2 = 0.0
     label_counts: dict[str, int] = {}
     label_area: dict[str, float] = {}
+    label_weight: dict[str, float] = {}
     zones: list[dict] = []
 
     for img_id, img in images.items():
-        annotations = get_cached_annotations(img_id)
-        img_pixel_area = 0.0
-
+        annotations = dataset.annotations_for(img_id)
         for ann in annotations:
-            pa = ann.pixel_area or 0.0
-            img_pixel_area += pa
-            total_annotations += 1
             label_counts[ann.label] = label_counts.get(ann.label, 0) + 1
-            label_area[ann.label] = label_area.get(ann.label, 0.0) + pa
-
-        total_pixel_area += img_pixel_area
+        total_annotations += len(annotations)
+        surveyed_area_cm2 += area_cm2(img.width * img.height, img.task_id)
+
+        img_area_cm2 = 0.0
+        img_weight_g = 0.0
+        for label, px in dataset.label_pixels_for(img_id).items():
+            a = area_cm2(px, img.task_id)
+            w = label_weight_g(label, px, img.task_id)
+            img_area_cm2 += a
+            img_weight_g += w
+            label_area[label] = label_area.get(label, 0.0) + a
+            label_weight[label] = label_weight.get(label, 0.0) + w
+        total_area_cm2 += img_area_cm2
+        total_weight_g += img_weight_g
 
         if annotations:
-            area_cm2 = img_pixel_area * AREA_PER_PIXEL_CM2
-            weight_g = img_pixel_area * WEIGHT_PER_PIXEL_G
             zones.append({
                 "image_id": img_id,
                 "image_name": img.name,
                 "annotation_count": len(annotations),
-                "area_cm2": round(area_cm2, 2),
-                "weight_g": round(weight_g, 2),
-                "weight_kg": round(weight_g / 1000.0, 4),
+                "area_cm2": round(img_area_cm2, 2),
+                "weight_g": round(img_weight_g, 2),
+                "weight_kg": round(img_weight_g / 1000.0, 4),
             })
 
-    total_area_cm2 = total_pixel_area * AREA_PER_PIXEL_CM2
     total_area_m2 = total_area_cm2 / 10_000
-    total_weight_g = total_pixel_area * WEIGHT_PER_PIXEL_G
     total_weight_kg = total_weight_g / 1000.0
 
-    # Surveyed area = sum of all image pixel areas in m²
-    surveyed_pixels = sum(img.width * img.height for img in images.values())
-    surveyed_area_m2 = surveyed_pixels * AREA_PER_PIXEL_CM2 / 10_000
+    # Surveyed area = sum of all image footprints in m²
+    surveyed_area_m2 = surveyed_area_cm2 / 10_000
 
     avg_density_g_per_cm2 = (total_weight_g / total_area_cm2) if total_area_cm2 > 0 else 0
     avg_density_g_per_m2 = avg_density_g_per_cm2 * 10_000
 
-    # Buried plastic estimate: 5x-25x surface visible
-    buried_low = round(total_weight_kg * 5, 2)
-    buried_high = round(total_weight_kg * 25, 2)
+    # Intervals from the uncertainty model (resolution, density and buried fraction sampled)
+    uncertainty = await asyncio.to_thread(get_uncertainty, site)
+    zone_intervals = {z.image_id: z.surface for z in uncertainty.zones}
+    for zone in zones:
+        interval = zone_intervals.get(zone["image_id"])
+        if interval:
+            zone["weight_interval_kg"] = {"low": interval.low_kg, "median": interval.median_kg, "high": interval.high_kg}
 
     # Hotspot = images with > 5 annotations
     hotspot_count = sum(1 for z in zones if z["annotation_count"] > 5)
@@ -69,8 +118,8 @@ async def dashboard_summary():
             {
                 "label": label,
                 "count": label_counts[label],
-                "area_cm2": round(label_area[label] * AREA_PER_PIXEL_CM2, 2),
-                "weight_g": round(label_area[label] * WEIGHT_PER_PIXEL_G, 2),
+                "area_cm2": round(label_area.get(label, 0.0), 2),
+                "weight_g": round(label_weight.get(label, 0.0), 2),
             }
             for label in label_counts
         ],
@@ -91,6 +140,11 @@ async def dashboard_summary():
     # Sort zones by weight descending
     zones.sort(key=lambda z: z["weight_g"], reverse=True)
 
+    if fmt == "topojson":
+        geometry = {"topology": to_topojson(geojson_features)}
+    else:
+        geometry = {"geojson": {"type": "FeatureCollection", "features": [f.model_dump() for f in geojson_features]}}
+
     return {
         "total_annotations": total_annotations,
         "total_area_cm2": round(total_area_cm2, 2),
@@ -99,12 +153,22 @@ async def dashboard_summary():
         "total_weight_kg": round(total_weight_kg, 4),
         "avg_density_g_per_cm2": round(avg_density_g_per_cm2, 6),
         "avg_density_g_per_m2": round(avg_density_g_per_m2, 4),
-        "buried_estimate_kg": {"low": buried_low, "high": buried_high},
+        "weight_interval_kg": {
+            "low": uncertainty.surface.low_kg,
+            "median": uncertainty.surface.median_kg,
+            "high": uncertainty.surface.high_kg,
+        },
+        "buried_estimate_kg": {
+            "low": round(uncertainty.buried.low_kg, 2),
+            "median": round(uncertainty.buried.median_kg, 2),
+            "high": round(uncertainty.buried.high_kg, 2),
+        },
+        "confidence": uncertainty.confidence,
         "hotspot_count": hotspot_count,
         "image_count": len(images),
         "annotation_count": total_annotations,
         "surveyed_area_m2": round(surveyed_area_m2, 4),
         "label_breakdown": label_breakdown,
         "zones": zones[:20],  # top 20 zones
-        "geojson": {"type": "FeatureCollection", "features": [f.model_dump() for f in geojson_features]},
+        **geometry,
     }
@@ -0,0 +1,39 @@
+import asyncio
+import shutil
+import tempfile
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.services.cvat_service import get_dataset
+from app.services.export_service import FORMATS, STREAMING_FORMATS, export_to_file, stream_export
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+
+@router.get("/detections")
+async def export_detections(format: str = "gpkg", site: str | None = None):
+    """Download every georeferenced detection (or one site's) as gpkg, parquet, shp (zipped), geojsonseq or csv."""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    suffix, media_type = FORMATS[format]
+    filename = f"cleanly_detections{suffix}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format in STREAMING_FORMATS:
+        get_dataset(site)  # 404 for an unknown site before the response starts
+        return StreamingResponse(stream_export(format, site=site), media_type=media_type, headers=headers)
+
+    # Binary containers need a seekable file; build it off the event loop, then stream it out
+    tmp = Path(tempfile.mkdtemp())
+    try:
+        await asyncio.to_thread(export_to_file, format, tmp / filename, site)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return FileResponse(
+        tmp / filename, media_type=media_type, filename=filename,
+        background=BackgroundTask(shutil.rmtree, tmp, ignore_errors=True),
+    )
@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 
 from app.models.schemas import (
     GeoCoordinate,
@@ -7,14 +9,22 @@ from app.models.schemas import (
     HeatmapResponse,
     MapFeatureCollection,
 )
+from app.services.change_service import get_change_features, get_changes_version
+from app.services.cvat_service import get_data_version
+from app.services.density_model import get_model_version
 from app.services.geo_service import (
     get_all_georefs,
+    get_georef_version,
     get_global_origin,
     get_heatmap_data,
     get_map_features,
     register_georeference,
     register_global_origin,
 )
+from app.services.mosaic_service import build_mosaic, list_mosaics, tile_path
+from app.services.response_cache import cached_json_response
+from app.services.survey_service import get_survey_version
+from app.services.topojson import negotiate_geo_format, to_topojson
 
 router = APIRouter(prefix="/map", tags=["map"])
 
@@ -39,8 +49,12 @@ async def set_global_origin(req: GlobalOriginRequest):
 
 
 @router.get("/georefs")
-async def get_georefs():
+async def get_georefs(request: Request):
     """Return all image georefs and the current global origin."""
+    return await cached_json_response(request, "map:georefs", get_georef_version(), _build_georefs)
+
+
+def _build_georefs() -> dict:
     georefs = get_all_georefs()
     origin = get_global_origin()
     return {
@@ -53,12 +67,66 @@ async def get_georefs():
 
 
 @router.get("/heatmap", response_model=HeatmapResponse)
-async def get_heatmap():
-    """Return heatmap data for all georeferenced images with annotations."""
-    return get_heatmap_data()
+async def get_heatmap(request: Request, site: str | None = None):
+    """Return heatmap data for all georeferenced images with annotations, or one site's."""
+    return await cached_json_response(
+        request, f"map:heatmap:{site}",
+        (get_data_version(), get_georef_version(), get_model_version(), get_survey_version()),
+        lambda: get_heatmap_data(site),
+    )
+
+
+@router.get("/changes", response_model=MapFeatureCollection)
+async def get_changes_layer(request: Request, site: str, after_task_id: int | None = None, format: str | None = None):
+    """Change layer between a site's survey and the one before it (latest by default).
+
+    Features carry `status`: new, persisting (later survey) or removed (earlier survey).
+    """
+    fmt = negotiate_geo_format(format, request.headers.get("accept", ""))
+
+    def build():
+        collection = get_change_features(site, after_task_id)
+        return to_topojson(collection.features) if fmt == "topojson" else collection
+
+    return await cached_json_response(
+        request, f"map:changes:{site}:{after_task_id}:{fmt}", get_changes_version(), build,
+    )
+
+
+@router.get("/mosaics")
+async def get_mosaics():
+    """List built imagery mosaics (bounds and zoom range) for the map's tile layers."""
+    return list_mosaics()
+
+
+@router.post("/mosaics/{task_id}")
+async def create_mosaic(task_id: int):
+    """Stitch a task's georeferenced frames into an XYZ tile pyramid with overviews."""
+    return await run_in_threadpool(build_mosaic, task_id)
+
+
+@router.get("/tiles/{task_id}/{z}/{x}/{y}.png")
+async def get_tile(task_id: int, z: int, x: int, y: int):
+    """Serve one mosaic tile."""
+    path = tile_path(task_id, z, x, y)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No tile.")
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "public, max-age=3600"})
 
 
 @router.get("/{image_id}", response_model=MapFeatureCollection)
-async def get_map(image_id: int):
-    """Return GeoJSON features for trash detections on the given image."""
-    return await get_map_features(image_id)
+async def get_map(image_id: int, request: Request, format: str | None = None):
+    """Return detections on the given image as GeoJSON, or quantised TopoJSON
+    with `format=topojson` (or an Accept header naming topojson)."""
+    fmt = negotiate_geo_format(format, request.headers.get("accept", ""))
+
+    async def build():
+        collection = await get_map_features(image_id)
+        return to_topojson(collection.features) if fmt == "topojson" else collection
+
+    response = await cached_json_response(
+        request, f"map:{image_id}:{fmt}", (get_data_version(), get_georef_version(), get_model_version()),
+        build,
+    )
+    response.headers["Vary"] = "Accept-Encoding, Accept"
+    return response
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+
+from app.config import settings
+from app.profiling import check_token, list_profiles, profile_path, start_window, stop_window
+
+# Only included when PROFILING_TOKEN is set (see main.py)
+router = APIRouter(prefix="/admin/profiling", tags=["profiling"])
+
+
+def _require_token(token: str | None) -> None:
+    if not check_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token.")
+
+
+@router.post("/window")
+async def profile_window(
+    seconds: float = Query(30.0, gt=0),
+    x_profile_token: str | None = Header(None),
+):
+    """Profile this worker for a time window; the profile is saved when it ends."""
+    _require_token(x_profile_token)
+    if seconds > settings.profiling_max_window_s:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {settings.profiling_max_window_s}")
+    profile_id = start_window(seconds)
+    if profile_id is None:
+        raise HTTPException(status_code=409, detail="A profiling window is already running on this worker.")
+    return {"status": "started", "id": profile_id, "seconds": seconds}
+
+
+@router.delete("/window")
+async def end_profile_window(x_profile_token: str | None = Header(None)):
+    """Stop the running window early and save it."""
+    _require_token(x_profile_token)
+    summary = stop_window()
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No profiling window is running on this worker.")
+    return summary
+
+
+@router.get("/profiles")
+async def get_profiles(x_profile_token: str | None = Header(None)):
+    """Stored profiles, newest first, with seconds per category."""
+    _require_token(x_profile_token)
+    return list_profiles()
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, x_profile_token: str | None = Header(None)):
+    """Download a profile as speedscope JSON."""
+    _require_token(x_profile_token)
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found.")
+    return FileResponse(path, media_type="application/json", filename=f"{profile_id}.speedscope.json")
@@ -0,0 +1,34 @@
+import asyncio
+
+from fastapi import APIRouter
+
+from app.models.schemas import Survey, SurveyChange, SurveyInfo
+from app.services.change_service import get_site_changes
+from app.services.survey_service import delete_survey, get_surveys, set_survey
+
+router = APIRouter(prefix="/surveys", tags=["surveys"])
+
+
+@router.get("", response_model=list[Survey])
+async def list_surveys():
+    """Return every recorded survey, grouped by site and ordered by date."""
+    return get_surveys()
+
+
+@router.get("/changes", response_model=list[SurveyChange])
+async def list_changes(site: str | None = None):
+    """New / removed / persisting detections and weight deltas between consecutive surveys."""
+    return await asyncio.to_thread(get_site_changes, site)
+
+
+@router.put("/{task_id}", response_model=Survey)
+async def update_survey(task_id: int, info: SurveyInfo):
+    """Record which site a CVAT task surveys and when it was flown."""
+    return set_survey(task_id, info)
+
+
+@router.delete("/{task_id}")
+async def remove_survey(task_id: int):
+    """Forget a task's survey metadata (its images and annotations are kept)."""
+    delete_survey(task_id)
+    return {"status": "ok", "task_id": task_id}
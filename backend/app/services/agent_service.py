@@ -1,15 +1,12 @@
+import asyncio
 import json
 
-from openai import AsyncOpenAI
-
-from app.config import settings
-from app.services.cvat_service import get_cached_images, get_cached_annotations
-from app.services.analysis_service import (
-    get_all_results,
-    AREA_PER_PIXEL_CM2,
-    WEIGHT_PER_PIXEL_G,
-)
+from app.services.cvat_service import get_dataset
+from app.services.analysis_service import get_all_results
+from app.services.density_model import area_cm2, weight_g
 from app.services.employee_service import list_employees
+from app.services.llm_gateway import complete
+from app.services.uncertainty_service import get_uncertainty
 
 RACCOON_SYSTEM_PROMPT = """\
 You are Raccoon, a knowledgeable AI assistant for the Cleanly ocean plastic \
@@ -19,10 +16,11 @@ drone-based plastic survey data, plan cleanup operations, and make decisions.
 You will receive a structured data context containing:
 - **Survey totals**: total plastic area (cm² and m²), weight (g and kg), \
 annotation count, surveyed area, and average density.
-- **Buried plastic estimate**: a low–high range representing plastic hidden \
-under sand/vegetation that drones cannot see (30-70% of surface plastic).
+- **Weight uncertainty**: Monte Carlo confidence intervals (low, median, high) \
+for surface weight, buried plastic hidden under sand/vegetation that drones \
+cannot see, and their total, overall and per survey.
 - **Per-zone breakdowns**: each image/zone with its own annotation count, \
-area, and weight.
+area, weight and surface weight interval.
 - **Hotspot summary**: zones ranked by plastic weight.
 - **Employee roster**: team members with roles, skills, and availability.
 - **Map context** (optional): GeoJSON features the user is viewing.
@@ -31,8 +29,9 @@ Guidelines:
 - Use specific numbers from the data. Never make up statistics.
 - Present weights in grams for <1 kg, kilograms otherwise.
 - Present areas in cm² for <10,000 cm², m² otherwise.
-- All weight estimates are surface-visible only. Always remind users that \
-buried plastic (30-70% additional) is not captured by drone imagery.
+- Point weights are surface-visible only. Always remind users that buried \
+plastic is not captured by drone imagery, and quote the buried and total \
+intervals from the weight uncertainty data rather than a point value.
 - For cleanup planning, use ~5 kg/person/hour for accessible coastal debris.
 - When asked about priorities, rank zones by weight descending.
 - If no data is loaded (0 images), tell the user to sync from CVAT first.
@@ -43,26 +42,25 @@ for breakdowns, and headers for sections when appropriate.
 """
 
 
-def _build_full_context() -> dict:
-    """Build a comprehensive data context from all preprocessed backend data."""
-    images = get_cached_images()
+def _build_full_context(site: str | None = None) -> dict:
+    """Build a comprehensive data context from all preprocessed backend data (or one site's)."""
+    dataset = get_dataset(site)
+    images = dataset.images
     results = get_all_results()
 
     zones = []
-    total_pixels = 0.0
+    total_area_cm2 = 0.0
+    total_weight_g = 0.0
+    surveyed_area_cm2 = 0.0
     total_annotations = 0
 
     for img_id, img in images.items():
-        annotations = get_cached_annotations(img_id)
+        annotations = dataset.annotations_for(img_id)
         analysis = results.get(img_id)
 
-        img_pixels = 0.0
-        for ann in annotations:
-            area = ann.pixel_area if ann.pixel_area is not None else 0.0
-            img_pixels += area
-
-        img_area_cm2 = img_pixels * AREA_PER_PIXEL_CM2
-        img_weight_g = img_pixels * WEIGHT_PER_PIXEL_G
+        label_pixels = dataset.label_pixels_for(img_id)
+        img_area_cm2 = area_cm2(sum(label_pixels.values()), img.task_id)
+        img_weight_g = weight_g(label_pixels, img.task_id)
 
         zone = {
             "image_id": img_id,
@@ -84,24 +82,26 @@ def _build_full_context() -> dict:
             }
 
         zones.append(zone)
-        total_pixels += img_pixels
+        total_area_cm2 += img_area_cm2
+        total_weight_g += img_weight_g
+        surveyed_area_cm2 += area_cm2(img.width * img.height, img.task_id)
         total_annotations += len(annotations)
 
-    total_area_cm2 = total_pixels * AREA_PER_PIXEL_CM2
     total_area_m2 = total_area_cm2 / 10_000
-    total_weight_g = total_pixels * WEIGHT_PER_PIXEL_G
     total_weight_kg = total_weight_g / 1000
 
-    surveyed_px = sum(img.width * img.height for img in images.values())
-    surveyed_area_m2 = surveyed_px * AREA_PER_PIXEL_CM2 / 10_000
+    surveyed_area_m2 = surveyed_area_cm2 / 10_000
 
     avg_density_g_per_m2 = (
         total_weight_g / surveyed_area_m2 if surveyed_area_m2 > 0 else 0
     )
 
-    surface_kg = total_weight_kg
-    buried_low = surface_kg * 0.3
-    buried_high = surface_kg * 0.7
+    uncertainty = get_uncertainty(site)
+    zone_intervals = {z.image_id: z.surface for z in uncertainty.zones}
+    for zone in zones:
+        interval = zone_intervals.get(zone["image_id"])
+        if interval:
+            zone["weight_interval_kg"] = [interval.low_kg, interval.high_kg]
 
     hotspots = sorted(zones, key=lambda z: z["weight_g"], reverse=True)[:10]
 
@@ -117,13 +117,15 @@ def _build_full_context() -> dict:
             "surveyed_area_m2": round(surveyed_area_m2, 4),
             "avg_density_g_per_m2": round(avg_density_g_per_m2, 4),
         },
-        "buried_plastic_estimate": {
-            "note": "Drone imagery only captures surface plastic. 30-70% additional plastic is typically buried or hidden.",
-            "surface_kg": round(surface_kg, 4),
-            "buried_low_kg": round(buried_low, 4),
-            "buried_high_kg": round(buried_high, 4),
-            "total_estimated_low_kg": round(surface_kg + buried_low, 4),
-            "total_estimated_high_kg": round(surface_kg + buried_high, 4),
+        "weight_uncertainty": {
+            "note": (
+                f"{uncertainty.confidence:.0%} intervals from {uncertainty.draws} Monte Carlo draws of ground "
+                "resolution, label density and buried fraction. Drone imagery only captures surface plastic."
+            ),
+            "surface": uncertainty.surface.model_dump(),
+            "buried": uncertainty.buried.model_dump(),
+            "total": uncertainty.total.model_dump(),
+            "per_survey": [survey.model_dump(mode="json") for survey in uncertainty.surveys],
         },
         "top_hotspots": hotspots,
         "all_zones": zones,
@@ -134,9 +136,11 @@ async def chat(
     message: str,
     map_context: dict | None = None,
     history: list[dict] | None = None,
+    site: str | None = None,
 ) -> str:
     """Send a user question to GPT-4o with full preprocessed data context."""
-    dataset = _build_full_context()
+    # Walks every image and may run the uncertainty sampling: keep it off the event loop
+    dataset = await asyncio.to_thread(_build_full_context, site)
     employees = await list_employees()
 
     context_parts = [
@@ -186,12 +190,5 @@ async def chat(
             {"role": "user", "content": f"{context_block}\n\n---\n\n**Question:** {message}"}
         )
 
-    client = AsyncOpenAI(api_key=settings.openai_api_key)
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.4,
-        max_tokens=1500,
-    )
-
-    return response.choices[0].message.content
+    # Not cached: conversations are open-ended and sampled at temperature 0.4
+    return await complete(messages, purpose="chat", temperature=0.4, max_tokens=1500)
@@ -1,58 +1,141 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
 from fastapi import HTTPException
-from shapely.geometry import Polygon
 
 from app.models.schemas import AnalysisResult, CvatAnnotation
-from app.services.cvat_service import get_cached_images, get_cached_annotations
-
-# Constants from spec
-GROUND_RESOLUTION_CM = 0.5  # cm per pixel
-AREA_PER_PIXEL_CM2 = GROUND_RESOLUTION_CM ** 2  # 0.25 cm^2/pixel
-SURFACE_DENSITY_G_CM2 = 0.48  # g/cm^2
-WEIGHT_PER_PIXEL_G = AREA_PER_PIXEL_CM2 * SURFACE_DENSITY_G_CM2  # 0.12 g/pixel
+from app.services.cvat_service import Dataset, get_dataset
+from app.services.density_model import area_cm2, label_weight_g
+from app.services.shapes import annotation_pixel_area
+from app.services.store import db_path, file_token, load_json, locked, save_json
 
-# Cache of computed results
-_results: dict[int, AnalysisResult] = {}
+# Results persist as db/analysis.json plus db/analysis.log, where each POST
+# appends its result as one JSON line instead of rewriting every stored result.
+# The log is folded into analysis.json once it holds COMPACT_LINES results
+# (batch runs write analysis.json directly); other workers replay only the
+# lines appended since they last read.
 
+BATCH_CHUNK_SIZE = 64  # images per pool task in batch analysis
+COMPACT_LINES = 1000
+_LOG = "analysis.log"
 
-def _compute_polygon_pixel_area(points: list[list[float]]) -> float:
-    """Compute pixel area of a polygon using Shapely."""
-    if len(points) < 3:
-        return 0.0
-    poly = Polygon(points)
-    return poly.area
+# Cache of computed results; replaced, never mutated, so readers in other threads can iterate it
+_results: dict[int, AnalysisResult] = {}
+# Token of the db/analysis.json this process last loaded or wrote
+_disk_token = None
+# Bytes and results of db/analysis.log already applied to _results
+_log_offset = 0
+_log_lines = 0
 
 
 async def compute_analysis(image_id: int) -> AnalysisResult:
     """Compute trash area and weight for all annotations on an image."""
-    images = get_cached_images()
+    result = _analyze(get_dataset(), image_id)
+    await asyncio.to_thread(_store_results, [result])
+    return result
+
+
+def _analyze(dataset: Dataset, image_id: int) -> AnalysisResult:
+    images = dataset.images
     if image_id not in images:
         raise HTTPException(status_code=404, detail=f"Image {image_id} not found. Run /cvat/sync first.")
 
     image = images[image_id]
-    annotations = get_cached_annotations(image_id)
 
+    # Annotations belong to an immutable snapshot, so store recomputed areas on copies
+    annotations = []
     total_pixels = 0.0
-    for ann in annotations:
-        area = _compute_polygon_pixel_area(ann.points)
-        ann.pixel_area = area
+    weight_g = 0.0
+    for ann in dataset.annotations_for(image_id):
+        area = annotation_pixel_area(ann)
+        annotations.append(ann.model_copy(update={"pixel_area": area}))
         total_pixels += area
+        weight_g += label_weight_g(ann.label, area, image.task_id)
 
-    area_cm2 = total_pixels * AREA_PER_PIXEL_CM2
-    weight_g = total_pixels * WEIGHT_PER_PIXEL_G
     weight_kg = weight_g / 1000.0
 
-    result = AnalysisResult(
+    return AnalysisResult(
         image_id=image_id,
         image_name=image.name,
         total_detected_pixels=total_pixels,
-        area_cm2=area_cm2,
+        area_cm2=area_cm2(total_pixels, image.task_id),
         estimated_weight_g=weight_g,
         estimated_weight_kg=weight_kg,
         annotation_count=len(annotations),
         annotations=annotations,
     )
-    _results[image_id] = result
-    return result
+
+
+def _store_results(results: list[AnalysisResult]) -> None:
+    global _results
+    with locked("analysis.json"):
+        refresh_from_disk()
+        _results = {**_results, **{result.image_id: result for result in results}}
+        if _log_lines + len(results) > COMPACT_LINES:
+            _save_to_disk()
+        else:
+            _append_log(results)
+
+
+def _init_batch_worker() -> None:
+    # Workers read the dataset and density model from db/ (the snapshot is memory-mapped)
+    from app.services import shared_state
+
+    shared_state.load_all()
+
+
+def _analyze_chunk(image_ids: list[int]) -> list[AnalysisResult]:
+    dataset = get_dataset()
+    return [_analyze(dataset, image_id) for image_id in image_ids]
+
+
+def run_batch_analysis(
+    task_ids: list[int] | None = None,
+    workers: int | None = None,
+    chunk_size: int = BATCH_CHUNK_SIZE,
+    progress: Callable[[dict], None] | None = None,
+) -> dict:
+    """Analyse every image (or those of `task_ids`) across a process pool, saving once at the end.
+
+    Returns counts plus elapsed seconds and images per second; `progress`
+    receives the same dict after every chunk.
+    """
+    dataset = get_dataset()
+    image_ids = [
+        image_id for image_id, image in dataset.images.items()
+        if task_ids is None or image.task_id in task_ids
+    ]
+    chunks = [image_ids[i:i + chunk_size] for i in range(0, len(image_ids), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+    stats = {"images": 0, "annotations": 0, "weight_kg": 0.0, "workers": workers, "elapsed_s": 0.0, "images_per_s": 0.0}
+
+    start = time.perf_counter()
+    results: list[AnalysisResult] = []
+
+    def record(chunk: list[AnalysisResult]) -> None:
+        results.extend(chunk)
+        stats["images"] += len(chunk)
+        stats["annotations"] += sum(r.annotation_count for r in chunk)
+        stats["weight_kg"] = round(stats["weight_kg"] + sum(r.estimated_weight_kg for r in chunk), 3)
+        stats["elapsed_s"] = round(time.perf_counter() - start, 3)
+        stats["images_per_s"] = round(stats["images"] / stats["elapsed_s"], 2) if stats["elapsed_s"] else 0.0
+        if progress:
+            progress(dict(stats))
+
+    if workers == 1:
+        for chunk in chunks:
+            record(_analyze_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker) as pool:
+            for chunk in pool.map(_analyze_chunk, chunks):
+                record(chunk)
+
+    if results:
+        _store_results(results)
+    return stats
 
 
 async def get_analysis(image_id: int) -> AnalysisResult:
@@ -64,3 +147,72 @@ async def get_analysis(image_id: int) -> AnalysisResult:
 
 def get_all_results() -> dict[int, AnalysisResult]:
     return _results
+
+
+def load_from_disk() -> None:
+    """Restore _results from db/analysis.json and the results logged since."""
+    global _results, _disk_token, _log_offset, _log_lines
+    _disk_token = file_token("analysis.json")
+    data = load_json("analysis.json")
+    _results = {int(k): AnalysisResult(**v) for k, v in data.get("results", {}).items()}
+    _log_offset = _log_lines = 0
+    _read_log()
+
+
+def refresh_from_disk() -> bool:
+    """Catch up with another worker's writes to db/analysis.json or its log. Returns True if any."""
+    log = file_token(_LOG)
+    log_size = log[2] if log else 0
+    if file_token("analysis.json") != _disk_token or log_size < _log_offset:
+        load_from_disk()
+        return True
+    if log_size > _log_offset:
+        _read_log()
+        return True
+    return False
+
+
+def _read_log() -> None:
+    """Apply the lines of db/analysis.log past _log_offset."""
+    global _results, _log_offset, _log_lines
+    try:
+        with open(db_path(_LOG), "rb") as fh:
+            fh.seek(_log_offset)
+            tail = fh.read()
+    except FileNotFoundError:
+        return
+    end = tail.rfind(b"\n") + 1  # a line still being written is read next time
+    if not end:
+        return
+    results = dict(_results)
+    for line in tail[:end].splitlines():
+        try:
+            result = AnalysisResult.model_validate_json(line)
+        except ValueError:
+            continue  # torn by a crash mid-append
+        results[result.image_id] = result
+        _log_lines += 1
+    _results = results
+    _log_offset += end
+
+
+def _append_log(results: list[AnalysisResult]) -> None:
+    """Append results to db/analysis.log (caller holds the lock and has refreshed)."""
+    global _log_offset, _log_lines
+    data = "".join(result.model_dump_json() + "\n" for result in results).encode()
+    with open(db_path(_LOG), "ab") as fh:
+        fh.write(data)
+    _log_offset += len(data)
+    _log_lines += len(results)
+
+
+def _save_to_disk() -> None:
+    """Persist _results to db/analysis.json, folding in and removing the log."""
+    global _disk_token, _log_offset, _log_lines
+    # Log first: a reader in between sees fewer results until analysis.json lands, never stale ones
+    db_path(_LOG).unlink(missing_ok=True)
+    save_json("analysis.json", {
+        "results": {str(k): v.model_dump() for k, v in _results.items()},
+    })
+    _disk_token = file_token("analysis.json")
+    _log_offset = _log_lines = 0
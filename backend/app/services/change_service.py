@@ -0,0 +1,362 @@
+import hashlib
+import json
+import math
+from dataclasses import dataclass
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.models.schemas import MapFeature, MapFeatureCollection, Survey, SurveyChange, ZoneChange
+from app.services.cvat_service import Dataset, get_dataset
+from app.services.density_model import get_model_version, label_weight_g
+from app.services.geo_service import PROJECTION_VERSION, annotation_ring, get_all_georefs, get_georef_version
+from app.services.store import file_token, load_json, locked, save_json
+from app.services.survey_service import get_survey_version, survey_groups_by_site
+
+# Change detection between consecutive surveys of a site, a survey being every
+# task flown at the site on one day. Detections of both surveys are projected
+# to local metres and spatially joined with an STRtree: an "after" detection
+# within MATCH_TOLERANCE_M of a "before" one persists (one-to-one, same label
+# preferred), unmatched ones are new or removed. Weight deltas are summed per
+# ZONE_SIZE_M grid cell.
+#
+# Diffs are persisted in db/changes.json with a fingerprint of each task's
+# inputs (annotations, georefs, weights, projection version), hashed from the
+# site's view of the dataset; only pairs whose fingerprints changed have their
+# detections projected and joined again.
+
+MATCH_TOLERANCE_M = 1.0  # drone georefs drift between flights
+ZONE_SIZE_M = 10.0
+MAX_ZONES = 50
+_M_PER_DEG = 111_320.0
+
+_changes: dict[str, dict] = {}  # "before ids:after ids" -> {"fingerprint", "change", "status"}
+_checked_version: tuple | None = None  # inputs version the stored diffs were last validated at
+# Token of the db/changes.json this process last loaded or wrote
+_disk_token = None
+
+
+@dataclass
+class _Detection:
+    annotation_id: int
+    label: str
+    weight_g: float
+    ring: list[list[float]]  # closed [[lng, lat], ...]
+
+
+def _task_images(dataset: Dataset) -> dict[int, list[int]]:
+    """Task id -> its image ids, in one pass over a (site view of the) dataset."""
+    tasks: dict[int, list[int]] = {}
+    for image_id, image in dataset.images.items():
+        tasks.setdefault(image.task_id, []).append(image_id)
+    return tasks
+
+
+def _task_detections(dataset: Dataset, image_ids: list[int]) -> list[_Detection]:
+    georefs = get_all_georefs()
+    detections: list[_Detection] = []
+    for image_id in image_ids:
+        image = dataset.images[image_id]
+        if image_id not in georefs:
+            continue
+        for ann in dataset.annotations_for(image_id):
+            if len(ann.points) < 3:
+                continue
+            detections.append(_Detection(
+                annotation_id=ann.id,
+                label=ann.label,
+                weight_g=label_weight_g(ann.label, ann.pixel_area or 0.0, image.task_id),
+                ring=annotation_ring(ann.points, image.width, image.height, georefs[image_id]),
+            ))
+    return detections
+
+
+def _fingerprint(dataset: Dataset, image_ids: list[int]) -> str:
+    """Hash of everything a task's detections are built from; far cheaper than building them."""
+    georefs = get_all_georefs()
+    digest = hashlib.blake2b(digest_size=16)
+    # Diffs stored under an older projection are recomputed
+    digest.update(f"projection:{PROJECTION_VERSION}".encode())
+    for image_id in image_ids:
+        georef = georefs.get(image_id)
+        if georef is None:
+            continue
+        image = dataset.images[image_id]
+        digest.update(f"{image_id}:{image.width}x{image.height}:{georef.model_dump_json()}".encode())
+        for ann in dataset.annotations_for(image_id):
+            if len(ann.points) >= 3:
+                weight = label_weight_g(ann.label, ann.pixel_area or 0.0, image.task_id)
+                digest.update(json.dumps([ann.id, ann.label, weight, ann.points]).encode())
+    return digest.hexdigest()
+
+
+def _inputs_version() -> tuple:
+    return (get_dataset().version, get_georef_version(), get_model_version(), get_survey_version())
+
+
+def _to_local(ring: list[list[float]], lng0: float, lat0: float, cos_lat: float) -> np.ndarray:
+    coords = np.asarray(ring, dtype=np.float64)
+    return np.column_stack((
+        (coords[:, 0] - lng0) * _M_PER_DEG * cos_lat,
+        (coords[:, 1] - lat0) * _M_PER_DEG,
+    ))
+
+
+def _local_polygons(dets: list[_Detection], lng0: float, lat0: float, cos_lat: float) -> np.ndarray:
+    import shapely  # deferred: only change detection needs it
+
+    if not dets:
+        return np.empty(0, dtype=object)
+    rings = [_to_local(d.ring, lng0, lat0, cos_lat) for d in dets]
+    indices = np.repeat(np.arange(len(rings)), [len(r) for r in rings])
+    return shapely.polygons(shapely.linearrings(np.vstack(rings), indices=indices))
+
+
+def _diff(before: list[Survey], after: list[Survey], old: list[_Detection], new: list[_Detection]) -> dict:
+    """Spatially join two surveys' detections and summarise the change."""
+    import shapely
+
+    everything = old + new
+    lng0 = min((p[0] for d in everything for p in d.ring), default=0.0)
+    lat0 = min((p[1] for d in everything for p in d.ring), default=0.0)
+    cos_lat = math.cos(math.radians(lat0))
+    old_geoms = _local_polygons(old, lng0, lat0, cos_lat)
+    new_geoms = _local_polygons(new, lng0, lat0, cos_lat)
+
+    persisting: list[tuple[int, int]] = []
+    if len(old_geoms) and len(new_geoms):
+        tree = shapely.STRtree(old_geoms)
+        new_idx, old_idx = tree.query(new_geoms, predicate="dwithin", distance=MATCH_TOLERANCE_M)
+        distance = shapely.distance(new_geoms[new_idx], old_geoms[old_idx])
+        # Greedy one-to-one: same label first, then closest
+        same_label = np.array([new[i].label == old[j].label for i, j in zip(new_idx, old_idx)], dtype=bool)
+        used_old: set[int] = set()
+        used_new: set[int] = set()
+        for k in np.lexsort((distance, ~same_label)):
+            i, j = int(new_idx[k]), int(old_idx[k])
+            if i in used_new or j in used_old:
+                continue
+            used_new.add(i)
+            used_old.add(j)
+            persisting.append((j, i))
+    matched_old = {j for j, _ in persisting}
+    matched_new = {i for _, i in persisting}
+
+    zones: dict[tuple[int, int], list[float]] = {}
+    for geoms, dets, slot in ((old_geoms, old, 0), (new_geoms, new, 1)):
+        if not len(dets):
+            continue
+        centroids = shapely.get_coordinates(shapely.centroid(geoms))
+        for (x, y), det in zip(centroids, dets):
+            key = (math.floor(x / ZONE_SIZE_M), math.floor(y / ZONE_SIZE_M))
+            zones.setdefault(key, [0.0, 0.0])[slot] += det.weight_g
+
+    zone_changes = [
+        ZoneChange(
+            lat=lat0 + (row + 0.5) * ZONE_SIZE_M / _M_PER_DEG,
+            lng=lng0 + (col + 0.5) * ZONE_SIZE_M / (_M_PER_DEG * cos_lat),
+            weight_before_g=round(w_before, 2),
+            weight_after_g=round(w_after, 2),
+            delta_g=round(w_after - w_before, 2),
+        )
+        for (col, row), (w_before, w_after) in zones.items()
+    ]
+    zone_changes.sort(key=lambda z: abs(z.delta_g), reverse=True)
+
+    weight_before = sum(d.weight_g for d in old)
+    weight_after = sum(d.weight_g for d in new)
+    change = SurveyChange(
+        site=after[0].site,
+        before_task_ids=[s.task_id for s in before],
+        after_task_ids=[s.task_id for s in after],
+        before_date=before[0].surveyed_on,
+        after_date=after[0].surveyed_on,
+        new=len(new) - len(matched_new),
+        removed=len(old) - len(matched_old),
+        persisting=len(persisting),
+        weight_before_g=round(weight_before, 2),
+        weight_after_g=round(weight_after, 2),
+        delta_g=round(weight_after - weight_before, 2),
+        zones=zone_changes[:MAX_ZONES],
+    )
+    return {
+        "change": change.model_dump(mode="json"),
+        "status": {
+            "new": [d.annotation_id for i, d in enumerate(new) if i not in matched_new],
+            "removed": [d.annotation_id for j, d in enumerate(old) if j not in matched_old],
+            "persisting": [[old[j].annotation_id, new[i].annotation_id] for j, i in persisting],
+        },
+    }
+
+
+def _pair_key(before: list[Survey], after: list[Survey]) -> str:
+    return ":".join(",".join(str(s.task_id) for s in survey) for survey in (before, after))
+
+
+def _pairs(site: str | None = None) -> list[tuple[list[Survey], list[Survey]]]:
+    sites = survey_groups_by_site()
+    if site is not None and site not in sites:
+        raise HTTPException(status_code=404, detail=f"Unknown site {site!r}.")
+    selected = [sites[site]] if site is not None else sites.values()
+    return [(a, b) for surveys in selected for a, b in zip(surveys, surveys[1:])]
+
+
+def refresh_changes() -> int:
+    """Recompute the diffs whose inputs changed since they were stored. Returns how many."""
+    global _changes, _checked_version
+    version = _inputs_version()
+    if version == _checked_version:
+        return 0
+    with locked("changes.json"):
+        refresh_from_disk()
+        changes = {}
+        recomputed = 0
+        for site, surveys in survey_groups_by_site().items():
+            if len(surveys) < 2:
+                continue
+            dataset = get_dataset(site)
+            task_images = _task_images(dataset)
+            fingerprints = {
+                s.task_id: _fingerprint(dataset, task_images.get(s.task_id, [])) for survey in surveys for s in survey
+            }
+            detections: dict[int, list[_Detection]] = {}
+            for before, after in zip(surveys, surveys[1:]):
+                key = _pair_key(before, after)
+                fingerprint = [
+                    [fingerprints[s.task_id] for s in before], [fingerprints[s.task_id] for s in after],
+                    before[0].surveyed_on.isoformat(), after[0].surveyed_on.isoformat(),
+                ]
+                stored = _changes.get(key)
+                if stored is not None and stored["fingerprint"] == fingerprint:
+                    changes[key] = stored
+                    continue
+                for s in before + after:
+                    if s.task_id not in detections:
+                        detections[s.task_id] = _task_detections(dataset, task_images.get(s.task_id, []))
+                changes[key] = {
+                    "fingerprint": fingerprint,
+                    **_diff(
+                        before, after,
+                        [d for s in before for d in detections[s.task_id]],
+                        [d for s in after for d in detections[s.task_id]],
+                    ),
+                }
+                recomputed += 1
+        if recomputed or changes.keys() != _changes.keys():
+            _changes = changes
+            _save_to_disk()
+        _checked_version = version
+    return recomputed
+
+
+def get_site_changes(site: str | None = None) -> list[SurveyChange]:
+    """Diffs between consecutive surveys, for one site or all of them."""
+    refresh_changes()
+    return [
+        SurveyChange(**_changes[_pair_key(a, b)]["change"])
+        for a, b in _pairs(site)
+        if _pair_key(a, b) in _changes
+    ]
+
+
+def get_change_features(site: str, after_task_id: int | None = None) -> MapFeatureCollection:
+    """Map layer of one diff: new and persisting detections of the later survey,
+    removed ones of the earlier survey, tagged by `status`. `after_task_id` picks
+    the diff whose later survey includes that task; default the latest."""
+    refresh_changes()
+    pairs = _pairs(site)
+    if after_task_id is not None:
+        pairs = [p for p in pairs if any(s.task_id == after_task_id for s in p[1])]
+    if not pairs:
+        raise HTTPException(status_code=404, detail=f"No survey pair for site {site!r}.")
+    before, after = pairs[-1]
+    entry = _changes.get(_pair_key(before, after))
+    if entry is None:
+        return MapFeatureCollection(features=[])
+
+    status = entry["status"]
+    after_status = {ann_id: "new" for ann_id in status["new"]}
+    after_status.update({after_id: "persisting" for _, after_id in status["persisting"]})
+    removed = set(status["removed"])
+
+    features: list[MapFeature] = []
+    removed_status = {ann_id: "removed" for ann_id in removed}
+    dataset = get_dataset(site)
+    task_images = _task_images(dataset)
+    for survey, wanted in [(s, after_status) for s in after] + [(s, removed_status) for s in before]:
+        for det in _task_detections(dataset, task_images.get(survey.task_id, [])):
+            if det.annotation_id not in wanted:
+                continue
+            features.append(MapFeature(
+                geometry={"type": "Polygon", "coordinates": [det.ring]},
+                properties={
+                    "annotation_id": det.annotation_id,
+                    "label": det.label,
+                    "weight_g": det.weight_g,
+                    "status": wanted[det.annotation_id],
+                    "task_id": survey.task_id,
+                    "surveyed_on": survey.surveyed_on.isoformat(),
+                },
+            ))
+    return MapFeatureCollection(features=features)
+
+
+def get_trends(site: str | None = None) -> list[dict]:
+    """Per site (or just `site`): totals per survey in date order, and the diffs between them."""
+    changes = get_site_changes(site)
+    by_site: dict[str, list[SurveyChange]] = {}
+    for change in changes:
+        by_site.setdefault(change.site, []).append(change)
+
+    dataset = get_dataset(site)
+    task_totals: dict[int, list[float]] = {}
+    for image_id, image in dataset.images.items():
+        totals = task_totals.setdefault(image.task_id, [0, 0.0])
+        for label, px in dataset.label_pixels_for(image_id).items():
+            totals[1] += label_weight_g(label, px, image.task_id)
+        totals[0] += len(dataset.annotations_for(image_id))
+
+    return [
+        {
+            "site": name,
+            "surveys": [
+                {
+                    "task_ids": [s.task_id for s in survey],
+                    "surveyed_on": survey[0].surveyed_on.isoformat(),
+                    "detections": int(sum(task_totals.get(s.task_id, [0, 0.0])[0] for s in survey)),
+                    "weight_g": round(sum(task_totals.get(s.task_id, [0, 0.0])[1] for s in survey), 2),
+                }
+                for survey in surveys
+            ],
+            "changes": [c.model_dump(mode="json", exclude={"zones"}) for c in by_site.get(name, [])],
+        }
+        for name, surveys in survey_groups_by_site().items()
+        if site is None or name == site
+    ]
+
+
+def get_changes_version() -> tuple:
+    """Version key for response caches built from diffs."""
+    return _inputs_version()
+
+
+def load_from_disk() -> None:
+    """Restore stored diffs from db/changes.json."""
+    global _changes, _disk_token, _checked_version
+    _disk_token = file_token("changes.json")
+    _changes = load_json("changes.json").get("changes", {})
+    _checked_version = None
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/changes.json. Returns True on reload."""
+    if file_token("changes.json") == _disk_token:
+        return False
+    load_from_disk()
+    return True
+
+
+def _save_to_disk() -> None:
+    global _disk_token
+    save_json("changes.json", {"changes": _changes})
+    _disk_token = file_token("changes.json")
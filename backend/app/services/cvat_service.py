@@ -1,17 +1,125 @@
-from cvat_sdk.api_client import ApiClient, Configuration
-from cvat_sdk.api_client.api import tasks_api, labels_api
-from shapely.geometry import Polygon
+import asyncio
+import json
+import os
+import random
+import shutil
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Mapping, TypeVar
+
+import ijson
+import numpy as np
 
 from app.config import settings
 from app.models.schemas import CvatImage, CvatAnnotation, CvatSyncResponse
-from app.services.store import load_json, save_json
+from app.services import geometry_service, partitions
+from app.services.shapes import shape_geometry
+from app.services.snapshot_columns import encode_dataset, open_dataset
+from app.services.store import FileToken, db_path, file_token, load_columns, load_json, locked, save_columns
+from app.services.survey_service import get_survey_version, site_task_ids
+
+if TYPE_CHECKING:
+    from cvat_sdk.api_client import ApiClient
+
+# cvat_sdk is imported inside the functions that talk to CVAT: it is large, and
+# workers that only serve reads from the snapshot never need it.
+
+# The dataset is persisted as a memory-mapped columnar snapshot; cvat.json is
+# only read to seed it (e.g. the committed sample data) when there is no
+# snapshot, so a touched or checked-out cvat.json never overwrites synced data
+# (delete cvat.snap to re-seed). Once saved, the published dataset is served
+# from the snapshot too, so objects are only built for the site partitions
+# being read and evicted under settings.partition_memory_mb (see partitions.py).
+_SNAPSHOT = "cvat.snap"
+
+# Sync fetches annotations per CVAT job and stream-parses each response, so a
+# task's raw annotation payload is never held in memory. Every
+# finished job is checkpointed under db/sync/<task_id>/ (its shapes as JSON
+# lines plus the job's updated_date); an interrupted sync resumes with the jobs
+# not yet on disk. Transient request failures are retried with backoff.
+SYNC_DIR = db_path("sync")
+SYNC_RETRIES = 5
+SYNC_BACKOFF_S = 1.0
+_JOBS_PAGE_SIZE = 100
+
+_T = TypeVar("_T")
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """Immutable snapshot of synced images and annotations.
+
+    Writers build a new Dataset off to the side and swap it in with a single
+    assignment; readers call get_dataset() once and iterate that snapshot
+    without locks. A replaced snapshot is freed as soon as its last reader
+    drops the reference.
+    """
+
+    version: int  # keys response caches and indexes
+    images: Mapping[int, CvatImage]
+    annotations: Mapping[int, list[CvatAnnotation]]  # keyed by image_id; treat lists as read-only
+    # Per-image, per-label pixel sums; the density model works from these alone
+    label_pixels: Mapping[int, Mapping[str, float]]
+    # Token of the db/cvat.snap holding exactly this data (None until saved);
+    # keys indexes persisted alongside it
+    snapshot_token: FileToken | None = None
+
+    def annotations_for(self, image_id: int) -> list[CvatAnnotation]:
+        return self.annotations.get(image_id, [])
+
+    def label_pixels_for(self, image_id: int) -> Mapping[str, float]:
+        return self.label_pixels.get(image_id, _EMPTY)
+
+
+_EMPTY: Mapping = MappingProxyType({})
+
+
+class _Subset(Mapping):
+    """Read-only view of the keys of `parent` listed in the sorted `ids` array."""
+
+    def __init__(self, parent: Mapping, ids: np.ndarray):
+        self._parent = parent
+        self._ids = ids
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self._parent[key]
+
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, (int, np.integer)):
+            return False
+        i = int(np.searchsorted(self._ids, key))
+        return i < len(self._ids) and self._ids[i] == key
+
+    def __iter__(self):
+        return iter(self._ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def _keys_for_tasks(mapping: Mapping, images: Mapping[int, CvatImage], task_ids: set[int]) -> np.ndarray:
+    if hasattr(mapping, "ids_for_tasks"):
+        return mapping.ids_for_tasks(task_ids)  # snapshot columns: no objects built
+    return np.array(sorted(k for k in mapping if images[k].task_id in task_ids), dtype=np.int64)
+
 
 # In-memory cache of synced data (replace with DB later)
-_images: dict[int, CvatImage] = {}
-_annotations: dict[int, list[CvatAnnotation]] = {}  # keyed by image_id
+_dataset = Dataset(version=0, images=_EMPTY, annotations=_EMPTY, label_pixels=_EMPTY)
+# Token of the db/cvat.snap this process last loaded or wrote
+_disk_token = None
+# Partition generation of the snapshot _dataset is served from
+_generation: int | None = None
+# Site -> (dataset version, survey version, view of that site)
+_site_views: dict[str, tuple[int, int, Dataset]] = {}
 
 
-def _get_cvat_client() -> ApiClient:
+def _get_cvat_client() -> "ApiClient":
+    from cvat_sdk.api_client import ApiClient, Configuration
+
     config = Configuration(
         host=settings.cvat_base_url,
         username=settings.cvat_username,
@@ -20,111 +128,351 @@ def _get_cvat_client() -> ApiClient:
     return ApiClient(configuration=config)
 
 
-async def sync_cvat_data(task_id: int | None = None) -> CvatSyncResponse:
-    """Pull images and annotations from CVAT and store in memory."""
-    client = _get_cvat_client()
+async def sync_cvat_data(
+    task_id: int | None = None,
+    progress: Callable[[int, int, int], None] | None = None,
+) -> CvatSyncResponse:
+    """Pull images and annotations from CVAT, replacing only the tasks pulled.
+
+    Each task is published as soon as all its jobs are fetched. An interrupted
+    sync resumes from the job checkpoints of the task it was pulling.
+    `progress(task_id, jobs_done, jobs_total)` is called after each job.
+    """
+    return await asyncio.to_thread(_sync_tasks, task_id, progress)
+
+
+def _with_retries(call: Callable[[], _T]) -> _T:
+    """Run a CVAT request, retrying transient failures with exponential backoff."""
+    from cvat_sdk.api_client.exceptions import ApiException
+    from urllib3.exceptions import HTTPError
+
+    for attempt in range(SYNC_RETRIES + 1):
+        try:
+            return call()
+        except (ApiException, HTTPError, OSError) as exc:
+            status = getattr(exc, "status", None)
+            transient = status is None or status >= 500 or status == 429
+            if not transient or attempt == SYNC_RETRIES:
+                raise
+            time.sleep(SYNC_BACKOFF_S * 2**attempt * random.uniform(0.5, 1.5))
+    raise AssertionError("unreachable")
+
+
+@dataclass(frozen=True)
+class _Job:
+    id: int
+    updated: str
+    first_frame: int  # first frame this job owns (overlapping frames go to the earlier job)
+    stop_frame: int
+
+
+def _list_jobs(client: "ApiClient", task_id: int) -> list[_Job]:
+    from cvat_sdk.api_client.api import jobs_api
+
+    jobs_client = jobs_api.JobsApi(client)
+    jobs = []
+    page = 1
+    while True:
+        result, _ = _with_retries(lambda: jobs_client.list(task_id=task_id, page=page, page_size=_JOBS_PAGE_SIZE))
+        # Ground-truth / consensus jobs duplicate frames of the annotation jobs
+        jobs.extend(j for j in result.results if str(j.type) == "annotation")
+        if not result.next:
+            break
+        page += 1
+
+    owned: list[_Job] = []
+    next_free = 0
+    for job in sorted(jobs, key=lambda j: j.start_frame):
+        owned.append(_Job(
+            id=job.id,
+            updated=str(job.updated_date),
+            first_frame=max(job.start_frame, next_free),
+            stop_frame=job.stop_frame,
+        ))
+        next_free = max(next_free, job.stop_frame + 1)
+    return owned
+
+
+def _fetch_job(client: "ApiClient", task_id: int, job: _Job, label_map: dict[int, str], path: Path) -> int:
+    """Stream one job's shapes to a JSON-lines checkpoint file. Returns the shape count."""
+    from cvat_sdk.api_client.api import jobs_api
+
+    jobs_client = jobs_api.JobsApi(client)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    count = 0
+    # Unparsed response: shapes are decoded one at a time straight off the socket
+    _, response = jobs_client.retrieve_annotations(job.id, _parse_response=False)
+    try:
+        with tmp.open("w") as out:
+            for shape in ijson.items(response, "shapes.item", use_float=True):
+                if not job.first_frame <= shape["frame"] <= job.stop_frame:
+                    continue
+                points, pixel_area = shape_geometry(shape["type"], shape["points"])
+                ann = CvatAnnotation(
+                    id=shape["id"],
+                    image_id=task_id * 100000 + shape["frame"],
+                    label=label_map.get(shape["label_id"], str(shape["label_id"])),
+                    points=points,
+                    pixel_area=pixel_area,
+                    shape_type=shape["type"],
+                )
+                out.write(ann.model_dump_json() + "\n")
+                count += 1
+        os.replace(tmp, path)
+    finally:
+        response.release_conn()
+        tmp.unlink(missing_ok=True)
+    return count
+
+
+def _sync_task(
+    client: "ApiClient",
+    task_id: int,
+    progress: Callable[[int, int, int], None] | None,
+) -> tuple[dict[int, CvatImage], dict[int, list[CvatAnnotation]]]:
+    from cvat_sdk.api_client.api import labels_api, tasks_api
 
     tasks_client = tasks_api.TasksApi(client)
+    labels_client = labels_api.LabelsApi(client)
+    label_list, _ = _with_retries(lambda: labels_client.list(task_id=task_id))
+    label_map: dict[int, str] = {lbl.id: lbl.name for lbl in label_list.results}
 
-    if task_id:
-        task_ids = [task_id]
-    else:
-        tasks_list, _ = tasks_client.list()
-        task_ids = [t.id for t in tasks_list.results]
-
-    # Clear stale cache for tasks being re-synced
-    _images.clear()
-    _annotations.clear()
-
-    synced_images: list[CvatImage] = []
-    total_annotations = 0
-
-    for tid in task_ids:
-        # Get labels for this task via the labels API
-        labels_client = labels_api.LabelsApi(client)
-        label_list, _ = labels_client.list(task_id=tid)
-        label_map: dict[int, str] = {}
-        for lbl in label_list.results:
-            label_map[lbl.id] = lbl.name
-
-        # Get task data (frames/images)
-        task_data, _ = tasks_client.retrieve_data_meta(tid)
-        for frame_idx, frame in enumerate(task_data.frames):
-            # Use task_id * 100000 + frame_index for a stable unique ID
-            frame_id = tid * 100000 + frame_idx
-            img = CvatImage(
-                id=frame_id,
-                name=frame.name,
-                width=frame.width,
-                height=frame.height,
-                task_id=tid,
-            )
-            _images[img.id] = img
-            synced_images.append(img)
-
-        # Get annotations — use the same synthetic ID as images
-        annotations_data, _ = tasks_client.retrieve_annotations(tid)
-        for shape in annotations_data.shapes:
-            image_id = tid * 100000 + shape.frame
-            points = _parse_points(shape.points)
-            pixel_area = _compute_pixel_area(points)
-            ann = CvatAnnotation(
-                id=shape.id,
-                image_id=image_id,
-                label=label_map.get(shape.label_id, str(shape.label_id)),
-                points=points,
-                pixel_area=pixel_area,
-            )
-            _annotations.setdefault(image_id, []).append(ann)
-            total_annotations += 1
+    # Use task_id * 100000 + frame_index for a stable unique ID
+    task_data, _ = _with_retries(lambda: tasks_client.retrieve_data_meta(task_id))
+    images = {
+        task_id * 100000 + idx: CvatImage(
+            id=task_id * 100000 + idx, name=frame.name, width=frame.width, height=frame.height, task_id=task_id,
+        )
+        for idx, frame in enumerate(task_data.frames)
+    }
+
+    # Jobs already on disk with an unchanged updated_date are not fetched again
+    task_dir = SYNC_DIR / str(task_id)
+    task_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = task_dir / "checkpoint.json"
+    try:
+        done: dict[str, str] = json.loads(checkpoint_path.read_text())
+    except (OSError, json.JSONDecodeError):
+        done = {}
+
+    jobs = _list_jobs(client, task_id)
+    for i, job in enumerate(jobs, 1):
+        path = task_dir / f"job-{job.id}.jsonl"
+        if done.get(str(job.id)) != job.updated or not path.exists():
+            _with_retries(lambda: _fetch_job(client, task_id, job, label_map, path))
+            done[str(job.id)] = job.updated
+            tmp = checkpoint_path.with_name(f".checkpoint.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(done))
+            os.replace(tmp, checkpoint_path)
+        if progress:
+            progress(task_id, i, len(jobs))
+
+    annotations: dict[int, list[CvatAnnotation]] = {}
+    for job in jobs:
+        with (task_dir / f"job-{job.id}.jsonl").open() as fh:
+            for line in fh:
+                ann = CvatAnnotation.model_validate_json(line)
+                annotations.setdefault(ann.image_id, []).append(ann)
+    return images, annotations
+
+
+def _sync_tasks(task_id: int | None, progress: Callable[[int, int, int], None] | None) -> CvatSyncResponse:
+    client = _get_cvat_client()
+    try:
+        if task_id:
+            task_ids = [task_id]
+        else:
+            from cvat_sdk.api_client.api import tasks_api
+
+            tasks_client = tasks_api.TasksApi(client)
+            tasks_list, _ = _with_retries(tasks_client.list)
+            task_ids = [t.id for t in tasks_list.results]
+
+        images: dict[int, CvatImage] = {}
+        annotations_count = 0
+        for tid in task_ids:
+            task_images, task_annotations = _sync_task(client, tid, progress)
+            # Each task is published once pulled, so only one task's shapes are held at a
+            # time and a failure later in the run keeps it. Only the synced task is
+            # replaced; earlier surveys (other tasks) are kept.
+            replace_tasks({tid}, task_images, task_annotations)
+            shutil.rmtree(SYNC_DIR / str(tid), ignore_errors=True)
+            images.update(task_images)
+            annotations_count += sum(len(anns) for anns in task_annotations.values())
+    finally:
+        client.close()
+
+    return CvatSyncResponse(images=list(images.values()), annotations_count=annotations_count)
 
-    client.close()
-    _save_to_disk()
-    return CvatSyncResponse(images=synced_images, annotations_count=total_annotations)
 
+def _publish(images: dict[int, CvatImage], annotations: dict[int, list[CvatAnnotation]]) -> None:
+    """Atomically replace the current dataset with a new version."""
+    label_pixels: dict[int, Mapping[str, float]] = {}
+    for image_id, anns in annotations.items():
+        sums: dict[str, float] = {}
+        for ann in anns:
+            sums[ann.label] = sums.get(ann.label, 0.0) + (ann.pixel_area or 0.0)
+        label_pixels[image_id] = MappingProxyType(sums)
+    _swap(MappingProxyType(images), MappingProxyType(annotations), MappingProxyType(label_pixels))
 
-def _parse_points(flat_points: list[float]) -> list[list[float]]:
-    """Convert CVAT flat [x1,y1,x2,y2,...] to [[x1,y1],[x2,y2],...]."""
-    return [[flat_points[i], flat_points[i + 1]] for i in range(0, len(flat_points), 2)]
 
+def _swap(
+    images: Mapping[int, CvatImage],
+    annotations: Mapping[int, list[CvatAnnotation]],
+    label_pixels: Mapping[int, Mapping[str, float]],
+    snapshot_token: FileToken | None = None,
+) -> None:
+    global _dataset
+    _dataset = Dataset(
+        version=_dataset.version + 1,
+        images=images,
+        annotations=annotations,
+        label_pixels=label_pixels,
+        snapshot_token=snapshot_token,
+    )
+
+
+def replace_tasks(
+    task_ids: set[int],
+    images: dict[int, CvatImage],
+    annotations: dict[int, list[CvatAnnotation]],
+) -> None:
+    """Publish a dataset where the given tasks are replaced and all other tasks are kept."""
+    geometry = geometry_service.validate_annotations(images, annotations)
+    with locked(_SNAPSHOT):
+        refresh_from_disk()
+        current = _dataset
+        merged_images = {k: v for k, v in current.images.items() if v.task_id not in task_ids}
+        merged_annotations = {k: v for k, v in current.annotations.items() if k in merged_images}
+        merged_images.update(images)
+        merged_annotations.update(annotations)
+        _publish(merged_images, merged_annotations)
+        _save_to_disk()
+    geometry_service.record(task_ids, geometry)
+
+
+def set_proposed_annotations(proposals: dict[int, list[CvatAnnotation]]) -> None:
+    """Replace the proposed shapes of the given images, keeping their human annotations."""
+    with locked(_SNAPSHOT):
+        refresh_from_disk()
+        current = _dataset
+        annotations = dict(current.annotations)
+        for image_id, proposed in proposals.items():
+            if image_id not in current.images:
+                continue
+            kept = [a for a in current.annotations_for(image_id) if not a.proposed]
+            if kept or proposed:
+                annotations[image_id] = kept + proposed
+            else:
+                annotations.pop(image_id, None)
+        _publish(dict(current.images), annotations)
+        _save_to_disk()
+
+
+def get_dataset(site: str | None = None) -> Dataset:
+    """Return the current snapshot. Hold on to it for a consistent multi-step read.
+
+    With `site`, the view holds only that site's surveys (404 for an unknown
+    site); other sites' partitions are never touched through it.
+    """
+    dataset = _dataset
+    if site is None:
+        return dataset
+    cached = _site_views.get(site)
+    if cached is not None and cached[:2] == (dataset.version, get_survey_version()):
+        return cached[2]
+    task_ids = site_task_ids(site)
+    images = dataset.images
+    view = Dataset(
+        version=dataset.version,
+        images=_Subset(images, _keys_for_tasks(images, images, task_ids)),
+        annotations=_Subset(dataset.annotations, _keys_for_tasks(dataset.annotations, images, task_ids)),
+        label_pixels=_Subset(dataset.label_pixels, _keys_for_tasks(dataset.label_pixels, images, task_ids)),
+    )
+    _site_views[site] = (dataset.version, get_survey_version(), view)
+    return view
 
-def _compute_pixel_area(points: list[list[float]]) -> float:
-    """Compute pixel area of a polygon using Shapely."""
-    if len(points) < 3:
-        return 0.0
-    return Polygon(points).area
 
+def get_data_version() -> int:
+    """Return a counter that changes whenever synced images/annotations change."""
+    return _dataset.version
 
-def get_cached_images() -> dict[int, CvatImage]:
-    return _images
+
+def get_cached_images() -> Mapping[int, CvatImage]:
+    return _dataset.images
 
 
 def get_cached_annotations(image_id: int) -> list[CvatAnnotation]:
-    return _annotations.get(image_id, [])
+    return _dataset.annotations_for(image_id)
 
 
 def load_from_disk() -> None:
-    """Restore _images and _annotations from db/cvat.json."""
-    data = load_json("cvat.json")
-    for k, v in data.get("images", {}).items():
-        _images[int(k)] = CvatImage(**v)
-    for k, anns in data.get("annotations", {}).items():
-        _annotations[int(k)] = [CvatAnnotation(**a) for a in anns]
+    """Restore the dataset from db/cvat.snap, seeding it from db/cvat.json if there is no snapshot yet.
+
+    The snapshot is memory-mapped, so this costs the same whatever the data size;
+    images and annotations are decoded on first access.
+    """
+    global _disk_token
+    snap_token = file_token(_SNAPSHOT)
+    snapshot = load_columns(_SNAPSHOT) if snap_token is not None else None
+    if snapshot is None and file_token("cvat.json") is not None:
+        data = load_json("cvat.json")
+        images = {int(k): CvatImage(**v) for k, v in data.get("images", {}).items()}
+        annotations = {
+            int(k): [CvatAnnotation(**a) for a in anns]
+            for k, anns in data.get("annotations", {}).items()
+        }
+        geometry = geometry_service.validate_annotations(images, annotations)
+        _publish(images, annotations)
+        _save_to_disk()
+        geometry_service.record(None, geometry)
+        return
+
+    _disk_token = snap_token
+    if snapshot is None:
+        _publish({}, {})
+        return
+    _swap(*_open(snapshot), snapshot_token=snap_token)
+
+
+def _open(snapshot: tuple[dict[str, np.ndarray], dict]) -> tuple[Mapping, Mapping, Mapping]:
+    """Lazy mappings over a loaded snapshot, in a new partition generation replacing the previous one."""
+    global _generation
+    if _generation is not None:
+        partitions.release(_generation)
+    _generation = partitions.new_generation()
+    return open_dataset(*snapshot, _generation)
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/cvat.snap. Returns True on reload."""
+    if file_token(_SNAPSHOT) == _disk_token:
+        return False
+    load_from_disk()
+    return True
 
 
 def _save_to_disk() -> None:
-    """Persist _images and _annotations to db/cvat.json."""
-    save_json("cvat.json", {
-        "images": {str(k): v.model_dump() for k, v in _images.items()},
-        "annotations": {
-            str(k): [a.model_dump() for a in anns]
-            for k, anns in _annotations.items()
-        },
-    })
+    """Persist the current dataset to db/cvat.snap."""
+    global _dataset, _disk_token
+    dataset = _dataset
+    arrays, meta = encode_dataset(dataset.images, dataset.annotations, dataset.label_pixels)
+    save_columns(_SNAPSHOT, arrays, meta)
+    _disk_token = file_token(_SNAPSHOT)
+    snapshot = load_columns(_SNAPSHOT)
+    if _dataset is dataset and snapshot is not None:
+        # Same data and version, now served from (and tied to) the file it was
+        # saved to; the dicts it was built from are freed
+        images, annotations, label_pixels = _open(snapshot)
+        _dataset = replace(
+            dataset, images=images, annotations=annotations, label_pixels=label_pixels, snapshot_token=_disk_token,
+        )
 
 
 def get_frame_data(task_id: int, frame: int) -> tuple[bytes, str]:
     """Fetch a frame image from CVAT and return (bytes, content_type)."""
+    from cvat_sdk.api_client.api import tasks_api
+
     client = _get_cvat_client()
     tasks_client = tasks_api.TasksApi(client)
     _, response = tasks_client.retrieve_data(
@@ -0,0 +1,95 @@
+from typing import Mapping
+
+from app.models.schemas import DensityModel, SiteDensityOverride
+from app.services.store import file_token, load_json, locked, save_json
+from app.services.survey_service import get_survey, get_survey_version
+
+# Converts detected pixels into area and weight. Ground resolution and surface
+# density come from one configurable model (per label, optionally per site),
+# persisted in db/density_model.json. Callers pass per-image label pixel sums,
+# so changing a coefficient re-estimates everything in O(images x labels)
+# without touching polygons. Callers also pass the image's task; its site comes
+# from the task's survey, so every survey of a site shares the site's overrides.
+
+_model = DensityModel()
+# Bumped whenever the model changes; keys response caches and indexes
+_version = 0
+# Token of the db/density_model.json this process last loaded or wrote
+_disk_token = None
+
+
+def get_density_model() -> DensityModel:
+    return _model
+
+
+def get_model_version() -> tuple[int, int]:
+    """Return a version that changes whenever the density model, or the task -> site mapping it uses, changes."""
+    return (_version, get_survey_version())
+
+
+def set_density_model(model: DensityModel) -> DensityModel:
+    """Replace the density model and persist it."""
+    global _model, _version
+    with locked("density_model.json"):
+        _model = model
+        _version += 1
+        _save_to_disk()
+    return _model
+
+
+def _site_override(task_id: int | None) -> SiteDensityOverride | None:
+    """Overrides for the site of a task's survey; None for tasks with no survey recorded."""
+    survey = get_survey(task_id) if task_id is not None else None
+    return _model.site_overrides.get(survey.site) if survey else None
+
+
+def resolution_cm(task_id: int | None = None) -> float:
+    """Ground resolution (cm per pixel) for a task's site, falling back to the global value."""
+    override = _site_override(task_id)
+    if override and override.ground_resolution_cm is not None:
+        return override.ground_resolution_cm
+    return _model.ground_resolution_cm
+
+
+def density_g_cm2(label: str, task_id: int | None = None) -> float:
+    """Surface density for a label at a task's site: site label, then global label, then default."""
+    override = _site_override(task_id)
+    if override and label in override.label_density_g_cm2:
+        return override.label_density_g_cm2[label]
+    return _model.label_density_g_cm2.get(label, _model.default_density_g_cm2)
+
+
+def area_cm2(pixels: float, task_id: int | None = None) -> float:
+    return pixels * resolution_cm(task_id) ** 2
+
+
+def label_weight_g(label: str, pixels: float, task_id: int | None = None) -> float:
+    return area_cm2(pixels, task_id) * density_g_cm2(label, task_id)
+
+
+def weight_g(label_pixels: Mapping[str, float], task_id: int | None = None) -> float:
+    """Weight of one image from its per-label pixel sums."""
+    return sum(label_weight_g(label, px, task_id) for label, px in label_pixels.items())
+
+
+def load_from_disk() -> None:
+    """Restore the density model from db/density_model.json."""
+    global _model, _version, _disk_token
+    _disk_token = file_token("density_model.json")
+    data = load_json("density_model.json")
+    _model = DensityModel(**data) if data else DensityModel()
+    _version += 1
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/density_model.json. Returns True on reload."""
+    if file_token("density_model.json") == _disk_token:
+        return False
+    load_from_disk()
+    return True
+
+
+def _save_to_disk() -> None:
+    global _disk_token
+    save_json("density_model.json", _model.model_dump())
+    _disk_token = file_token("density_model.json")
@@ -0,0 +1,358 @@
+import csv
+import io
+import json
+import sqlite3
+import struct
+import zipfile
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Iterator
+
+from fastapi import HTTPException
+
+from app.services.cvat_service import get_dataset
+from app.services.density_model import area_cm2, label_weight_g
+from app.services.geo_service import annotation_ring, get_all_georefs
+
+# Streams every georeferenced annotation into GIS formats. Features are
+# produced in fixed-size chunks from one dataset snapshot and each writer
+# appends chunk by chunk, so memory stays flat regardless of survey size.
+
+CHUNK_SIZE = 1000
+
+# Attribute columns, in output order: (name, type, dbf width, dbf decimals)
+FIELDS: list[tuple[str, type, int, int]] = [
+    ("image_id", int, 12, 0),
+    ("image_name", str, 128, 0),
+    ("task_id", int, 10, 0),
+    ("annotation_id", int, 12, 0),
+    ("label", str, 64, 0),
+    ("shape_type", str, 16, 0),
+    ("proposed", int, 1, 0),
+    ("pixel_area", float, 18, 3),
+    ("area_cm2", float, 18, 3),
+    ("weight_g", float, 18, 3),
+]
+
+# file suffix, media type
+FORMATS: dict[str, tuple[str, str]] = {
+    "gpkg": (".gpkg", "application/geopackage+sqlite3"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "shp": (".zip", "application/zip"),
+    "geojsonseq": (".geojsons", "application/geo+json-seq"),
+    "csv": (".csv", "text/csv"),
+}
+STREAMING_FORMATS = {"geojsonseq", "csv"}
+
+WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+    'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+)
+
+
+@dataclass
+class ExportFeature:
+    properties: dict
+    ring: list[list[float]]  # closed [[lng, lat], ...]
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        xs = [p[0] for p in self.ring]
+        ys = [p[1] for p in self.ring]
+        return min(xs), min(ys), max(xs), max(ys)
+
+
+def iter_feature_chunks(chunk_size: int = CHUNK_SIZE, site: str | None = None) -> Iterator[list[ExportFeature]]:
+    """Yield lists of at most chunk_size features for every georeferenced annotation (of `site` if given)."""
+    dataset = get_dataset(site)
+    georefs = get_all_georefs()
+    chunk: list[ExportFeature] = []
+    for image_id, annotations in dataset.annotations.items():
+        image = dataset.images.get(image_id)
+        georef = georefs.get(image_id)
+        if image is None or georef is None:
+            continue
+        for ann in annotations:
+            if len(ann.points) < 3:
+                continue
+            pixels = ann.pixel_area or 0.0
+            chunk.append(ExportFeature(
+                properties={
+                    "image_id": image_id,
+                    "image_name": image.name,
+                    "task_id": image.task_id,
+                    "annotation_id": ann.id,
+                    "label": ann.label,
+                    "shape_type": ann.shape_type,
+                    "proposed": int(ann.proposed),
+                    "pixel_area": pixels,
+                    "area_cm2": area_cm2(pixels, image.task_id),
+                    "weight_g": label_weight_g(ann.label, pixels, image.task_id),
+                },
+                ring=annotation_ring(ann.points, image.width, image.height, georef),
+            ))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _wkb_polygon(ring: list[list[float]]) -> bytes:
+    """Little-endian WKB for a single-ring polygon."""
+    coords = [c for point in ring for c in point[:2]]
+    return struct.pack(f"<BIII{len(coords)}d", 1, 3, 1, len(ring), *coords)
+
+
+def _wkt_polygon(ring: list[list[float]]) -> str:
+    return "POLYGON ((" + ", ".join(f"{x} {y}" for x, y in ring) + "))"
+
+
+# --- Streaming text formats ---
+
+def _stream_geojsonseq(chunks: Iterator[list[ExportFeature]]) -> Iterator[bytes]:
+    """RFC 8142 GeoJSON text sequence: one RS-prefixed Feature per line."""
+    for chunk in chunks:
+        yield b"".join(
+            b"\x1e" + json.dumps({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [f.ring]},
+                "properties": f.properties,
+            }).encode() + b"\n"
+            for f in chunk
+        )
+
+
+def _stream_csv(chunks: Iterator[list[ExportFeature]]) -> Iterator[bytes]:
+    names = [name for name, *_ in FIELDS]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([*names, "wkt"])
+    for chunk in chunks:
+        for f in chunk:
+            writer.writerow([*(f.properties[n] for n in names), _wkt_polygon(f.ring)])
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def stream_export(
+    fmt: str, chunks: Iterator[list[ExportFeature]] | None = None, site: str | None = None,
+) -> Iterator[bytes]:
+    """Return a byte-chunk iterator for a streaming format (geojsonseq, csv)."""
+    chunks = chunks if chunks is not None else iter_feature_chunks(site=site)
+    return _stream_geojsonseq(chunks) if fmt == "geojsonseq" else _stream_csv(chunks)
+
+
+# --- GeoPackage ---
+
+_GPKG_SQL_TYPES = {int: "INTEGER", str: "TEXT", float: "DOUBLE"}
+
+
+def _gpkg_geometry(f: ExportFeature) -> bytes:
+    minx, miny, maxx, maxy = f.bounds()
+    # magic, version 0, flags: little-endian + xy envelope
+    header = b"GP" + bytes([0, 0b00000011]) + struct.pack("<i4d", 4326, minx, maxx, miny, maxy)
+    return header + _wkb_polygon(f.ring)
+
+
+def _write_gpkg(path: Path, site: str | None) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(f"""
+            PRAGMA application_id = 1196444487;
+            PRAGMA user_version = 10400;
+            CREATE TABLE gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            CREATE TABLE gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '',
+                last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+                srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id));
+            CREATE TABLE gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                PRIMARY KEY (table_name, column_name));
+            CREATE TABLE detections (
+                fid INTEGER PRIMARY KEY AUTOINCREMENT, geom POLYGON,
+                {", ".join(f"{name} {_GPKG_SQL_TYPES[typ]}" for name, typ, *_ in FIELDS)});
+        """)
+        conn.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+            ("WGS 84 geodetic", 4326, "EPSG", 4326, WGS84_WKT, None),
+        ])
+        conn.execute("INSERT INTO gpkg_geometry_columns VALUES ('detections', 'geom', 'POLYGON', 4326, 0, 0)")
+
+        names = [name for name, *_ in FIELDS]
+        insert = f"INSERT INTO detections (geom, {', '.join(names)}) VALUES ({', '.join('?' * (len(names) + 1))})"
+        count = 0
+        extent = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+        for chunk in iter_feature_chunks(site=site):
+            conn.executemany(insert, [
+                (_gpkg_geometry(f), *(f.properties[n] for n in names)) for f in chunk
+            ])
+            for f in chunk:
+                minx, miny, maxx, maxy = f.bounds()
+                extent = [min(extent[0], minx), min(extent[1], miny), max(extent[2], maxx), max(extent[3], maxy)]
+            count += len(chunk)
+            conn.commit()
+
+        conn.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) "
+            "VALUES ('detections', 'features', 'detections', ?, ?, ?, ?, 4326)",
+            extent if count else [None] * 4,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+
+# --- Shapefile (zipped .shp/.shx/.dbf/.prj/.cpg) ---
+
+def _shp_header(file_length_bytes: int, bbox: list[float]) -> bytes:
+    return (
+        struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length_bytes // 2)
+        + struct.pack("<2i", 1000, 5)
+        + struct.pack("<8d", *bbox, 0.0, 0.0, 0.0, 0.0)
+    )
+
+
+def _clockwise(ring: list[list[float]]) -> list[list[float]]:
+    """Shapefile outer rings are clockwise; the shoelace sum is positive for counter-clockwise."""
+    signed = sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:]))
+    return ring[::-1] if signed > 0 else ring
+
+
+def _dbf_header(record_count: int) -> bytes:
+    today = date.today()
+    record_length = 1 + sum(width for _, _, width, _ in FIELDS)
+    header_length = 32 + 32 * len(FIELDS) + 1
+    out = struct.pack(
+        "<B3BIHH20x", 0x03, today.year - 1900, today.month, today.day,
+        record_count, header_length, record_length,
+    )
+    for name, typ, width, decimals in FIELDS:
+        dbf_type = b"C" if typ is str else b"N"
+        out += struct.pack("<11sc4xBB14x", name[:10].encode(), dbf_type, width, decimals)
+    return out + b"\r"
+
+
+def _dbf_record(props: dict) -> bytes:
+    out = b" "
+    for name, typ, width, decimals in FIELDS:
+        value = props[name]
+        if typ is str:
+            raw = str(value).encode("utf-8")[:width]
+            out += raw.decode("utf-8", "ignore").encode("utf-8").ljust(width)
+        else:
+            out += f"{value:.{decimals}f}".encode().rjust(width)[:width]
+    return out
+
+
+def _write_shapefile_zip(path: Path, site: str | None) -> int:
+    work = path.with_suffix(".parts")
+    work.mkdir()
+    shp_path, shx_path, dbf_path = work / "detections.shp", work / "detections.shx", work / "detections.dbf"
+    count = 0
+    bbox = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    with shp_path.open("wb") as shp, shx_path.open("wb") as shx, dbf_path.open("wb") as dbf:
+        shp.write(b"\0" * 100)
+        shx.write(b"\0" * 100)
+        dbf.write(_dbf_header(0))
+        offset = 100
+        for chunk in iter_feature_chunks(site=site):
+            for f in chunk:
+                ring = _clockwise(f.ring)
+                minx, miny, maxx, maxy = f.bounds()
+                bbox = [min(bbox[0], minx), min(bbox[1], miny), max(bbox[2], maxx), max(bbox[3], maxy)]
+                coords = [c for point in ring for c in point[:2]]
+                content = struct.pack(
+                    f"<i4dii i{len(coords)}d", 5, minx, miny, maxx, maxy, 1, len(ring), 0, *coords,
+                )
+                count += 1
+                shp.write(struct.pack(">2i", count, len(content) // 2) + content)
+                shx.write(struct.pack(">2i", offset // 2, len(content) // 2))
+                offset += 8 + len(content)
+                dbf.write(_dbf_record(f.properties))
+        dbf.write(b"\x1a")
+        if not count:
+            bbox = [0.0, 0.0, 0.0, 0.0]
+        shp.seek(0)
+        shp.write(_shp_header(offset, bbox))
+        shx.seek(0)
+        shx.write(_shp_header(100 + 8 * count, bbox))
+        dbf.seek(0)
+        dbf.write(_dbf_header(count))
+    (work / "detections.prj").write_text(WGS84_WKT)
+    (work / "detections.cpg").write_text("UTF-8")
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for part in sorted(work.iterdir()):
+            zf.write(part, part.name)
+            part.unlink()
+    work.rmdir()
+    return count
+
+
+# --- GeoParquet ---
+
+def _write_geoparquet(path: Path, site: str | None) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=501, detail="GeoParquet export requires pyarrow to be installed.")
+
+    arrow_types = {int: pa.int64(), str: pa.string(), float: pa.float64()}
+    geo_meta = {
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Polygon"]}},
+    }
+    schema = pa.schema(
+        [(name, arrow_types[typ]) for name, typ, *_ in FIELDS] + [("geometry", pa.binary())],
+        metadata={"geo": json.dumps(geo_meta)},
+    )
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_feature_chunks(site=site):
+            columns = {name: [f.properties[name] for f in chunk] for name, *_ in FIELDS}
+            columns["geometry"] = [_wkb_polygon(f.ring) for f in chunk]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(chunk)
+    return count
+
+
+_FILE_WRITERS = {
+    "gpkg": _write_gpkg,
+    "shp": _write_shapefile_zip,
+    "parquet": _write_geoparquet,
+}
+
+
+def export_to_file(fmt: str, path: Path, site: str | None = None) -> int:
+    """Write all georeferenced detections (of `site` if given) to path in fmt. Returns the feature count."""
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if fmt in STREAMING_FORMATS:
+        count = 0
+
+        def counted() -> Iterator[list[ExportFeature]]:
+            nonlocal count
+            for chunk in iter_feature_chunks(site=site):
+                count += len(chunk)
+                yield chunk
+
+        with path.open("wb") as out:
+            for data in stream_export(fmt, counted()):
+                out.write(data)
+        return count
+    return _FILE_WRITERS[fmt](path, site)
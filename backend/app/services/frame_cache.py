@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.services.cvat_service import get_frame_data
+from app.services.single_flight import coalesce_sync
+from app.services.store import db_path
+
+# Original-quality frames fetched from CVAT, kept on disk under db/frames/<task>/<frame>.img
+# so batch jobs read each frame from CVAT at most once. Decoded RGB copies sit next
+# to them as .npy files that readers memory-map instead of decoding again; they
+# are several times larger than the originals, so the least recently used ones
+# are deleted once they total more than settings.decoded_frames_mb.
+# Concurrent misses on one frame (route, prefetcher, batch threads) share one download.
+
+FRAME_DIR = db_path("frames")
+
+
+def frame_index(image_id: int, task_id: int) -> int:
+    """Frame number of an image, inverting the task_id * 100000 + frame id scheme."""
+    return image_id - task_id * 100000
+
+
+def cached_frame(task_id: int, frame: int) -> Path | None:
+    """Return the local path of a frame if it is already cached, without fetching."""
+    path = FRAME_DIR / str(task_id) / f"{frame}.img"
+    return path if path.exists() else None
+
+
+def frame_media_type(path: Path) -> str:
+    """Sniff the image type of a cached frame (CVAT serves JPEG or PNG)."""
+    with open(path, "rb") as fh:
+        head = fh.read(8)
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def cached_frame_path(task_id: int, frame: int) -> Path:
+    """Return the local path of a frame, downloading it from CVAT on first use."""
+    path = FRAME_DIR / str(task_id) / f"{frame}.img"
+    if path.exists():
+        return path
+    return coalesce_sync("cvat:frame", (task_id, frame), lambda: _download_frame(task_id, frame, path))
+
+
+def _download_frame(task_id: int, frame: int, path: Path) -> Path:
+    if path.exists():  # a flight that finished just before ours started
+        return path
+    data, _ = get_frame_data(task_id, frame)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return path
+
+
+def decoded_frame(task_id: int, frame: int) -> np.ndarray:
+    """Return a frame as a read-only, memory-mapped (height, width, 3) uint8 array."""
+    path = FRAME_DIR / str(task_id) / f"{frame}.npy"
+    try:
+        rgb = np.load(path, mmap_mode="r")
+        os.utime(path)  # recency for eviction
+        return rgb
+    except FileNotFoundError:
+        pass
+    with Image.open(cached_frame_path(task_id, frame)) as img:
+        rgb = np.asarray(img.convert("RGB"))
+    tmp = path.with_name(f".{frame}.{os.getpid()}.tmp.npy")
+    np.save(tmp, rgb)
+    os.replace(tmp, path)
+    _evict_decoded(keep=path)
+    return np.load(path, mmap_mode="r")
+
+
+def _evict_decoded(keep: Path) -> None:
+    """Delete the least recently used decoded frames beyond the size budget.
+
+    Mapped arrays of deleted files stay readable until their holders drop them.
+    """
+    files = []
+    for path in FRAME_DIR.glob("*/*.npy"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue  # evicted by another worker
+        files.append((st.st_mtime, st.st_size, path))
+    files.sort(reverse=True)
+    budget = settings.decoded_frames_mb * 1024 * 1024
+    total = 0
+    for _, size, path in files:
+        total += size
+        if total > budget and path != keep:
+            path.unlink(missing_ok=True)
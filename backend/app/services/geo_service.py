@@ -1,5 +1,5 @@
-import re
 import math
+from typing import Mapping
 
 from fastapi import HTTPException
 
@@ -11,27 +11,49 @@ from app.models.schemas import (
     HeatmapPoint,
     HeatmapResponse,
 )
-from app.services.cvat_service import get_cached_annotations, get_cached_images
-from app.services.analysis_service import get_all_results
-from app.services.store import load_json, save_json
+from app.services.cvat_service import get_dataset
+from app.services.density_model import area_cm2, label_weight_g, weight_g
+from app.services.mosaic_index import pixel_offsets
+from app.services.snapshot_columns import encode_georefs, open_georefs
+from app.services.store import file_token, load_columns, load_json, locked, save_columns
+
+# Persisted as a memory-mapped columnar snapshot; georefs.json only seeds it
+# when there is no snapshot yet.
+_SNAPSHOT = "georefs.snap"
 
 # Store georeferencing info per image.
 # In production this comes from drone EXIF/metadata.
 # For the hackathon, register manually or extract from image metadata.
-_georefs: dict[int, ImageGeoReference] = {}
+_georefs: Mapping[int, ImageGeoReference] = {}
 
 # Global mosaic origin (set via register_global_origin)
 _global_origin: GeoCoordinate | None = None
+# Ground resolution the origin was registered with, reused for newly synced images
+_global_resolution_cm = 0.5
+
+# Bumped whenever _georefs/_global_origin change; keys response caches
+_version = 0
+# Bumped whenever _pixel_to_geo changes, so anything derived from projected
+# outlines (response caches, persisted change fingerprints) is rebuilt.
+# 2: longitude scaled by 1/cos(lat)
+PROJECTION_VERSION = 2
+# Token of the db/georefs.snap this process last loaded or wrote
+_disk_token = None
 
 
 def register_georeference(image_id: int, center: GeoCoordinate, resolution: float = 0.5):
     """Register georeferencing data for an image."""
-    _georefs[image_id] = ImageGeoReference(
-        image_id=image_id,
-        center=center,
-        ground_resolution_cm_per_pixel=resolution,
-    )
-    _save_to_disk()
+    global _georefs
+    with locked(_SNAPSHOT):
+        refresh_from_disk()
+        # Copy-on-write so concurrent readers keep iterating the old dict
+        _georefs = {**_georefs, image_id: ImageGeoReference(
+            image_id=image_id,
+            center=center,
+            ground_resolution_cm_per_pixel=resolution,
+        )}
+        _bump_version()
+        _save_to_disk()
 
 
 def _pixel_to_geo(
@@ -42,25 +64,40 @@ def _pixel_to_geo(
     This is a simplified linear transform suitable for small drone images.
     For production, use proper affine/homography transforms.
     """
-    res_deg = georef.ground_resolution_cm_per_pixel / 100 / 111_320  # rough cm -> degrees
+    res_lat = georef.ground_resolution_cm_per_pixel / 100 / 111_320  # rough cm -> degrees
+    res_lng = res_lat / math.cos(math.radians(georef.center.lat))  # as in _offset_to_geo
 
     dx = px - image_width / 2
     dy = py - image_height / 2
 
-    lng = georef.center.lng + dx * res_deg
-    lat = georef.center.lat - dy * res_deg  # y increases downward in image
+    lng = georef.center.lng + dx * res_lng
+    lat = georef.center.lat - dy * res_lat  # y increases downward in image
 
     return lat, lng
 
 
+def annotation_ring(
+    points: list[list[float]], image_width: int, image_height: int, georef: ImageGeoReference
+) -> list[list[float]]:
+    """Convert an annotation outline to a closed [[lng, lat], ...] ring."""
+    coords = [
+        list(reversed(_pixel_to_geo(p[0], p[1], image_width, image_height, georef)))
+        for p in points
+    ]
+    # Close the polygon ring
+    if coords and coords[0] != coords[-1]:
+        coords.append(coords[0])
+    return coords
+
+
 async def get_map_features(image_id: int) -> MapFeatureCollection:
     """Build GeoJSON FeatureCollection from annotations + georef."""
-    images = get_cached_images()
-    if image_id not in images:
+    dataset = get_dataset()
+    if image_id not in dataset.images:
         raise HTTPException(status_code=404, detail=f"Image {image_id} not found.")
 
-    image = images[image_id]
-    annotations = get_cached_annotations(image_id)
+    image = dataset.images[image_id]
+    annotations = dataset.annotations_for(image_id)
 
     if image_id not in _georefs:
         raise HTTPException(
@@ -69,26 +106,18 @@ async def get_map_features(image_id: int) -> MapFeatureCollection:
         )
 
     georef = _georefs[image_id]
-    results = get_all_results()
-    analysis = results.get(image_id)
 
     features: list[MapFeature] = []
     for ann in annotations:
-        coords = [
-            list(reversed(_pixel_to_geo(p[0], p[1], image.width, image.height, georef)))
-            for p in ann.points
-        ]
-        # Close the polygon ring
-        if coords and coords[0] != coords[-1]:
-            coords.append(coords[0])
-
+        coords = annotation_ring(ann.points, image.width, image.height, georef)
         feature = MapFeature(
             geometry={"type": "Polygon", "coordinates": [coords]},
             properties={
                 "annotation_id": ann.id,
                 "label": ann.label,
                 "pixel_area": ann.pixel_area,
-                "weight_g": (ann.pixel_area or 0) * 0.12,
+                "area_cm2": area_cm2(ann.pixel_area or 0, image.task_id),
+                "weight_g": label_weight_g(ann.label, ann.pixel_area or 0, image.task_id),
             },
         )
         features.append(feature)
@@ -98,19 +127,6 @@ async def get_map_features(image_id: int) -> MapFeatureCollection:
 
 # --- Global Origin Georeferencing ---
 
-_FILENAME_PATTERN = re.compile(r"_y(\d+)_x(\d+)\.")
-
-
-def _parse_pixel_offsets(filename: str) -> tuple[int, int] | None:
-    """Extract (x_pixels, y_pixels) from a filename like '1-5_y23100_x15708.jpg'."""
-    m = _FILENAME_PATTERN.search(filename)
-    if not m:
-        return None
-    y_px = int(m.group(1))
-    x_px = int(m.group(2))
-    return (x_px, y_px)
-
-
 def _offset_to_geo(
     x_px: int,
     y_px: int,
@@ -144,33 +160,84 @@ def _offset_to_geo(
     return GeoCoordinate(lat=lat, lng=lng)
 
 
-def register_global_origin(origin: GeoCoordinate, resolution_cm: float = 0.5) -> int:
-    """Set mosaic origin and compute georef for every cached image from filename offsets.
-
-    Returns the number of images successfully georeferenced.
-    """
-    global _global_origin
-    _global_origin = origin
-
-    images = get_cached_images()
+def _derive_georefs(
+    georefs: dict[int, ImageGeoReference], image_ids, origin: GeoCoordinate, resolution_cm: float
+) -> int:
+    """Set georefs for `image_ids` from mosaic offsets relative to `origin`; returns how many were set."""
+    images = get_dataset().images
     count = 0
-    for img_id, img in images.items():
-        offsets = _parse_pixel_offsets(img.name)
+    for img_id in image_ids:
+        img = images[img_id]
+        offsets = pixel_offsets(img_id)
         if offsets is None:
             continue
         x_px, y_px = offsets
         center = _offset_to_geo(x_px, y_px, img.width, img.height, origin, resolution_cm)
-        _georefs[img_id] = ImageGeoReference(
+        georefs[img_id] = ImageGeoReference(
             image_id=img_id,
             center=center,
             ground_resolution_cm_per_pixel=resolution_cm,
         )
         count += 1
-    _save_to_disk()
     return count
 
 
-def get_all_georefs() -> dict[int, ImageGeoReference]:
+def register_global_origin(origin: GeoCoordinate, resolution_cm: float = 0.5) -> int:
+    """Set mosaic origin and compute georef for every cached image from filename offsets.
+
+    Returns the number of images successfully georeferenced.
+    """
+    global _georefs, _global_origin, _global_resolution_cm
+    with locked(_SNAPSHOT):
+        refresh_from_disk()
+        _global_origin = origin
+        _global_resolution_cm = resolution_cm
+
+        georefs = dict(_georefs)
+        count = _derive_georefs(georefs, get_dataset().images, origin, resolution_cm)
+        _georefs = georefs
+        _bump_version()
+        _save_to_disk()
+    return count
+
+
+def georeference_new_images() -> int:
+    """Georeference cached images that have no georef yet, from the persisted origin.
+
+    Already persisted georefs are left alone, and nothing is written when every
+    image is covered, so this is cheap to run at startup.
+    """
+    global _georefs
+    if _global_origin is None:
+        return 0
+    with locked(_SNAPSHOT):
+        refresh_from_disk()
+        if _global_origin is None:
+            return 0
+        known = set(_georefs)
+        missing = [img_id for img_id in get_dataset().images if img_id not in known]
+        if not missing:
+            return 0
+        georefs = dict(_georefs)
+        count = _derive_georefs(georefs, missing, _global_origin, _global_resolution_cm)
+        if count:
+            _georefs = georefs
+            _bump_version()
+            _save_to_disk()
+    return count
+
+
+def _bump_version() -> None:
+    global _version
+    _version += 1
+
+
+def get_georef_version() -> tuple[int, int]:
+    """Return a version that changes whenever georefs, the global origin or the projection change."""
+    return (PROJECTION_VERSION, _version)
+
+
+def get_all_georefs() -> Mapping[int, ImageGeoReference]:
     """Return the georef dict so the frontend can display coordinates per image."""
     return _georefs
 
@@ -180,26 +247,24 @@ def get_global_origin() -> GeoCoordinate | None:
     return _global_origin
 
 
-def get_heatmap_data() -> HeatmapResponse:
-    """Build heatmap data from georeferenced images that have annotations."""
+def get_heatmap_data(site: str | None = None) -> HeatmapResponse:
+    """Build heatmap data from georeferenced images that have annotations (of one site's surveys with `site`)."""
     if _global_origin is None:
         raise HTTPException(status_code=400, detail="Global origin not set. Call POST /map/global-origin first.")
 
-    results = get_all_results()
     points: list[HeatmapPoint] = []
-    images = get_cached_images()
+    dataset = get_dataset(site)
+    images = dataset.images
+    georefs = _georefs
 
-    for img_id, georef in _georefs.items():
-        annotations = get_cached_annotations(img_id)
-        if not annotations:
+    for img_id, annotations in dataset.annotations.items():
+        georef = georefs.get(img_id)
+        if georef is None or not annotations:
             continue
 
-        analysis = results.get(img_id)
-        total_weight = analysis.estimated_weight_g if analysis else sum(
-            (ann.pixel_area or 0) * 0.12 for ann in annotations
-        )
-
         img = images.get(img_id)
+        total_weight = weight_g(dataset.label_pixels_for(img_id), img.task_id if img else None)
+
         points.append(HeatmapPoint(
             image_id=img_id,
             image_name=img.name if img else f"image_{img_id}",
@@ -212,24 +277,50 @@ def get_heatmap_data() -> HeatmapResponse:
     return HeatmapResponse(
         origin=_global_origin,
         points=points,
-        total_images_georeferenced=len(_georefs),
+        total_images_georeferenced=len(georefs) if site is None else sum(1 for i in images if i in georefs),
     )
 
 
 def load_from_disk() -> None:
-    """Restore _georefs and _global_origin from db/georefs.json."""
-    global _global_origin
-    data = load_json("georefs.json")
-    for k, v in data.get("georefs", {}).items():
-        _georefs[int(k)] = ImageGeoReference(**v)
-    origin = data.get("global_origin")
-    if origin is not None:
-        _global_origin = GeoCoordinate(**origin)
+    """Restore _georefs and _global_origin from db/georefs.snap (seeded from georefs.json if there is none)."""
+    global _georefs, _global_origin, _global_resolution_cm, _disk_token
+    snap_token = file_token(_SNAPSHOT)
+    snapshot = load_columns(_SNAPSHOT) if snap_token is not None else None
+    if snapshot is None and file_token("georefs.json") is not None:
+        data = load_json("georefs.json")
+        _georefs = {int(k): ImageGeoReference(**v) for k, v in data.get("georefs", {}).items()}
+        origin = data.get("global_origin")
+        _global_origin = GeoCoordinate(**origin) if origin is not None else None
+        _global_resolution_cm = data.get("global_resolution_cm", 0.5)
+        _bump_version()
+        _save_to_disk()
+        return
+
+    _disk_token = snap_token
+    if snapshot is None:
+        _georefs, _global_origin = {}, None
+    else:
+        cols, meta = snapshot
+        _georefs = open_georefs(cols)
+        origin = meta.get("global_origin")
+        _global_origin = GeoCoordinate(**origin) if origin is not None else None
+        _global_resolution_cm = meta.get("global_resolution_cm", 0.5)
+    _bump_version()
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/georefs.snap. Returns True on reload."""
+    if file_token(_SNAPSHOT) == _disk_token:
+        return False
+    load_from_disk()
+    return True
 
 
 def _save_to_disk() -> None:
-    """Persist _georefs and _global_origin to db/georefs.json."""
-    save_json("georefs.json", {
-        "georefs": {str(k): v.model_dump() for k, v in _georefs.items()},
+    """Persist _georefs and _global_origin to db/georefs.snap."""
+    global _disk_token
+    save_columns(_SNAPSHOT, encode_georefs(_georefs), {
         "global_origin": _global_origin.model_dump() if _global_origin else None,
+        "global_resolution_cm": _global_resolution_cm,
     })
+    _disk_token = file_token(_SNAPSHOT)
@@ -0,0 +1,112 @@
+import numpy as np
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeometryReport, ImageGeometry
+from app.services.shapes import DEGENERATE, REPAIRED, VALID, validate_polygons
+from app.services.store import file_token, load_json, locked, save_json
+from app.services.survey_service import site_task_ids
+
+# Geometry validation stage of ingestion (sync, import and the cvat.json seed).
+# Every incoming polygon goes through one vectorised Shapely pass: valid
+# outlines keep their area, invalid ones (self-intersections, bow-ties) are
+# measured after make_valid, and degenerate ones count as 0 px. Results land in
+# the annotations' pixel_area before the dataset is published; per-image counts
+# and the flagged annotation ids are kept in db/geometry.json.
+
+_images: dict[int, ImageGeometry] = {}
+# Token of the db/geometry.json this process last loaded or wrote
+_disk_token = None
+
+
+def validate_annotations(
+    images: dict[int, CvatImage],
+    annotations: dict[int, list[CvatAnnotation]],
+) -> dict[int, ImageGeometry]:
+    """Set pixel_area on every polygon in `annotations` (in place) and return per-image counts."""
+    polygons = [
+        (image_id, ann)
+        for image_id, anns in annotations.items()
+        for ann in anns
+        if ann.shape_type == "polygon"
+    ]
+    areas, status = validate_polygons([ann.points for _, ann in polygons])
+    for (_, ann), area in zip(polygons, areas.tolist()):
+        ann.pixel_area = area
+
+    image_ids = np.fromiter((image_id for image_id, _ in polygons), dtype=np.int64, count=len(polygons))
+    uniq, inverse = np.unique(image_ids, return_inverse=True)
+    counts = {
+        code: np.bincount(inverse, weights=status == code, minlength=len(uniq)).astype(int)
+        for code in (VALID, REPAIRED, DEGENERATE)
+    }
+    flagged: dict[int, list[int]] = {}
+    for i in np.flatnonzero(status != VALID).tolist():
+        image_id, ann = polygons[i]
+        flagged.setdefault(image_id, []).append(ann.id)
+
+    stats = {}
+    for i, image_id in enumerate(uniq.tolist()):
+        image = images.get(image_id)
+        if image is None:
+            continue
+        valid, repaired, degenerate = (int(counts[code][i]) for code in (VALID, REPAIRED, DEGENERATE))
+        stats[image_id] = ImageGeometry(
+            image_id=image_id,
+            task_id=image.task_id,
+            polygons=valid + repaired + degenerate,
+            valid=valid,
+            repaired=repaired,
+            degenerate=degenerate,
+            flagged_ids=flagged.get(image_id, []),
+        )
+    return stats
+
+
+def record(task_ids: set[int] | None, stats: dict[int, ImageGeometry]) -> None:
+    """Replace the recorded stats of `task_ids` (all tasks if None) with `stats`."""
+    global _images
+    with locked("geometry.json"):
+        refresh_from_disk()
+        kept = {} if task_ids is None else {k: v for k, v in _images.items() if v.task_id not in task_ids}
+        _images = {**kept, **stats}
+        _save_to_disk()
+
+
+def get_report(task_id: int | None = None, site: str | None = None) -> GeometryReport:
+    site_tasks = site_task_ids(site) if site is not None else None
+    entries = [
+        s for s in _images.values()
+        if (task_id is None or s.task_id == task_id) and (site_tasks is None or s.task_id in site_tasks)
+    ]
+    flagged = [s for s in entries if s.repaired or s.degenerate]
+    flagged.sort(key=lambda s: (-(s.repaired + s.degenerate), s.image_id))
+    return GeometryReport(
+        polygons=sum(s.polygons for s in entries),
+        valid=sum(s.valid for s in entries),
+        repaired=sum(s.repaired for s in entries),
+        degenerate=sum(s.degenerate for s in entries),
+        images=flagged,
+    )
+
+
+def load_from_disk() -> None:
+    """Restore per-image geometry stats from db/geometry.json."""
+    global _images, _disk_token
+    _disk_token = file_token("geometry.json")
+    data = load_json("geometry.json")
+    _images = {int(k): ImageGeometry(**v) for k, v in data.get("images", {}).items()}
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/geometry.json. Returns True on reload."""
+    if file_token("geometry.json") == _disk_token:
+        return False
+    load_from_disk()
+    return True
+
+
+def _save_to_disk() -> None:
+    global _disk_token
+    save_json("geometry.json", {
+        "images": {str(k): v.model_dump() for k, v in _images.items()},
+    })
+    _disk_token = file_token("geometry.json")
@@ -0,0 +1,333 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.services.cvat_service import Dataset, get_cached_annotations, get_dataset
+from app.services.density_model import area_cm2, get_model_version, weight_g
+from app.services.geo_service import get_all_georefs, get_georef_version
+from app.services.survey_service import site_task_ids
+
+# Secondary indexes over the cached images, rebuilt once per data/density model version.
+# The index holds compact per-image columns (task, weight, annotated) and
+# posting lists of global sort ranks, never the image rows themselves: a page's
+# rows are built from the dataset when served, so only the site partitions of
+# that page stay resident (see partitions.py). Every filter has a posting list:
+# `min_weight_g` is a prefix of the weight order and `georeferenced` is derived
+# once per georef version. A page is a searchsorted into the smallest matching
+# posting list plus a vectorised walk over it, never a scan of all images.
+
+SORT_KEYS = ("name", "weight")
+IMAGE_FIELDS = (
+    "id", "name", "width", "height", "task_id",
+    "annotation_count", "labels", "pixel_area", "area_cm2", "weight_g", "georeferenced",
+)
+
+_NONE = np.empty(0, dtype=np.int64)
+# Ranks checked per step of the walk; doubled each step so sparse matches stay cheap
+_WALK_CHUNK = 256
+
+
+@dataclass
+class _SortOrder:
+    values: Sequence  # primary sort value per rank; ties are broken by image id
+    rows: np.ndarray  # index row per rank
+    ranks: np.ndarray  # rank per index row
+    by_weight: np.ndarray  # ranks in descending weight order: `min_weight_g` matches a prefix
+    # posting lists of ranks, each sorted ascending
+    all: np.ndarray
+    by_task: dict[int, np.ndarray]
+    by_label: dict[str, np.ndarray]
+    annotated: np.ndarray
+    unannotated: np.ndarray
+
+
+@dataclass
+class ImageIndex:
+    version: tuple  # (dataset version, density model version)
+    dataset: Dataset  # the snapshot the index was built from; page rows are read from it
+    # one row per image, sorted by image id
+    ids: np.ndarray
+    task_ids: np.ndarray
+    weights: np.ndarray
+    annotated: np.ndarray
+    orders: dict[str, _SortOrder]
+    # georef version -> (sort, georeferenced) -> ranks, filled on first use
+    georef_postings: dict[tuple, dict[tuple[str, bool], np.ndarray]] = field(default_factory=dict)
+
+
+_index: ImageIndex | None = None
+
+
+def _group(keys: np.ndarray) -> dict[int, np.ndarray]:
+    """Ranks grouped by key, given one key per rank; each group comes out sorted."""
+    by_key = np.argsort(keys, kind="stable")
+    unique, starts = np.unique(keys[by_key], return_index=True)
+    return {int(k): ranks for k, ranks in zip(unique.tolist(), np.split(by_key, starts[1:]))}
+
+
+def _build_order(
+    values: Sequence,
+    rows: np.ndarray,
+    weight_rows: np.ndarray,
+    task_ids: np.ndarray,
+    annotated: np.ndarray,
+    label_rows: dict[str, list[int]],
+) -> _SortOrder:
+    ranks = np.empty(len(rows), dtype=np.int64)
+    ranks[rows] = np.arange(len(rows))
+    return _SortOrder(
+        values=values,
+        rows=rows,
+        ranks=ranks,
+        by_weight=ranks[weight_rows],
+        all=np.arange(len(rows)),
+        by_task=_group(task_ids[rows]),
+        by_label={label: np.sort(ranks[r]) for label, r in label_rows.items()},
+        annotated=np.flatnonzero(annotated[rows]),
+        unannotated=np.flatnonzero(~annotated[rows]),
+    )
+
+
+def _build_index(dataset: Dataset, version: tuple[int, int]) -> ImageIndex:
+    ids = np.array(sorted(dataset.images), dtype=np.int64)
+    names: list[str] = []
+    task_ids = np.empty(len(ids), dtype=np.int64)
+    weights = np.empty(len(ids), dtype=np.float64)
+    annotated = np.empty(len(ids), dtype=bool)
+    label_rows: dict[str, list[int]] = {}
+    for row, img_id in enumerate(ids.tolist()):
+        img = dataset.images[img_id]
+        # Every annotation adds its label here, so an image has annotations iff it has labels
+        label_pixels = dataset.label_pixels_for(img_id)
+        names.append(img.name)
+        task_ids[row] = img.task_id
+        weights[row] = weight_g(label_pixels, img.task_id)
+        annotated[row] = bool(label_pixels)
+        for label in label_pixels:
+            label_rows.setdefault(label, []).append(row)
+
+    # Rows are in id order, so a stable sort breaks ties by id
+    name_rows = np.array(sorted(range(len(ids)), key=names.__getitem__), dtype=np.int64)
+    weight_rows = np.lexsort((ids, -weights))
+    columns = (weight_rows, task_ids, annotated, label_rows)
+    return ImageIndex(
+        version=version,
+        dataset=dataset,
+        ids=ids,
+        task_ids=task_ids,
+        weights=weights,
+        annotated=annotated,
+        orders={
+            "name": _build_order([names[r] for r in name_rows.tolist()], name_rows, *columns),
+            "weight": _build_order(-weights[weight_rows], weight_rows, *columns),
+        },
+    )
+
+
+def get_image_index() -> ImageIndex:
+    """Return the index for the current data version, rebuilding it if stale."""
+    global _index
+    dataset = get_dataset()
+    version = (dataset.version, get_model_version())
+    index = _index
+    if index is None or index.version != version:
+        index = _index = _build_index(dataset, version)
+    return index
+
+
+def _image_row(dataset: Dataset, img_id: int) -> dict:
+    img = dataset.images[img_id]
+    label_pixels = dataset.label_pixels_for(img_id)
+    pixel_area = sum(label_pixels.values())
+    return {
+        **img.model_dump(),
+        "annotation_count": len(dataset.annotations_for(img_id)),
+        "labels": sorted(label_pixels),
+        "pixel_area": pixel_area,
+        "area_cm2": area_cm2(pixel_area, img.task_id),
+        "weight_g": weight_g(label_pixels, img.task_id),
+    }
+
+
+def _georef_posting(index: ImageIndex, sort: str, georeferenced: bool) -> np.ndarray:
+    """Ranks of the images that are (or are not) georeferenced, for the current georef version."""
+    version = get_georef_version()
+    postings = index.georef_postings.get(version)
+    if postings is None:
+        index.georef_postings.clear()
+        postings = index.georef_postings[version] = {}
+    posting = postings.get((sort, georeferenced))
+    if posting is None:
+        order = index.orders[sort]
+        georef_ids = np.fromiter(get_all_georefs(), dtype=np.int64)
+        rows = np.searchsorted(index.ids, georef_ids)
+        known = rows < len(index.ids)
+        known[known] = index.ids[rows[known]] == georef_ids[known]
+        posting = np.sort(order.ranks[rows[known]])
+        if not georeferenced:
+            posting = np.setdiff1d(order.all, posting, assume_unique=True)
+        postings[(sort, georeferenced)] = posting
+    return posting
+
+
+def _contains(posting: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+    pos = np.searchsorted(posting, ranks)
+    found = pos < len(posting)
+    found[found] = posting[pos[found]] == ranks[found]
+    return found
+
+
+def _encode_cursor(sort: str, key: tuple) -> str:
+    raw = json.dumps([sort, list(key)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort order.")
+    return tuple(key)
+
+
+def _cursor_key(index: ImageIndex, order: _SortOrder, rank: int) -> tuple:
+    value = order.values[rank]
+    return (value if isinstance(value, str) else float(value), int(index.ids[order.rows[rank]]))
+
+
+def _rank_after(index: ImageIndex, order: _SortOrder, key: tuple) -> int:
+    """First rank whose (sort value, image id) comes after `key`."""
+    try:
+        value, img_id = key
+        lo = bisect_left(order.values, value)
+        hi = bisect_right(order.values, value, lo)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return lo + int(np.searchsorted(index.ids[order.rows[lo:hi]], img_id, side="right"))
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """Validate a comma-separated `fields=` projection."""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in IMAGE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def query_images(
+    *,
+    limit: int = 100,
+    cursor: str | None = None,
+    sort: str = "name",
+    task_id: int | None = None,
+    site: str | None = None,
+    has_annotations: bool | None = None,
+    label: str | None = None,
+    min_weight_g: float | None = None,
+    georeferenced: bool | None = None,
+    fields: list[str] | None = None,
+) -> dict:
+    """Return one page of images matching the filters, plus the cursor for the next page."""
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_KEYS)}")
+
+    index = get_image_index()
+    order = index.orders[sort]
+    georefs = get_all_georefs()
+
+    # Each filter as a sorted posting list of ranks; the walk is driven by the smallest
+    postings: list[np.ndarray] = []
+    if task_id is not None:
+        postings.append(order.by_task.get(task_id, _NONE))
+    if site is not None:
+        site_postings = [order.by_task.get(t, _NONE) for t in site_task_ids(site)]
+        postings.append(np.sort(np.concatenate(site_postings)) if site_postings else _NONE)
+    if label is not None:
+        postings.append(order.by_label.get(label, _NONE))
+    if has_annotations is not None:
+        postings.append(order.annotated if has_annotations else order.unannotated)
+    if georeferenced is not None:
+        postings.append(_georef_posting(index, sort, georeferenced))
+    end = len(index.ids)
+    if min_weight_g is not None:
+        # Images of at least min_weight_g are a prefix of the weight order
+        heavy = int(np.searchsorted(index.orders["weight"].values, -min_weight_g, side="right"))
+        if sort == "weight":
+            end = heavy
+        elif not postings or heavy < min(len(p) for p in postings):
+            # Only sorted into rank order when it is the smallest list
+            postings.append(np.sort(order.by_weight[:heavy]))
+    posting = min(postings, key=len) if postings else order.all
+    others = [p for p in postings if p is not posting]
+
+    pos = 0
+    if cursor:
+        pos = int(np.searchsorted(posting, _rank_after(index, order, _decode_cursor(cursor, sort))))
+    stop = int(np.searchsorted(posting, end))
+
+    matches: list[int] = []
+    chunk = _WALK_CHUNK
+    while pos < stop and len(matches) <= limit:
+        ranks = posting[pos:min(pos + chunk, stop)]
+        pos += chunk
+        chunk *= 2
+        keep = np.ones(len(ranks), dtype=bool)
+        for other in others:
+            keep &= _contains(other, ranks)
+        if min_weight_g is not None and sort != "weight":
+            keep &= index.weights[order.rows[ranks]] >= min_weight_g
+        matches.extend(ranks[keep][:limit + 1 - len(matches)].tolist())
+
+    items: list[dict] = []
+    for rank in matches[:limit]:
+        row = _image_row(index.dataset, int(index.ids[order.rows[rank]]))
+        item = {**row, "georeferenced": row["id"] in georefs}
+        items.append({f: item[f] for f in fields} if fields else item)
+    next_cursor = _encode_cursor(sort, _cursor_key(index, order, matches[limit - 1])) if len(matches) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+ANNOTATION_FIELDS = ("id", "image_id", "label", "points", "pixel_area", "shape_type", "proposed")
+
+
+def query_annotations(
+    image_id: int,
+    *,
+    limit: int | None = None,
+    cursor: str | None = None,
+    label: str | None = None,
+    fields: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """Return (annotations, next_cursor) for one image; the cursor is the last annotation id."""
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    if projection:
+        unknown = [f for f in projection if f not in ANNOTATION_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    annotations = sorted(get_cached_annotations(image_id), key=lambda a: a.id)
+    if label is not None:
+        annotations = [a for a in annotations if a.label == label]
+    if cursor:
+        try:
+            after_id = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        annotations = annotations[bisect_right(annotations, after_id, key=lambda a: a.id):]
+
+    next_cursor = None
+    if limit is not None and len(annotations) > limit:
+        annotations = annotations[:limit]
+        next_cursor = str(annotations[-1].id)
+    return [a.model_dump(include=set(projection) if projection else None) for a in annotations], next_cursor
@@ -0,0 +1,225 @@
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import IO, Iterator
+
+import ijson
+from fastapi import HTTPException
+
+from app.models.schemas import CvatAnnotation, CvatImage, CvatSyncResponse
+from app.services.cvat_service import replace_tasks
+from app.services.shapes import shape_geometry
+
+# Offline import of CVAT export archives. Both formats are parsed as a stream
+# straight out of the zip, so the raw XML tree or JSON document is never held
+# whole. The parsed images and annotations are still collected in memory, since
+# the archive's tasks are published together in one replace_tasks call; memory
+# grows with the number of shapes imported, not with the archive's raw size.
+
+# Imported shapes carry no CVAT id, so they get synthetic ones per task
+# (same spirit as the task_id * 100000 + frame image ids). A task with more
+# shapes than the stride is rejected rather than overlapping the next task's ids.
+_ANNOTATION_ID_STRIDE = 10_000_000
+
+# (label, CVAT shape type, CVAT-style flat points)
+Shape = tuple[str, str, list[float]]
+
+
+def _image_id(task_id: int, frame: int) -> int:
+    return task_id * 100000 + frame
+
+
+def _xml_flat_points(raw: str) -> list[float]:
+    """Parse CVAT XML 'x1,y1;x2,y2;...' points into a flat [x1, y1, x2, y2, ...] list."""
+    return [float(v) for pair in raw.split(";") if pair for v in pair.split(",")]
+
+
+def _xml_shape(elem: ET.Element) -> Shape | None:
+    """Convert an XML shape element into the flat points layout the CVAT API uses."""
+    label = elem.get("label", "")
+    attr = lambda name: float(elem.get(name, 0))  # noqa: E731
+    if elem.tag in ("polygon", "polyline", "points"):
+        return label, elem.tag, _xml_flat_points(elem.get("points", ""))
+    if elem.tag == "box":
+        return label, "rectangle", [attr("xtl"), attr("ytl"), attr("xbr"), attr("ybr")]
+    if elem.tag == "ellipse":
+        cx, cy = attr("cx"), attr("cy")
+        return label, "ellipse", [cx, cy, cx + attr("rx"), cy - attr("ry")]
+    if elem.tag == "mask":
+        runs = [float(v) for v in elem.get("rle", "").split(",") if v.strip()]
+        left, top = attr("left"), attr("top")
+        bbox = [left, top, left + attr("width") - 1, top + attr("height") - 1]
+        return label, "mask", runs + bbox
+    return None
+
+
+def _coco_rle_counts(counts: str) -> list[int]:
+    """Decode COCO's compressed RLE counts string (pycocotools rleFrString)."""
+    runs: list[int] = []
+    pos = 0
+    while pos < len(counts):
+        value, shift, more = 0, 0, True
+        while more:
+            c = ord(counts[pos]) - 48
+            value |= (c & 0x1F) << (5 * shift)
+            more = bool(c & 0x20)
+            pos += 1
+            shift += 1
+            if not more and c & 0x10:
+                value |= -1 << (5 * shift)
+        if len(runs) > 2:
+            value += runs[-2]
+        runs.append(value)
+    return runs
+
+
+def _coco_shapes(label: str, ann: dict) -> list[Shape]:
+    segmentation = ann.get("segmentation")
+    if isinstance(segmentation, list):
+        return [(label, "polygon", list(ring)) for ring in segmentation]
+    x, y, w, h = ann["bbox"]
+    if isinstance(segmentation, dict):
+        counts = segmentation["counts"]
+        runs = _coco_rle_counts(counts) if isinstance(counts, str) else counts
+        # Full-image column-major runs; only the foreground total is used
+        return [(label, "mask", list(runs) + [x, y, x + w - 1, y + h - 1])]
+    return [(label, "rectangle", [x, y, x + w, y + h])]
+
+
+def _iter_cvat_xml(fh: IO[bytes], default_task_id: int) -> Iterator[tuple[CvatImage, list[Shape]]]:
+    """Yield (image, shapes) per <image> element of a CVAT-for-images XML."""
+    task_id = default_task_id
+    context = ET.iterparse(fh, events=("start", "end"))
+    _, root = next(context)
+    path: list[str] = [root.tag]
+    for event, elem in context:
+        if event == "start":
+            path.append(elem.tag)
+            continue
+        path.pop()
+        if elem.tag == "id" and path[-2:] == ["meta", "task"] and elem.text:
+            task_id = int(elem.text)
+        elif elem.tag == "image":
+            frame = int(elem.get("id", 0))
+            img_task = int(elem.get("task_id", task_id))
+            image = CvatImage(
+                id=_image_id(img_task, frame),
+                name=elem.get("name", f"frame_{frame}"),
+                width=int(elem.get("width", 0)),
+                height=int(elem.get("height", 0)),
+                task_id=img_task,
+            )
+            shapes = [shape for child in elem if (shape := _xml_shape(child)) is not None]
+            yield image, shapes
+            # Drop parsed elements so the tree never grows past one <image>
+            elem.clear()
+            root.clear()
+
+
+def _coco_member(zf: zipfile.ZipFile) -> str:
+    names = [n for n in zf.namelist() if n.endswith(".json")]
+    preferred = [n for n in names if n.startswith("annotations/instances")]
+    return (preferred or names)[0]
+
+
+def _iter_coco(zf: zipfile.ZipFile, task_id: int) -> Iterator[tuple[CvatImage, list[Shape]]]:
+    """Yield (image, shapes) from a COCO instances JSON using three streaming passes."""
+    member = _coco_member(zf)
+
+    with zf.open(member) as fh:
+        categories = {c["id"]: c["name"] for c in ijson.items(fh, "categories.item")}
+
+    # COCO image id -> our image, in export (frame) order
+    images: dict[int, CvatImage] = {}
+    with zf.open(member) as fh:
+        for frame, img in enumerate(ijson.items(fh, "images.item", use_float=True)):
+            images[img["id"]] = CvatImage(
+                id=_image_id(task_id, frame),
+                name=img["file_name"],
+                width=int(img["width"]),
+                height=int(img["height"]),
+                task_id=task_id,
+            )
+
+    # CVAT writes annotations grouped by image, so flush whenever image_id changes
+    current: int | None = None
+    shapes: list[Shape] = []
+    emitted: set[int] = set()
+    with zf.open(member) as fh:
+        for ann in ijson.items(fh, "annotations.item", use_float=True):
+            if ann["image_id"] != current:
+                if current in images:
+                    yield images[current], shapes
+                    emitted.add(current)
+                current, shapes = ann["image_id"], []
+            label = categories.get(ann["category_id"], str(ann["category_id"]))
+            shapes.extend(_coco_shapes(label, ann))
+    if current in images:
+        yield images[current], shapes
+        emitted.add(current)
+    for coco_id, image in images.items():
+        if coco_id not in emitted:
+            yield image, []
+
+
+def detect_format(zf: zipfile.ZipFile) -> str:
+    """Return 'cvat_xml' or 'coco' based on the archive contents."""
+    names = zf.namelist()
+    if any(n.endswith("annotations.xml") for n in names):
+        return "cvat_xml"
+    if any(n.endswith(".json") for n in names):
+        return "coco"
+    raise HTTPException(status_code=400, detail="Archive has no annotations.xml or COCO JSON.")
+
+
+def import_export_archive(path: Path, task_id: int | None = None) -> CvatSyncResponse:
+    """Import a CVAT-for-images XML or COCO JSON export zip into the dataset.
+
+    Replaces the images and annotations of every task found in the archive
+    and leaves other tasks untouched. `task_id` is required for COCO, which
+    has no task metadata, and is the fallback for task-level XML exports.
+    """
+    try:
+        zf = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Upload is not a zip archive.")
+
+    with zf:
+        fmt = detect_format(zf)
+        if fmt == "coco":
+            if task_id is None:
+                raise HTTPException(status_code=400, detail="task_id is required for COCO imports.")
+            records = _iter_coco(zf, task_id)
+        else:
+            member = next(n for n in zf.namelist() if n.endswith("annotations.xml"))
+            records = _iter_cvat_xml(zf.open(member), task_id or 0)
+
+        images: dict[int, CvatImage] = {}
+        annotations: dict[int, list[CvatAnnotation]] = {}
+        next_ann_id: dict[int, int] = {}
+        for image, shapes in records:
+            images[image.id] = image
+            for label, shape_type, flat_points in shapes:
+                points, pixel_area = shape_geometry(shape_type, flat_points)
+                seq = next_ann_id.get(image.task_id, 0)
+                if seq == _ANNOTATION_ID_STRIDE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Task {image.task_id} has more than {_ANNOTATION_ID_STRIDE:,} shapes; "
+                        "their ids would collide with the next task's.",
+                    )
+                next_ann_id[image.task_id] = seq + 1
+                annotations.setdefault(image.id, []).append(CvatAnnotation(
+                    id=image.task_id * _ANNOTATION_ID_STRIDE + seq,
+                    image_id=image.id,
+                    label=label,
+                    points=points,
+                    pixel_area=pixel_area,
+                    shape_type=shape_type,
+                ))
+
+    replace_tasks({img.task_id for img in images.values()}, images, annotations)
+    return CvatSyncResponse(
+        images=list(images.values()),
+        annotations_count=sum(len(anns) for anns in annotations.values()),
+    )
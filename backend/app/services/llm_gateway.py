@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable
+
+from app.config import settings
+from app.services.single_flight import coalesce
+from app.services.store import db_path
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# One gateway for every chat-completions call (agent chat, expedition plans).
+# A single AsyncOpenAI client per event loop reuses its connection pool;
+# concurrent upstream calls are bounded by settings.llm_concurrency, each
+# attempt is capped at settings.llm_timeout_s and transient failures
+# (connection errors, timeouts, 429, 5xx) are retried with exponential
+# backoff. Calls made with cache=True (deterministic ones such as planning)
+# are answered from db/llm_cache/ when the endpoint, model, messages and
+# parameters match (so a fake or proxy endpoint never answers for the real one), and identical concurrent calls share one upstream request. Only
+# completions the caller's `validate` accepts are cached; the cache keeps at
+# most settings.llm_cache_max_entries files, none older than
+# settings.llm_cache_max_age_days.
+#
+# Point OPENAI_BASE_URL at loadtest.fake_openai to exercise it offline.
+
+CACHE_DIR = db_path("llm_cache")
+_DEFAULT_BASE_URL = "https://api.openai.com/v1"
+_RECENT_CALLS = 200
+
+_client: tuple[asyncio.AbstractEventLoop, "AsyncOpenAI", asyncio.Semaphore] | None = None
+_recent: deque[dict] = deque(maxlen=_RECENT_CALLS)
+_stats: dict[str, dict[str, float]] = {}  # purpose -> counters
+
+
+def _get_client() -> tuple["AsyncOpenAI", asyncio.Semaphore]:
+    """The shared client and concurrency limit, created on first use in this event loop."""
+    global _client
+    loop = asyncio.get_running_loop()
+    if _client is None or _client[0] is not loop:
+        from openai import AsyncOpenAI  # deferred: ~0.5 s to import, only chat and planning need it
+
+        client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+            timeout=settings.llm_timeout_s,
+            max_retries=0,  # retried here, so attempts show up in the metrics
+        )
+        _client = (loop, client, asyncio.Semaphore(settings.llm_concurrency))
+    return _client[1], _client[2]
+
+
+async def close() -> None:
+    """Close the pooled connections (app shutdown)."""
+    global _client
+    if _client is not None:
+        client = _client[1]
+        _client = None
+        await client.close()
+
+
+def cache_key(model: str, messages: list[dict], params: dict) -> str:
+    endpoint = (settings.openai_base_url or _DEFAULT_BASE_URL).rstrip("/")
+    payload = json.dumps(
+        {"endpoint": endpoint, "model": model, "messages": messages, "params": params}, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_read(key: str) -> dict | None:
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        if time.time() - path.stat().st_mtime > settings.llm_cache_max_age_days * 86400:
+            return None
+        return json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _cache_write(key: str, entry: dict) -> None:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = CACHE_DIR / f"{key}.json"
+    tmp = path.with_name(f".{key}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(entry))
+    os.replace(tmp, path)
+    _cache_prune()
+
+
+def _cache_prune() -> None:
+    """Delete expired entries, then the oldest ones beyond the entry limit."""
+    entries = []
+    for path in CACHE_DIR.glob("*.json"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except OSError:
+            continue  # removed by another worker
+    entries.sort(reverse=True)
+    cutoff = time.time() - settings.llm_cache_max_age_days * 86400
+    for i, (mtime, path) in enumerate(entries):
+        if i >= settings.llm_cache_max_entries or mtime < cutoff:
+            path.unlink(missing_ok=True)
+
+
+def _transient(exc: Exception) -> bool:
+    import openai
+
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(exc, openai.APIStatusError) and (status == 429 or status >= 500)
+
+
+async def _call_upstream(model: str, messages: list[dict], params: dict) -> dict:
+    """One completion from the API with retries; returns content, usage and attempt count."""
+    client, limit = _get_client()
+    for attempt in range(settings.llm_retries + 1):
+        try:
+            async with limit:
+                response = await client.chat.completions.create(model=model, messages=messages, **params)
+        except Exception as exc:
+            if not _transient(exc) or attempt == settings.llm_retries:
+                raise
+            await asyncio.sleep(settings.llm_backoff_s * 2**attempt * random.uniform(0.5, 1.5))
+            continue
+        usage = response.usage
+        return {
+            "content": response.choices[0].message.content,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "attempts": attempt + 1,
+        }
+    raise AssertionError("unreachable")
+
+
+def _record(purpose: str, model: str, started: float, result: dict | None, cached: bool, error: str | None) -> None:
+    latency_ms = (time.perf_counter() - started) * 1000
+    result = result or {}
+    call = {
+        "purpose": purpose,
+        "model": model,
+        "latency_ms": round(latency_ms, 1),
+        "prompt_tokens": 0 if cached else result.get("prompt_tokens", 0),
+        "completion_tokens": 0 if cached else result.get("completion_tokens", 0),
+        "attempts": 0 if cached else result.get("attempts", 0),
+        "cached": cached,
+        "error": error,
+    }
+    _recent.append(call)
+    stats = _stats.setdefault(purpose, {
+        "calls": 0, "cache_hits": 0, "errors": 0, "retries": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "upstream_ms": 0.0,
+    })
+    stats["calls"] += 1
+    stats["cache_hits"] += cached
+    stats["errors"] += error is not None
+    stats["retries"] += max(call["attempts"] - 1, 0)
+    stats["prompt_tokens"] += call["prompt_tokens"]
+    stats["completion_tokens"] += call["completion_tokens"]
+    if not cached and error is None:
+        stats["upstream_ms"] += latency_ms
+
+
+async def complete(
+    messages: list[dict],
+    *,
+    purpose: str,
+    model: str = "gpt-4o",
+    cache: bool = False,
+    validate: Callable[[str], Any] | None = None,
+    **params,
+) -> Any:
+    """Content of a chat completion. `params` go to the API (temperature, max_tokens, response_format...).
+
+    With `validate`, returns validate(content) instead; a completion it raises on
+    is neither returned nor cached. With `cache`, an identical earlier call (same
+    model, messages and params) is answered from disk; only use it where the same
+    inputs should give the same answer.
+    """
+    started = time.perf_counter()
+    check = validate or (lambda content: content)
+    key = cache_key(model, messages, params) if cache else None
+    if key is not None:
+        entry = await asyncio.to_thread(_cache_read, key)
+        if entry is not None:
+            try:
+                value = check(entry["content"])
+            except Exception:
+                pass  # cached before the caller's checks changed: fetch again
+            else:
+                _record(purpose, model, started, entry, cached=True, error=None)
+                return value
+
+    fetched = False
+
+    async def fetch() -> tuple[dict, Any]:
+        nonlocal fetched
+        fetched = True
+        result = await _call_upstream(model, messages, params)
+        value = check(result["content"])
+        if key is not None:
+            await asyncio.to_thread(_cache_write, key, {"model": model, **result})
+        return result, value
+
+    try:
+        result, value = await coalesce("llm", key, fetch) if key is not None else await fetch()
+    except Exception as exc:
+        _record(purpose, model, started, None, cached=False, error=type(exc).__name__)
+        raise
+    # Callers that joined another's identical request count as cache hits: no tokens spent
+    _record(purpose, model, started, result, cached=not fetched, error=None)
+    return value
+
+
+def get_llm_stats() -> dict:
+    """Per-purpose counters plus the most recent calls (newest last)."""
+    purposes = {}
+    for purpose, stats in _stats.items():
+        upstream = stats["calls"] - stats["cache_hits"] - stats["errors"]
+        purposes[purpose] = {
+            **{k: int(v) for k, v in stats.items() if k != "upstream_ms"},
+            "avg_upstream_ms": round(stats["upstream_ms"] / upstream, 1) if upstream else None,
+        }
+    latencies = sorted(c["latency_ms"] for c in _recent if not c["cached"] and c["error"] is None)
+    return {
+        "concurrency": settings.llm_concurrency,
+        "purposes": purposes,
+        "recent_p50_ms": latencies[len(latencies) // 2] if latencies else None,
+        "recent_p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        "recent": list(_recent),
+    }
@@ -0,0 +1,246 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.models.schemas import ImageNeighbors, MosaicGridInfo, MosaicNeighbor
+from app.services.cvat_service import Dataset, get_dataset
+from app.services.single_flight import coalesce_sync
+from app.services.store import load_columns, locked, save_columns
+
+# Grid layout of each task's mosaic: (task, column, row) -> image ids, from the
+# _y<row>_x<col> pixel offsets in frame names. Cells are the task's offset pitch
+# (frames usually overlap, so the pitch is below the frame size), so neighbour
+# lookups are array slices and pixel-rectangle queries only touch the cells the
+# rectangle covers. Offsets off the pitch (a shifted edge column) can put
+# several frames in one cell, so cells are stored CSR-style: the ids of cell k
+# are cell_ids[cell_start[k]:cell_start[k + 1]], cells numbered row-major.
+#
+# Filenames are parsed once per dataset snapshot; the parsed offsets are saved
+# to db/mosaic_index.snap keyed by the db/cvat.snap they came from, so other
+# workers and restarts reuse them until the next sync or import.
+
+_SNAPSHOT = "mosaic_index.snap"
+_FILENAME_PATTERN = re.compile(r"_y(\d+)_x(\d+)\.")
+
+
+def parse_pixel_offsets(filename: str) -> tuple[int, int] | None:
+    """Extract (x_pixels, y_pixels) from a filename like '1-5_y23100_x15708.jpg'."""
+    m = _FILENAME_PATTERN.search(filename)
+    if not m:
+        return None
+    y_px = int(m.group(1))
+    x_px = int(m.group(2))
+    return (x_px, y_px)
+
+
+@dataclass(frozen=True)
+class MosaicGrid:
+    task_id: int
+    tile_width: int  # cell size: the most common step between frame offsets
+    tile_height: int
+    reach_cols: int  # cells a frame's footprint can span from its own
+    reach_rows: int
+    col0: int  # grid column of the first cell in each row
+    row0: int  # grid row of the first row of cells
+    rows: int
+    cols: int
+    cell_start: np.ndarray  # (rows * cols + 1) offsets into cell_ids
+    cell_ids: np.ndarray  # image ids grouped by cell, ascending within a cell
+    extent_px: tuple[int, int, int, int]  # x0, y0, x1, y1 covered by the task's frames
+    tiles: int
+    collisions: int  # frames sharing a cell with another frame
+
+    def ids_in(self, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+        """Ids in cells [r0, r1) x [c0, c1) (grid-relative): one contiguous slice per row."""
+        starts = self.cell_start
+        parts = [
+            self.cell_ids[starts[r * self.cols + c0]:starts[r * self.cols + c1]] for r in range(r0, r1)
+        ]
+        return np.concatenate(parts) if parts else self.cell_ids[:0]
+
+
+@dataclass(frozen=True)
+class _Index:
+    version: int
+    ids: np.ndarray  # sorted image ids of frames with offsets; the columns below align with it
+    task: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    width: np.ndarray
+    height: np.ndarray
+    col: np.ndarray
+    row: np.ndarray
+    grids: dict[int, MosaicGrid]
+
+    def find(self, image_id: int) -> int | None:
+        i = int(np.searchsorted(self.ids, image_id))
+        return i if i < len(self.ids) and self.ids[i] == image_id else None
+
+
+_index: _Index | None = None
+
+
+def _parse(dataset: Dataset) -> dict[str, np.ndarray]:
+    rows = []
+    for image_id, image in dataset.images.items():
+        offsets = parse_pixel_offsets(image.name)
+        if offsets is not None and image.width and image.height:
+            rows.append((image_id, image.task_id, *offsets, image.width, image.height))
+    rows.sort()
+    table = np.array(rows, dtype=np.int64).reshape(len(rows), 6)
+    return dict(zip(("image_id", "task_id", "x", "y", "width", "height"), table.T))
+
+
+def _offset_columns(dataset: Dataset) -> dict[str, np.ndarray]:
+    """Parsed offsets for `dataset`, from db/mosaic_index.snap when it matches, else parsed and saved."""
+    token = list(dataset.snapshot_token) if dataset.snapshot_token else None
+    if token is not None:
+        snapshot = load_columns(_SNAPSHOT)
+        if snapshot is not None and snapshot[1].get("dataset_token") == token:
+            return snapshot[0]
+    cols = _parse(dataset)
+    if token is not None:
+        with locked(_SNAPSHOT):
+            save_columns(_SNAPSHOT, cols, {"dataset_token": token})
+    return cols
+
+
+def _most_common(values: np.ndarray) -> int:
+    uniq, counts = np.unique(values, return_counts=True)
+    return int(uniq[np.argmax(counts)])
+
+
+def _pitch(offsets: np.ndarray, sizes: np.ndarray) -> int:
+    steps = np.diff(np.unique(offsets))
+    return _most_common(steps) if len(steps) else _most_common(sizes)
+
+
+def _build(dataset: Dataset) -> _Index:
+    cols = _offset_columns(dataset)
+    ids, task = cols["image_id"], cols["task_id"]
+    x, y, width, height = cols["x"], cols["y"], cols["width"], cols["height"]
+    col = np.zeros(len(ids), dtype=np.int64)
+    row = np.zeros(len(ids), dtype=np.int64)
+    grids: dict[int, MosaicGrid] = {}
+    for task_id in np.unique(task).tolist():
+        members = np.flatnonzero(task == task_id)
+        tile_w, tile_h = _pitch(x[members], width[members]), _pitch(y[members], height[members])
+        col[members] = x[members] // tile_w
+        row[members] = y[members] // tile_h
+        c, r = col[members], row[members]
+        n_rows, n_cols = int(r.max() - r.min()) + 1, int(c.max() - c.min()) + 1
+        cell = (r - r.min()) * n_cols + (c - c.min())
+        order = np.lexsort((ids[members], cell))  # by cell, then id (members are id-sorted already)
+        counts = np.bincount(cell, minlength=n_rows * n_cols)
+        cell_start = np.zeros(n_rows * n_cols + 1, dtype=np.int64)
+        np.cumsum(counts, out=cell_start[1:])
+        grids[task_id] = MosaicGrid(
+            task_id=task_id,
+            tile_width=tile_w,
+            tile_height=tile_h,
+            reach_cols=-(-int(width[members].max()) // tile_w),
+            reach_rows=-(-int(height[members].max()) // tile_h),
+            col0=int(c.min()),
+            row0=int(r.min()),
+            rows=n_rows,
+            cols=n_cols,
+            cell_start=cell_start,
+            cell_ids=ids[members][order],
+            extent_px=(
+                int(x[members].min()), int(y[members].min()),
+                int((x[members] + width[members]).max()), int((y[members] + height[members]).max()),
+            ),
+            tiles=len(members),
+            collisions=int(counts[counts > 1].sum()),
+        )
+    return _Index(dataset.version, ids, task, x, y, width, height, col, row, grids)
+
+
+def get_index() -> _Index:
+    """The index for the current dataset, rebuilt (once, across threads) when it changes."""
+    global _index
+    dataset = get_dataset()
+    index = _index
+    if index is not None and index.version == dataset.version:
+        return index
+    index = coalesce_sync("mosaic_index", dataset.version, lambda: _build(dataset))
+    _index = index
+    return index
+
+
+def pixel_offsets(image_id: int) -> tuple[int, int] | None:
+    """(x, y) of a frame in its task's mosaic, in pixels, or None if its name carries none."""
+    index = get_index()
+    i = index.find(image_id)
+    return (int(index.x[i]), int(index.y[i])) if i is not None else None
+
+
+def get_grid(task_id: int) -> MosaicGrid:
+    grid = get_index().grids.get(task_id)
+    if grid is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} has no frames with mosaic offsets.")
+    return grid
+
+
+def image_position(image_id: int) -> tuple[int, int, int, int, int]:
+    """(task_id, column, row, x_px, y_px) of a frame; 404 if it has no mosaic position."""
+    index = get_index()
+    i = index.find(image_id)
+    if i is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_id} has no mosaic position.")
+    return int(index.task[i]), int(index.col[i]), int(index.row[i]), int(index.x[i]), int(index.y[i])
+
+
+def neighbours(image_id: int, radius: int = 1) -> list[tuple[int, int, int]]:
+    """(image_id, d_col, d_row) of the frames within `radius` cells of `image_id`."""
+    task_id, col, row, _, _ = image_position(image_id)
+    index = get_index()
+    grid = index.grids[task_id]
+    r0, r1 = max(row - radius - grid.row0, 0), min(row + radius - grid.row0 + 1, grid.rows)
+    c0, c1 = max(col - radius - grid.col0, 0), min(col + radius - grid.col0 + 1, grid.cols)
+    others = grid.ids_in(r0, r1, c0, c1)
+    others = others[others != image_id]
+    at = np.searchsorted(index.ids, others)
+    return [
+        (int(other), int(c) - col, int(r) - row)
+        for other, c, r in zip(others, index.col[at], index.row[at])
+    ]
+
+
+def tiles_in_rect(task_id: int, x0: int, y0: int, x1: int, y1: int) -> list[int]:
+    """Ids of a task's frames whose footprint intersects the mosaic-pixel rectangle [x0, x1) x [y0, y1)."""
+    grid = get_grid(task_id)
+    index = get_index()
+    rows, cols = grid.rows, grid.cols
+    # A frame starts inside its own cell and can reach `reach` cells further
+    c0 = max(x0 // grid.tile_width - grid.reach_cols - grid.col0, 0)
+    c1 = min((x1 - 1) // grid.tile_width + 1 - grid.col0, cols)
+    r0 = max(y0 // grid.tile_height - grid.reach_rows - grid.row0, 0)
+    r1 = min((y1 - 1) // grid.tile_height + 1 - grid.row0, rows)
+    if c0 >= c1 or r0 >= r1:
+        return []
+    candidates = grid.ids_in(r0, r1, c0, c1)
+    rows_idx = np.searchsorted(index.ids, candidates)
+    hit = (
+        (index.x[rows_idx] < x1) & (index.x[rows_idx] + index.width[rows_idx] > x0)
+        & (index.y[rows_idx] < y1) & (index.y[rows_idx] + index.height[rows_idx] > y0)
+    )
+    return sorted(int(i) for i in candidates[hit])
+
+
+def get_image_neighbors(image_id: int, radius: int = 1) -> ImageNeighbors:
+    task_id, col, row, x_px, y_px = image_position(image_id)
+    return ImageNeighbors(
+        image_id=image_id, task_id=task_id, col=col, row=row, x_px=x_px, y_px=y_px,
+        neighbors=[MosaicNeighbor(image_id=i, d_col=dc, d_row=dr) for i, dc, dr in neighbours(image_id, radius)],
+    )
+
+
+def get_grid_info(task_id: int) -> MosaicGridInfo:
+    grid = get_grid(task_id)
+    return MosaicGridInfo(
+        task_id=task_id, tile_width=grid.tile_width, tile_height=grid.tile_height, cols=grid.cols, rows=grid.rows,
+        tiles=grid.tiles, collisions=grid.collisions, extent_px=list(grid.extent_px),
+    )
@@ -0,0 +1,216 @@
+import json
+import math
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from fastapi import HTTPException
+from PIL import Image
+
+from app.services.cvat_service import get_dataset
+from app.services.frame_cache import decoded_frame, frame_index
+from app.services.geo_service import get_all_georefs
+from app.services.store import db_path, locked
+
+# Stitches a task's georeferenced frames into an XYZ (web mercator) PNG tile
+# pyramid under db/mosaic/<task_id>/{z}/{x}/{y}.png. The native zoom is rendered
+# tile by tile from memory-mapped decoded frames; each overview level is built
+# from the four child tiles below it, so at most one 512x512 window is in RAM.
+
+TILE_PX = 256
+MAX_ZOOM = 23  # the map's own maxZoom
+MOSAIC_DIR = db_path("mosaic")
+_EARTH_M_PER_PX_Z0 = 156_543.033_93  # web mercator ground resolution at zoom 0, equator
+
+
+@dataclass(frozen=True)
+class _Frame:
+    task_id: int
+    frame: int
+    width: int
+    height: int
+    west: float
+    north: float
+    res_lat: float  # degrees of latitude per pixel
+    res_lng: float  # degrees of longitude per pixel: res_lat / cos(lat), as in geo_service
+
+    @property
+    def east(self) -> float:
+        return self.west + self.width * self.res_lng
+
+    @property
+    def south(self) -> float:
+        return self.north - self.height * self.res_lat
+
+
+def _task_frames(task_id: int) -> list[_Frame]:
+    dataset = get_dataset()
+    frames: list[_Frame] = []
+    for image_id, georef in get_all_georefs().items():
+        image = dataset.images.get(image_id)
+        if image is None or image.task_id != task_id:
+            continue
+        res_lat = georef.ground_resolution_cm_per_pixel / 100 / 111_320
+        res_lng = res_lat / math.cos(math.radians(georef.center.lat))
+        frames.append(_Frame(
+            task_id=task_id,
+            frame=frame_index(image_id, task_id),
+            width=image.width,
+            height=image.height,
+            west=georef.center.lng - image.width / 2 * res_lng,
+            north=georef.center.lat + image.height / 2 * res_lat,
+            res_lat=res_lat,
+            res_lng=res_lng,
+        ))
+    return frames
+
+
+def _tile_x(lng: float, z: int) -> float:
+    return (lng + 180.0) / 360.0 * 2**z
+
+
+def _tile_y(lat: float, z: int) -> float:
+    return (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * 2**z
+
+
+def _native_zoom(frames: list[_Frame]) -> int:
+    """Deepest zoom whose pixels are no finer than the frames' ground resolution."""
+    res_m = min(f.res_lat for f in frames) * 111_320
+    lat = math.radians(sum(f.north for f in frames) / len(frames))
+    return max(0, min(MAX_ZOOM, math.floor(math.log2(_EARTH_M_PER_PX_Z0 * math.cos(lat) / res_m))))
+
+
+def _render_tile(frames: list[_Frame], z: int, tx: int, ty: int) -> np.ndarray | None:
+    """Sample a native-zoom tile (nearest neighbour) from the frames that overlap it."""
+    n = 2**z
+    steps = (np.arange(TILE_PX) + 0.5) / TILE_PX
+    lng = (tx + steps) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ty + steps) / n))))
+
+    out = np.zeros((TILE_PX, TILE_PX, 4), dtype=np.uint8)
+    for f in frames:
+        if f.east < lng[0] or f.west > lng[-1] or f.south > lat[0] or f.north < lat[-1]:
+            continue
+        cols = np.floor((lng - f.west) / f.res_lng).astype(np.int64)
+        rows = np.floor((f.north - lat) / f.res_lat).astype(np.int64)
+        ci = np.flatnonzero((cols >= 0) & (cols < f.width))
+        ri = np.flatnonzero((rows >= 0) & (rows < f.height))
+        if not len(ci) or not len(ri):
+            continue
+        # Fancy indexing a memmap only pages in the rows this tile touches
+        pixels = decoded_frame(f.task_id, f.frame)[np.ix_(rows[ri], cols[ci])]
+        window = np.ix_(ri, ci)
+        out[..., :3][window] = pixels
+        out[..., 3][window] = 255
+    return out if out[..., 3].any() else None
+
+
+def _save_tile(root: Path, z: int, x: int, y: int, rgba: np.ndarray) -> None:
+    path = root / str(z) / str(x) / f"{y}.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(rgba, "RGBA").save(path, optimize=True)
+
+
+def _build_overview(root: Path, z: int, x: int, y: int) -> np.ndarray:
+    """Downsample the (up to four) child tiles of (z, x, y) into one tile."""
+    window = np.zeros((2 * TILE_PX, 2 * TILE_PX, 4), dtype=np.uint8)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            child = root / str(z + 1) / str(2 * x + dx) / f"{2 * y + dy}.png"
+            if child.exists():
+                with Image.open(child) as img:
+                    window[dy * TILE_PX:(dy + 1) * TILE_PX, dx * TILE_PX:(dx + 1) * TILE_PX] = np.asarray(img)
+    return np.asarray(Image.fromarray(window, "RGBA").reduce(2))
+
+
+def build_mosaic(task_id: int, progress: Callable[[int, int], None] | None = None) -> dict:
+    """(Re)build the tile pyramid for one task and return its metadata.
+
+    `progress(zoom, tiles_written)` is called after each zoom level.
+    """
+    frames = _task_frames(task_id)
+    if not frames:
+        raise HTTPException(status_code=400, detail=f"Task {task_id} has no georeferenced images.")
+
+    started = time.perf_counter()
+    west = min(f.west for f in frames)
+    east = max(f.east for f in frames)
+    south = min(f.south for f in frames)
+    north = max(f.north for f in frames)
+    max_zoom = _native_zoom(frames)
+
+    with locked(f"mosaic-{task_id}"):
+        MOSAIC_DIR.mkdir(parents=True, exist_ok=True)
+        build = MOSAIC_DIR / f".{task_id}.{os.getpid()}.build"
+        shutil.rmtree(build, ignore_errors=True)
+
+        level: set[tuple[int, int]] = set()
+        x0, x1 = int(_tile_x(west, max_zoom)), int(_tile_x(east, max_zoom))
+        y0, y1 = int(_tile_y(north, max_zoom)), int(_tile_y(south, max_zoom))
+        for tx in range(x0, x1 + 1):
+            for ty in range(y0, y1 + 1):
+                rgba = _render_tile(frames, max_zoom, tx, ty)
+                if rgba is not None:
+                    _save_tile(build, max_zoom, tx, ty, rgba)
+                    level.add((tx, ty))
+        tiles = len(level)
+        if progress:
+            progress(max_zoom, len(level))
+
+        # Overviews down to the first zoom where the whole task fits one tile
+        min_zoom = max_zoom
+        while min_zoom > 0 and len(level) > 1:
+            min_zoom -= 1
+            level = {(tx // 2, ty // 2) for tx, ty in level}
+            for tx, ty in level:
+                _save_tile(build, min_zoom, tx, ty, _build_overview(build, min_zoom, tx, ty))
+            tiles += len(level)
+            if progress:
+                progress(min_zoom, len(level))
+
+        info = {
+            "task_id": task_id,
+            "bounds": [west, south, east, north],
+            "min_zoom": min_zoom,
+            "max_zoom": max_zoom,
+            "frames": len(frames),
+            "tiles": tiles,
+            "built_at": time.time(),
+            "build_s": round(time.perf_counter() - started, 3),
+        }
+        (build / "mosaic.json").write_text(json.dumps(info, indent=2))
+
+        # Swap the finished pyramid in; tile readers see either old or new files
+        target = MOSAIC_DIR / str(task_id)
+        old = MOSAIC_DIR / f".{task_id}.{os.getpid()}.old"
+        if target.exists():
+            os.replace(target, old)
+        os.replace(build, target)
+        shutil.rmtree(old, ignore_errors=True)
+    return info
+
+
+def get_mosaic_info(task_id: int) -> dict | None:
+    path = MOSAIC_DIR / str(task_id) / "mosaic.json"
+    try:
+        return json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def list_mosaics() -> list[dict]:
+    """Metadata of every built mosaic, for the map to add as tile layers."""
+    if not MOSAIC_DIR.exists():
+        return []
+    infos = [get_mosaic_info(int(p.name)) for p in MOSAIC_DIR.iterdir() if p.name.isdigit()]
+    return sorted((i for i in infos if i), key=lambda i: i["task_id"])
+
+
+def tile_path(task_id: int, z: int, x: int, y: int) -> Path | None:
+    """Path of a built tile, or None if the pyramid has no tile there."""
+    path = MOSAIC_DIR / str(task_id) / str(z) / str(x) / f"{y}.png"
+    return path if path.exists() else None
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from itertools import count
+from typing import Hashable
+
+from app.config import settings
+from app.services.survey_service import get_survey
+
+# Residency of decoded dataset rows, partitioned by site. The dataset snapshot
+# is memory-mapped, so rows cost nothing until read; what grows is the
+# pydantic objects built from them. Those are memoised per partition (a site,
+# or a lone task with no survey recorded) and partitions are evicted least
+# recently used once their estimated size exceeds settings.partition_memory_mb.
+# An evicted partition is rebuilt from the mapped columns on its next access;
+# objects already handed to a reader stay valid.
+
+
+class Partition:
+    __slots__ = ("key", "memos", "bytes", "evicted")
+
+    def __init__(self, key: tuple[int, Hashable]):
+        self.key = key
+        self.memos: dict[str, dict] = {}  # mapping kind -> key -> built object
+        self.bytes = 0
+        self.evicted = False  # set once dropped; holders must ask partition() again
+
+
+_lock = threading.Lock()
+_resident: OrderedDict[tuple[int, Hashable], Partition] = OrderedDict()
+_bytes = 0
+_generations = count(1)
+_stats = {"loads": 0, "evictions": 0, "evicted_bytes": 0}
+
+
+def partition_of(task_id: int) -> Hashable:
+    """Partition key of a task: its survey's site, or the task itself if it has none."""
+    survey = get_survey(task_id)
+    return survey.site if survey else f"task:{task_id}"
+
+
+def new_generation() -> int:
+    """Key for the partitions of one opened snapshot, so rows of different snapshots never mix."""
+    return next(_generations)
+
+
+def partition(generation: int, task_id: int) -> Partition:
+    """The task's resident partition, created on first access and marked most recently used."""
+    key = (generation, partition_of(task_id))
+    with _lock:
+        part = _resident.get(key)
+        if part is None:
+            part = _resident[key] = Partition(key)
+            _stats["loads"] += 1
+        else:
+            _resident.move_to_end(key)
+        return part
+
+
+def charge(part: Partition, nbytes: int) -> None:
+    """Account a newly built object and evict least recently used partitions over budget."""
+    global _bytes
+    budget = settings.partition_memory_mb * 1024 * 1024
+    with _lock:
+        if part.evicted:
+            return  # dropped while the object was being built
+        part.bytes += nbytes
+        _bytes += nbytes
+        # The partition being read goes last, so it is never evicted, even alone over budget
+        _resident.move_to_end(part.key)
+        while _bytes > budget and len(_resident) > 1:
+            old = next(iter(_resident.values()))
+            _drop(old)
+            _stats["evictions"] += 1
+            _stats["evicted_bytes"] += old.bytes
+
+
+def _drop(part: Partition) -> None:
+    global _bytes
+    del _resident[part.key]
+    _bytes -= part.bytes
+    part.evicted = True
+
+
+def release(generation: int) -> None:
+    """Drop the partitions of a snapshot that has been replaced."""
+    with _lock:
+        for part in [p for k, p in _resident.items() if k[0] == generation]:
+            _drop(part)
+
+
+def get_partition_stats() -> dict:
+    with _lock:
+        resident = [
+            {"generation": gen, "partition": part, "mb": round(p.bytes / 2**20, 2)}
+            for (gen, part), p in reversed(_resident.items())
+        ]
+        total = _bytes
+        loads, evictions, evicted = _stats["loads"], _stats["evictions"], _stats["evicted_bytes"]
+    return {
+        "budget_mb": settings.partition_memory_mb,
+        "resident_mb": round(total / 2**20, 2),
+        "loads": loads,
+        "evictions": evictions,
+        "evicted_mb": round(evicted / 2**20, 2),
+        "resident": resident,  # most recently used first
+    }
@@ -1,20 +1,15 @@
 import json
 
-from openai import AsyncOpenAI
-
-from app.config import settings
 from app.models.schemas import (
     PlanExpeditionRequest,
     ExpeditionPlan,
     VesselRecommendation,
     EmployeeAssignment,
 )
-from app.services.cvat_service import get_cached_images, get_cached_annotations
+from app.services.cvat_service import get_dataset
+from app.services.density_model import area_cm2, weight_g
 from app.services.employee_service import list_employees
-
-# Constants from spec (same as analysis_service)
-AREA_PER_PIXEL_CM2 = 0.25  # (0.5 cm/pixel)^2
-WEIGHT_PER_PIXEL_G = 0.12  # 0.25 cm^2 * 0.48 g/cm^2
+from app.services.llm_gateway import complete
 
 PLANNING_SYSTEM_PROMPT = """\
 You are an expedition planning agent for ocean plastic cleanup operations.
@@ -43,7 +38,8 @@ Return ONLY valid JSON matching this schema:
 
 async def generate_expedition_plan(request: PlanExpeditionRequest) -> ExpeditionPlan:
     """Use OpenAI to generate an expedition plan from analysis data + employee directory."""
-    images = get_cached_images()
+    dataset = get_dataset()
+    images = dataset.images
     employees = await list_employees()
 
     # Aggregate metrics directly from persisted annotations
@@ -53,12 +49,12 @@ async def generate_expedition_plan(request: PlanExpeditionRequest) -> Expedition
 
     target_ids = request.image_ids or list(images.keys())
     for iid in target_ids:
-        annotations = get_cached_annotations(iid)
-        if not annotations:
+        img = images.get(iid)
+        if img is None or not dataset.annotations_for(iid):
             continue
-        total_pixels = sum((ann.pixel_area or 0) for ann in annotations)
-        total_weight_kg += total_pixels * WEIGHT_PER_PIXEL_G / 1000.0
-        total_area_cm2 += total_pixels * AREA_PER_PIXEL_CM2
+        label_pixels = dataset.label_pixels_for(iid)
+        total_weight_kg += weight_g(label_pixels, img.task_id) / 1000.0
+        total_area_cm2 += area_cm2(sum(label_pixels.values()), img.task_id)
         image_count += 1
 
     total_area_m2 = total_area_cm2 / 10_000
@@ -72,16 +68,19 @@ async def generate_expedition_plan(request: PlanExpeditionRequest) -> Expedition
         "employees": [e.model_dump() for e in employees],
     })
 
-    client = AsyncOpenAI(api_key=settings.openai_api_key)
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    # Same data, roster and notes -> same plan: answered from the gateway's disk cache
+    return await complete(
+        [
             {"role": "system", "content": PLANNING_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt},
         ],
+        purpose="plan",
+        cache=True,
+        validate=_parse_plan,
         response_format={"type": "json_object"},
         temperature=0.3,
     )
 
-    plan_data = json.loads(response.choices[0].message.content)
-    return ExpeditionPlan(**plan_data)
+
+def _parse_plan(content: str) -> ExpeditionPlan:
+    return ExpeditionPlan(**json.loads(content))
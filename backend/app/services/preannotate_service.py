@@ -0,0 +1,156 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+import shapely
+from PIL import Image
+
+from app.config import settings
+from app.models.schemas import CvatAnnotation, CvatImage
+from app.services.cvat_service import get_dataset, set_proposed_annotations
+from app.services.frame_cache import cached_frame_path, frame_index
+from app.services.store import load_json, save_json
+
+# CPU pre-annotation for tiles nobody has labelled yet. A classical colour
+# classifier runs per tile in a process pool; the per-frame mask is vectorised
+# into polygons on a coarse cell grid and stored as proposed annotations for
+# review in CVAT. Progress is checkpointed per batch so a rerun resumes.
+
+TILE_SIZE = 512  # classifier window; each tile gets its own background estimate
+CELL_PX = 8  # mask -> polygon grid; a cell is debris if half its pixels are
+MIN_AREA_PX = 400  # drop specks smaller than ~20x20 px
+COLOUR_DISTANCE = 60.0  # RGB distance from the tile background that counts as debris
+BATCH_SIZE = 32  # frames per pool round-trip and per checkpoint
+MAX_PROPOSALS_PER_IMAGE = 1000
+
+# Proposed shapes have no CVAT id; keep them clear of CVAT's and imported ids
+_PROPOSED_ID_BASE = 10**15
+_CHECKPOINT = "preannotate.json"
+
+
+def classify_tile(rgb: np.ndarray) -> np.ndarray:
+    """Debris mask for one RGB tile: pixels far in colour from the tile's dominant
+    background (sand), excluding blue/cyan water."""
+    pixels = rgb.astype(np.float32)
+    background = np.median(pixels.reshape(-1, 3), axis=0)
+    distance = np.linalg.norm(pixels - background, axis=-1)
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    water = (b > r + 20) & (b >= g - 10)
+    return (distance > COLOUR_DISTANCE) & ~water
+
+
+def mask_to_polygons(mask: np.ndarray, cell: int = CELL_PX) -> list[tuple[list[list[float]], float]]:
+    """Vectorise a bool mask into (outline, pixel area) pairs on a `cell`-pixel grid."""
+    h, w = mask.shape
+    ch, cw = h // cell, w // cell
+    cells = mask[:ch * cell, :cw * cell].reshape(ch, cell, cw, cell).mean(axis=(1, 3)) >= 0.5
+    ys, xs = np.nonzero(cells)
+    if not len(xs):
+        return []
+    boxes = shapely.box(xs * cell, ys * cell, (xs + 1) * cell, (ys + 1) * cell)
+    merged = shapely.union_all(boxes).simplify(cell / 2)
+
+    polygons = []
+    for poly in getattr(merged, "geoms", [merged]):
+        if poly.geom_type != "Polygon":
+            continue
+        # Outlines are exterior-only, so measure the filled exterior
+        area = shapely.Polygon(poly.exterior).area
+        if area < MIN_AREA_PX:
+            continue
+        polygons.append(([[float(x), float(y)] for x, y in poly.exterior.coords[:-1]], area))
+    return polygons
+
+
+def _propose_frame(job: tuple[int, str]) -> tuple[int, int, list[tuple[list[list[float]], float]]]:
+    """Pool worker: (image_id, frame path) -> (image_id, tiles classified, polygons)."""
+    image_id, path = job
+    with Image.open(path) as img:
+        rgb = np.asarray(img.convert("RGB"))
+    h, w = rgb.shape[:2]
+    mask = np.zeros((h, w), dtype=bool)
+    tiles = 0
+    for y in range(0, h, TILE_SIZE):
+        for x in range(0, w, TILE_SIZE):
+            mask[y:y + TILE_SIZE, x:x + TILE_SIZE] = classify_tile(rgb[y:y + TILE_SIZE, x:x + TILE_SIZE])
+            tiles += 1
+    return image_id, tiles, mask_to_polygons(mask)
+
+
+def _load_checkpoint() -> dict[int, int]:
+    """image_id -> number of shapes proposed, for every image already processed."""
+    return {int(k): v for k, v in load_json(_CHECKPOINT).get("done", {}).items()}
+
+
+def _pending_images(task_id: int | None, checkpoint: dict[int, int]) -> tuple[list[CvatImage], int]:
+    """Unlabelled images still to process, and how many were skipped as already done."""
+    dataset = get_dataset()
+    pending: list[CvatImage] = []
+    skipped = 0
+    for image_id, image in dataset.images.items():
+        if task_id is not None and image.task_id != task_id:
+            continue
+        anns = dataset.annotations_for(image_id)
+        if any(not a.proposed for a in anns):
+            continue  # a human has labelled it
+        # Done only if its proposals are still there (a re-sync drops them)
+        if image_id in checkpoint and (anns or checkpoint[image_id] == 0):
+            skipped += 1
+            continue
+        pending.append(image)
+    return pending, skipped
+
+
+def run_preannotation(
+    task_id: int | None = None,
+    workers: int | None = None,
+    batch_size: int = BATCH_SIZE,
+    restart: bool = False,
+    progress: Callable[[dict], None] | None = None,
+) -> dict:
+    """Propose shapes for every unlabelled image, resuming from the last checkpoint.
+
+    Returns counts plus elapsed seconds and throughput in tiles per second;
+    `progress` receives the same dict after every batch.
+    """
+    checkpoint = {} if restart else _load_checkpoint()
+    pending, skipped = _pending_images(task_id, checkpoint)
+    workers = workers or settings.preannotate_workers or os.cpu_count() or 1
+    stats = {"images": 0, "tiles": 0, "proposed": 0, "skipped": skipped, "elapsed_s": 0.0, "tiles_per_s": 0.0}
+
+    def fetch(image: CvatImage) -> tuple[int, str]:
+        return image.id, str(cached_frame_path(image.task_id, frame_index(image.id, image.task_id)))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=8) as io:
+        for i in range(0, len(pending), batch_size):
+            jobs = list(io.map(fetch, pending[i:i + batch_size]))
+            proposals: dict[int, list[CvatAnnotation]] = {}
+            for image_id, tiles, polygons in pool.map(_propose_frame, jobs):
+                proposals[image_id] = [
+                    CvatAnnotation(
+                        id=_PROPOSED_ID_BASE + image_id * MAX_PROPOSALS_PER_IMAGE + n,
+                        image_id=image_id,
+                        label=settings.preannotate_label,
+                        points=points,
+                        pixel_area=area,
+                        proposed=True,
+                    )
+                    for n, (points, area) in enumerate(polygons[:MAX_PROPOSALS_PER_IMAGE])
+                ]
+                stats["tiles"] += tiles
+
+            set_proposed_annotations(proposals)
+            for image_id, anns in proposals.items():
+                checkpoint[image_id] = len(anns)
+            save_json(_CHECKPOINT, {"done": {str(k): v for k, v in checkpoint.items()}})
+
+            stats["images"] += len(proposals)
+            stats["proposed"] += sum(len(anns) for anns in proposals.values())
+            stats["elapsed_s"] = round(time.perf_counter() - start, 3)
+            stats["tiles_per_s"] = round(stats["tiles"] / stats["elapsed_s"], 2) if stats["elapsed_s"] else 0.0
+            if progress:
+                progress(dict(stats))
+    return stats
@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.services.cvat_service import get_dataset
+from app.services.frame_cache import cached_frame, cached_frame_path, frame_index
+from app.services.image_index import query_images
+from app.services.mosaic_index import neighbours
+
+# Warms the on-disk frame cache ahead of requests. A bounded pool of asyncio
+# workers drains a priority queue of (task_id, frame) jobs; each job belongs to
+# a group, and scheduling a group again cancels its still-queued jobs, so a
+# user who pages or pans on only ever waits behind work for the current view.
+
+PRIORITY_VISIBLE = 0  # frames of the listing page being shown
+PRIORITY_NEIGHBOUR = 10  # mosaic neighbours of a frame just viewed
+PRIORITY_NEXT_PAGE = 20  # frames of the listing's next page
+PRIORITY_HOTSPOT = 30  # heaviest images, warmed in the background
+
+_PREFETCHED_MAX = 10_000  # warmed frames remembered for prefetch_hits; oldest forgotten first
+
+FrameKey = tuple[int, int]  # (task_id, frame)
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    key: FrameKey = field(compare=False)
+    group: str = field(compare=False)
+    generation: int = field(compare=False)
+
+
+_queue: asyncio.PriorityQueue | None = None
+_workers: list[asyncio.Task] = []
+_seq = itertools.count()
+_queued: dict[FrameKey, _Job] = {}  # latest live job per frame
+_generation: dict[str, int] = {}  # bumped to cancel a group's queued jobs
+_prefetched: dict[FrameKey, None] = {}  # warmed but not yet requested, oldest first
+_hotspot_version: int | None = None
+
+_stats = {
+    "requests": 0,
+    "hits": 0,
+    "misses": 0,
+    "prefetch_hits": 0,  # hits on frames the prefetcher warmed
+    "scheduled": 0,
+    "completed": 0,
+    "already_cached": 0,
+    "cancelled": 0,
+    "dropped": 0,  # queue full
+    "failed": 0,
+    "in_flight": 0,
+}
+
+
+def start_prefetcher() -> None:
+    """Start the worker pool (app startup)."""
+    global _queue
+    if not settings.prefetch_enabled or _workers:
+        return
+    _queue = asyncio.PriorityQueue(maxsize=settings.prefetch_queue_size)
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(settings.prefetch_concurrency))
+
+
+async def stop_prefetcher() -> None:
+    """Cancel the workers (app shutdown); in-flight downloads finish in their threads."""
+    global _queue
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queued.clear()
+    _queue = None
+
+
+def _is_live(job: _Job) -> bool:
+    return _queued.get(job.key) is job and _generation.get(job.group, 0) == job.generation
+
+
+async def _worker() -> None:
+    while True:
+        job = await _queue.get()
+        try:
+            if not _is_live(job):
+                _stats["cancelled"] += 1
+                continue
+            del _queued[job.key]
+            if cached_frame(*job.key) is not None:
+                _stats["already_cached"] += 1
+                continue
+            _stats["in_flight"] += 1
+            try:
+                await asyncio.to_thread(cached_frame_path, *job.key)
+            finally:
+                _stats["in_flight"] -= 1
+            _prefetched[job.key] = None
+            if len(_prefetched) > _PREFETCHED_MAX:
+                del _prefetched[next(iter(_prefetched))]
+            _stats["completed"] += 1
+        except Exception:
+            _stats["failed"] += 1
+        finally:
+            _queue.task_done()
+
+
+def schedule(group: str, frames: Iterable[FrameKey], priority: int) -> int:
+    """Replace `group`'s queued jobs with `frames` at `priority`. Returns how many were queued.
+
+    A frame already queued at the same or a more urgent priority is left alone.
+    """
+    if _queue is None:
+        return 0
+    generation = _generation[group] = _generation.get(group, 0) + 1
+    count = 0
+    for key in frames:
+        current = _queued.get(key)
+        if current is not None and _is_live(current) and current.priority <= priority:
+            continue
+        if cached_frame(*key) is not None:
+            continue
+        job = _Job(priority, next(_seq), key, group, generation)
+        try:
+            _queue.put_nowait(job)
+        except asyncio.QueueFull:
+            _stats["dropped"] += 1
+            break
+        _queued[key] = job
+        count += 1
+    _stats["scheduled"] += count
+    return count
+
+
+def cancel(group: str) -> None:
+    """Drop every still-queued job of `group`."""
+    _generation[group] = _generation.get(group, 0) + 1
+
+
+def record_frame_request(task_id: int, frame: int, hit: bool) -> None:
+    """Count a frame request against the cache, for get_prefetch_stats()."""
+    _stats["requests"] += 1
+    _stats["hits" if hit else "misses"] += 1
+    if hit and (task_id, frame) in _prefetched:
+        del _prefetched[(task_id, frame)]
+        _stats["prefetch_hits"] += 1
+
+
+def get_prefetch_stats() -> dict:
+    requests = _stats["requests"]
+    return {
+        **_stats,
+        "hit_ratio": round(_stats["hits"] / requests, 4) if requests else None,
+        "queue_depth": len(_queued),
+        "workers": len(_workers),
+    }
+
+
+# --- What to prefetch ---
+
+
+def _frame_key(image_id: int, task_id: int) -> FrameKey:
+    return task_id, frame_index(image_id, task_id)
+
+
+def neighbour_frames(image_id: int) -> list[FrameKey]:
+    """Frames of the tiles around `image_id` in its task's mosaic."""
+    image = get_dataset().images.get(image_id)
+    if image is None:
+        return []
+    try:
+        found = neighbours(image_id)
+    except HTTPException:  # no mosaic position
+        return []
+    return [_frame_key(other, image.task_id) for other, _, _ in found]
+
+
+def prefetch_neighbours(task_id: int, frame: int) -> None:
+    """Warm the mosaic neighbours of a frame that was just viewed."""
+    schedule("neighbours", neighbour_frames(task_id * 100000 + frame), PRIORITY_NEIGHBOUR)
+
+
+async def prefetch_listing(**query) -> None:
+    """Warm the frames of a listing page and of the page after it (pages read in a worker thread)."""
+    if _queue is None:
+        return
+    page = await asyncio.to_thread(query_images, **{**query, "fields": ["id", "task_id"]})
+    frames = [_frame_key(row["id"], row["task_id"]) for row in page["items"]]
+    schedule("listing", frames, PRIORITY_VISIBLE)
+    if page["next_cursor"]:
+        following = await asyncio.to_thread(
+            query_images, **{**query, "cursor": page["next_cursor"], "fields": ["id", "task_id"]},
+        )
+        schedule(
+            "listing:next",
+            [_frame_key(row["id"], row["task_id"]) for row in following["items"]],
+            PRIORITY_NEXT_PAGE,
+        )
+
+
+async def prefetch_hotspots() -> None:
+    """Warm the heaviest images once per data version."""
+    global _hotspot_version
+    version = get_dataset().version
+    if _queue is None or version == _hotspot_version or not settings.prefetch_hotspots:
+        return
+    _hotspot_version = version
+    page = await asyncio.to_thread(
+        query_images, limit=settings.prefetch_hotspots, sort="weight", has_annotations=True, fields=["id", "task_id"],
+    )
+    schedule("hotspots", [_frame_key(row["id"], row["task_id"]) for row in page["items"]], PRIORITY_HOTSPOT)
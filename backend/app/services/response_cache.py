@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import inspect
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+import orjson
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from app.compression import compress, pick_encoding
+from app.services.single_flight import coalesce
+
+# Pre-encoded response bodies keyed by cache key, valid for one data version.
+# Reads hit this instead of rebuilding pydantic models and re-encoding JSON.
+# Concurrent misses for the same key and version share a single rebuild.
+
+
+@dataclass(frozen=True)
+class _Entry:
+    version: Hashable
+    etag: str
+    identity: bytes
+    gzip: bytes
+    br: bytes
+    headers: tuple[tuple[str, str], ...] = ()
+
+
+MAX_ENTRIES = 4096
+
+_entries: OrderedDict[str, _Entry] = OrderedDict()
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_json(obj: Any) -> bytes:
+    """Encode obj (pydantic models, dicts, lists) to JSON bytes with orjson."""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _build_entry(version: Hashable, payload: Any, headers: dict[str, str] | None = None) -> _Entry:
+    body = encode_json(payload)
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return _Entry(
+        version=version,
+        etag=f'W/"{digest}"',
+        identity=body,
+        gzip=compress(body, "gzip"),
+        br=compress(body, "br"),
+        headers=tuple((headers or {}).items()),
+    )
+
+
+def _flight_namespace(key: str) -> str:
+    """Metrics namespace for a cache key: query dropped and ids collapsed, so per-image keys share one."""
+    return "response:" + re.sub(r"\d+", "{id}", key.partition("?")[0])
+
+
+async def _rebuild(key: str, version: Hashable, build: Callable[[], Any], with_headers: bool) -> _Entry:
+    if inspect.iscoroutinefunction(build):
+        payload = await build()
+    else:
+        # Off the loop, so other requests (and waiters on this flight) keep moving
+        payload = await asyncio.to_thread(build)
+        if inspect.isawaitable(payload):
+            payload = await payload
+    headers = None
+    if with_headers:
+        payload, headers = payload
+    entry = await asyncio.to_thread(_build_entry, version, payload, headers)
+    _entries[key] = entry
+    if len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+    return entry
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+async def cached_json_response(
+    request: Request,
+    key: str,
+    version: Hashable,
+    build: Callable[[], Any],
+    *,
+    with_headers: bool = False,
+) -> Response:
+    """Serve the JSON for `key` from cache, rebuilding only when `version` changes.
+
+    `build` may be sync (run in a worker thread) or async. Concurrent misses
+    for the same key and version wait on one build. Honours If-None-Match and
+    negotiates br/gzip against the precompressed variants. With
+    `with_headers`, `build` returns (payload, headers) and the headers are
+    cached alongside the body and sent on every hit.
+    """
+    entry = _entries.get(key)
+    if entry is None or entry.version != version:
+        entry = await coalesce(_flight_namespace(key), (key, version), lambda: _rebuild(key, version, build, with_headers))
+    if key in _entries:
+        _entries.move_to_end(key)
+
+    headers = {**dict(entry.headers), "ETag": entry.etag, "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = pick_encoding(request.headers.get("accept-encoding", ""))
+    if encoding == "identity":
+        body = entry.identity
+    else:
+        body = entry.br if encoding == "br" else entry.gzip
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
@@ -0,0 +1,104 @@
+import math
+from itertools import chain
+
+import numpy as np
+
+from app.models.schemas import CvatAnnotation
+
+# Shape-type-aware geometry for CVAT shapes. Every type is reduced to an
+# outline (for maps and display) plus a pixel area (for weights):
+#   polygon    flat x,y pairs, area measured in bulk by validate_polygons()
+#   rectangle  [xtl, ytl, xbr, ybr], area analytic (rotation does not change it)
+#   ellipse    [cx, cy, right_x, top_y], area analytic pi * rx * ry
+#   mask       RLE runs + [left, top, right, bottom], area = sum of foreground runs
+#   polyline / points / anything else: no area
+
+ELLIPSE_OUTLINE_VERTICES = 64
+
+# validate_polygons() status per polygon
+VALID, REPAIRED, DEGENERATE = 0, 1, 2
+
+
+def parse_points(flat_points: list[float]) -> list[list[float]]:
+    """Convert CVAT flat [x1,y1,x2,y2,...] to [[x1,y1],[x2,y2],...]."""
+    return [[flat_points[i], flat_points[i + 1]] for i in range(0, len(flat_points) - 1, 2)]
+
+
+def validate_polygons(rings: list[list[list[float]]]) -> tuple[np.ndarray, np.ndarray]:
+    """Areas and VALID/REPAIRED/DEGENERATE status of many polygon outlines in one vectorised pass.
+
+    Invalid outlines (bow-ties, self-touching rings) are measured after
+    shapely.make_valid, so lobes add up instead of cancelling out. Outlines
+    with fewer than 3 vertices or no area are DEGENERATE, with area 0.
+    """
+    import shapely  # deferred: only ingestion needs it
+
+    n = len(rings)
+    areas = np.zeros(n)
+    status = np.full(n, DEGENERATE, dtype=np.int8)
+    counts = np.fromiter((len(r) for r in rings), dtype=np.int64, count=n)
+    usable = np.flatnonzero(counts >= 3)
+    if not len(usable):
+        return areas, status
+
+    total = int(counts[usable].sum())
+    coords = np.fromiter(
+        chain.from_iterable(chain.from_iterable(rings[i] for i in usable)), dtype=np.float64, count=2 * total,
+    ).reshape(total, 2)
+    indices = np.repeat(np.arange(len(usable)), counts[usable])
+    polygons = shapely.polygons(shapely.linearrings(coords, indices=indices))
+
+    valid = shapely.is_valid(polygons)
+    measured = shapely.area(polygons)
+    invalid = np.flatnonzero(~valid)
+    if len(invalid):
+        measured[invalid] = shapely.area(shapely.make_valid(polygons[invalid]))
+    areas[usable] = measured
+    status[usable] = np.where(valid, VALID, REPAIRED)
+    status[usable[measured <= 0]] = DEGENERATE
+    return areas, status
+
+
+def _rectangle_outline(xtl: float, ytl: float, xbr: float, ybr: float) -> list[list[float]]:
+    return [[xtl, ytl], [xbr, ytl], [xbr, ybr], [xtl, ybr]]
+
+
+def ellipse_outline(cx: float, cy: float, rx: float, ry: float) -> list[list[float]]:
+    theta = np.linspace(0.0, 2 * np.pi, ELLIPSE_OUTLINE_VERTICES, endpoint=False)
+    return np.column_stack((cx + rx * np.cos(theta), cy + ry * np.sin(theta))).tolist()
+
+
+def rle_pixel_count(runs) -> int:
+    """Count foreground pixels straight from alternating background/foreground runs."""
+    return int(np.asarray(runs, dtype=np.int64)[1::2].sum())
+
+
+def shape_geometry(shape_type: str, flat_points: list[float]) -> tuple[list[list[float]], float | None]:
+    """Return (outline points, pixel area) for a CVAT shape's flat `points` array.
+
+    Polygon areas are None here: ingestion measures them all at once with validate_polygons().
+    """
+    if shape_type == "rectangle":
+        xtl, ytl, xbr, ybr = flat_points[:4]
+        return _rectangle_outline(xtl, ytl, xbr, ybr), float(abs(xbr - xtl) * abs(ybr - ytl))
+    if shape_type == "ellipse":
+        cx, cy, right_x, top_y = flat_points[:4]
+        rx, ry = abs(right_x - cx), abs(cy - top_y)
+        return ellipse_outline(cx, cy, rx, ry), math.pi * rx * ry
+    if shape_type == "mask":
+        left, top, right, bottom = flat_points[-4:]
+        # bbox is inclusive of its right/bottom pixel
+        outline = _rectangle_outline(left, top, right + 1, bottom + 1)
+        return outline, float(rle_pixel_count(flat_points[:-4]))
+
+    points = parse_points(flat_points)
+    if shape_type == "polygon":
+        return points, None
+    return points, 0.0
+
+
+def annotation_pixel_area(ann: CvatAnnotation) -> float:
+    """Pixel area for an annotation as ingested (polygons validated); measured here if missing."""
+    if ann.pixel_area is None and ann.shape_type == "polygon":
+        return float(validate_polygons([ann.points])[0][0])
+    return ann.pixel_area or 0.0
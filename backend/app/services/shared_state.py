@@ -0,0 +1,47 @@
+import time
+
+from app.config import settings
+from app.services import (
+    analysis_service,
+    change_service,
+    cvat_service,
+    density_model,
+    geo_service,
+    geometry_service,
+    survey_service,
+)
+
+# Every worker keeps its own in-memory copy of db/*.json. Writes are atomic
+# file replacements, so a worker notices another worker's write by comparing
+# file tokens, checked at most once per settings.state_refresh_interval_s.
+
+_last_check = 0.0
+
+
+def load_all() -> None:
+    """Load every service's state from db/ (process startup)."""
+    global _last_check
+    cvat_service.load_from_disk()
+    geometry_service.load_from_disk()
+    geo_service.load_from_disk()
+    analysis_service.load_from_disk()
+    density_model.load_from_disk()
+    survey_service.load_from_disk()
+    change_service.load_from_disk()
+    _last_check = time.monotonic()
+
+
+def refresh_if_stale() -> None:
+    """Pick up writes made by other workers, bounded by the refresh interval."""
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < settings.state_refresh_interval_s:
+        return
+    _last_check = now
+    cvat_service.refresh_from_disk()
+    geometry_service.refresh_from_disk()
+    geo_service.refresh_from_disk()
+    analysis_service.refresh_from_disk()
+    density_model.refresh_from_disk()
+    survey_service.refresh_from_disk()
+    change_service.refresh_from_disk()
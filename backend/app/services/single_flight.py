@@ -0,0 +1,115 @@
+import asyncio
+import inspect
+import threading
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+# Single-flight: concurrent callers asking for the same key share one
+# computation instead of each running it. Keys must include everything the
+# result depends on (endpoint, parameters, data version). Nothing is cached:
+# once the leader finishes, the next caller starts a fresh flight.
+#
+# coalesce() is for coroutines on the event loop; coalesce_sync() is for
+# worker threads (to_thread downloads, the prefetcher, batch jobs).
+
+_T = TypeVar("_T")
+
+_async_flights: dict[Hashable, asyncio.Task] = {}
+_thread_flights: dict[Hashable, "_ThreadFlight"] = {}
+_thread_lock = threading.Lock()
+_stats: dict[str, dict[str, int]] = {}  # namespace -> counters
+
+
+class _ThreadFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+def _count(namespace: str, counter: str, delta: int = 1) -> None:
+    """Bump a counter; callers hold _thread_lock (the stats are shared with worker threads)."""
+    stats = _stats.setdefault(namespace, {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0, "in_flight": 0})
+    stats[counter] += delta
+
+
+async def _lead(namespace: str, flight_key: Hashable, fn: Callable[[], Awaitable[_T] | _T]) -> _T:
+    try:
+        result = fn()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    except BaseException:
+        with _thread_lock:
+            _count(namespace, "errors")
+        raise
+    finally:
+        with _thread_lock:
+            _count(namespace, "in_flight", -1)
+        del _async_flights[flight_key]
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()  # mark retrieved when every caller has gone
+
+
+async def coalesce(namespace: str, key: Hashable, fn: Callable[[], Awaitable[_T] | _T]) -> _T:
+    """Run `fn` once for all concurrent callers with the same (namespace, key)."""
+    flight_key = (namespace, key)
+    task = _async_flights.get(flight_key)
+    with _thread_lock:
+        _count(namespace, "calls")
+        _count(namespace, "coalesced" if task is not None else "executed")
+        if task is None:
+            _count(namespace, "in_flight")
+    if task is None:
+        # The work runs in its own task, so cancelling any caller (the first
+        # one included) leaves it running for the others
+        task = asyncio.ensure_future(_lead(namespace, flight_key, fn))
+        task.add_done_callback(_retrieve)
+        _async_flights[flight_key] = task
+    return await asyncio.shield(task)
+
+
+def coalesce_sync(namespace: str, key: Hashable, fn: Callable[[], _T]) -> _T:
+    """Thread-safe variant: one thread runs `fn`, the others block on its result."""
+    flight_key = (namespace, key)
+    with _thread_lock:
+        _count(namespace, "calls")
+        flight = _thread_flights.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _thread_flights[flight_key] = _ThreadFlight()
+            _count(namespace, "executed")
+            _count(namespace, "in_flight")
+        else:
+            _count(namespace, "coalesced")
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = fn()
+        return flight.result
+    except BaseException as exc:
+        flight.error = exc
+        with _thread_lock:
+            _count(namespace, "errors")
+        raise
+    finally:
+        with _thread_lock:
+            _count(namespace, "in_flight", -1)
+            del _thread_flights[flight_key]
+        flight.done.set()
+
+
+def get_single_flight_stats() -> dict:
+    """Per namespace: calls, executions, calls served by another caller's flight, errors."""
+    with _thread_lock:
+        return {
+            namespace: {**stats, "coalesced_ratio": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else None}
+            for namespace, stats in sorted(_stats.items())
+        }
@@ -0,0 +1,287 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterator, Mapping
+from types import MappingProxyType
+
+import numpy as np
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeoCoordinate, ImageGeoReference
+from app.services import partitions
+
+# Columnar encodings of the dataset and georefs for store.save_columns.
+# Rows are sorted by image id so lookups are a searchsorted into a memory-mapped
+# array; pydantic objects are only built for the rows a request actually touches.
+# Dataset objects are memoised per site partition (see partitions.py), so the
+# memory they hold stays under budget however many sites the snapshot covers.
+
+_EMPTY: Mapping = MappingProxyType({})
+
+# Approximate size of built objects, measured with tracemalloc
+_IMAGE_BYTES = 1100
+_ANNOTATION_BYTES = 1150
+_VERTEX_BYTES = 130
+_LABEL_BYTES = 190
+
+
+def _offsets(lengths: list[int]) -> np.ndarray:
+    out = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=out[1:])
+    return out
+
+
+def _find(ids: np.ndarray, key) -> int | None:
+    """Row of `key` in the sorted `ids` column, or None."""
+    if not isinstance(key, (int, np.integer)) or not len(ids):
+        return None
+    row = int(np.searchsorted(ids, key))
+    if row < len(ids) and ids[row] == key:
+        return row
+    return None
+
+
+class _LazyColumns(Mapping, ABC):
+    """Read-only id -> object mapping over a sorted id column, memoising built rows."""
+
+    def __init__(self, ids: np.ndarray):
+        self._ids = ids
+        self._built: dict[int, object] = {}
+
+    @abstractmethod
+    def _build(self, row: int):
+        """The object for row `row` of the columns."""
+
+    def __getitem__(self, key):
+        obj = self._built.get(key)
+        if obj is None:
+            row = _find(self._ids, key)
+            if row is None:
+                raise KeyError(key)
+            obj = self._built[key] = self._build(row)
+        return obj
+
+    def __contains__(self, key) -> bool:
+        return key in self._built or _find(self._ids, key) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class _PartitionedColumns(_LazyColumns):
+    """_LazyColumns whose built rows are memoised per site partition, under the residency budget."""
+
+    kind = ""
+
+    def __init__(self, ids: np.ndarray, tasks: np.ndarray, generation: int):
+        super().__init__(ids)
+        self._tasks = tasks  # task id per row
+        self._generation = generation
+        # (task id, partition) of the last read: consecutive reads mostly stay in one task
+        self._last: tuple[int, partitions.Partition] | None = None
+
+    @abstractmethod
+    def _cost(self, obj) -> int:
+        """Estimated bytes of a built object, charged to its partition."""
+
+    def __getitem__(self, key):
+        row = _find(self._ids, key)
+        if row is None:
+            raise KeyError(key)
+        task_id = int(self._tasks[row])
+        last = self._last
+        if last is not None and last[0] == task_id and not last[1].evicted:
+            part = last[1]
+        else:
+            part = partitions.partition(self._generation, task_id)
+            self._last = (task_id, part)
+        built = part.memos.setdefault(self.kind, {})
+        obj = built.get(key)
+        if obj is None:
+            obj = built[key] = self._build(row)
+            partitions.charge(part, self._cost(obj))
+        return obj
+
+    def ids_for_tasks(self, task_ids: set[int]) -> np.ndarray:
+        """Sorted ids of the rows belonging to `task_ids`, without building anything."""
+        return self._ids[np.isin(self._tasks, list(task_ids))]
+
+
+# --- Dataset ---
+
+
+def encode_dataset(
+    images: Mapping[int, CvatImage],
+    annotations: Mapping[int, list[CvatAnnotation]],
+    label_pixels: Mapping[int, Mapping[str, float]],
+) -> tuple[dict[str, np.ndarray], dict]:
+    """Flatten a dataset into columns. Annotations of unknown images are not kept."""
+    ordered = sorted(images.values(), key=lambda img: img.id)
+    labels = sorted({ann.label for img in ordered for ann in annotations.get(img.id, [])})
+    shape_types = sorted({ann.shape_type for img in ordered for ann in annotations.get(img.id, [])})
+    label_code = {label: i for i, label in enumerate(labels)}
+    shape_code = {shape: i for i, shape in enumerate(shape_types)}
+
+    names = [img.name.encode() for img in ordered]
+    anns = [ann for img in ordered for ann in annotations.get(img.id, [])]
+    points = [p for ann in anns for p in ann.points]
+
+    label_px = np.zeros((len(ordered), len(labels)), dtype=np.float64)
+    label_present = np.zeros((len(ordered), len(labels)), dtype=bool)
+    for row, img in enumerate(ordered):
+        for label, px in label_pixels.get(img.id, _EMPTY).items():
+            label_px[row, label_code[label]] = px
+            label_present[row, label_code[label]] = True
+
+    arrays = {
+        "image_id": np.array([img.id for img in ordered], dtype=np.int64),
+        "image_width": np.array([img.width for img in ordered], dtype=np.int32),
+        "image_height": np.array([img.height for img in ordered], dtype=np.int32),
+        "image_task_id": np.array([img.task_id for img in ordered], dtype=np.int64),
+        "image_name_offsets": _offsets([len(n) for n in names]),
+        "image_names": np.frombuffer(b"".join(names), dtype=np.uint8),
+        "image_ann_offsets": _offsets([len(annotations.get(img.id, [])) for img in ordered]),
+        "image_label_pixels": label_px,
+        "image_label_present": label_present,
+        "ann_id": np.array([ann.id for ann in anns], dtype=np.int64),
+        "ann_label": np.array([label_code[ann.label] for ann in anns], dtype=np.int32),
+        "ann_shape_type": np.array([shape_code[ann.shape_type] for ann in anns], dtype=np.int16),
+        # NaN stands for a missing pixel_area
+        "ann_pixel_area": np.array(
+            [np.nan if ann.pixel_area is None else ann.pixel_area for ann in anns], dtype=np.float64
+        ),
+        "ann_proposed": np.array([ann.proposed for ann in anns], dtype=bool),
+        "ann_point_offsets": _offsets([len(ann.points) for ann in anns]),
+        "ann_points": np.array(points, dtype=np.float64).reshape(len(points), 2),
+    }
+    return arrays, {"labels": labels, "shape_types": shape_types}
+
+
+class _ImageColumns(_PartitionedColumns):
+    kind = "images"
+
+    def __init__(self, cols: dict[str, np.ndarray], generation: int):
+        super().__init__(cols["image_id"], cols["image_task_id"], generation)
+        self._cols = cols
+
+    def _cost(self, obj) -> int:
+        return _IMAGE_BYTES
+
+    def _build(self, row: int) -> CvatImage:
+        c = self._cols
+        start, end = c["image_name_offsets"][row:row + 2]
+        return CvatImage.model_construct(
+            id=int(c["image_id"][row]),
+            name=c["image_names"][start:end].tobytes().decode(),
+            width=int(c["image_width"][row]),
+            height=int(c["image_height"][row]),
+            task_id=int(c["image_task_id"][row]),
+        )
+
+
+class _AnnotationColumns(_PartitionedColumns):
+    """image_id -> annotations, only for images that have any (like the dict it replaces)."""
+
+    kind = "annotations"
+
+    def __init__(self, cols: dict[str, np.ndarray], meta: dict, generation: int):
+        counts = np.diff(cols["image_ann_offsets"])
+        self._rows = np.flatnonzero(counts)
+        super().__init__(cols["image_id"][self._rows], cols["image_task_id"][self._rows], generation)
+        self._cols = cols
+        self._labels = meta["labels"]
+        self._shape_types = meta["shape_types"]
+        # absent in snapshots written before pre-annotation existed
+        self._proposed = cols.get("ann_proposed")
+
+    def _build(self, row: int) -> list[CvatAnnotation]:
+        c = self._cols
+        image_row = self._rows[row]
+        image_id = int(c["image_id"][image_row])
+        start, end = c["image_ann_offsets"][image_row:image_row + 2]
+        anns = []
+        for a in range(start, end):
+            p0, p1 = c["ann_point_offsets"][a:a + 2]
+            area = float(c["ann_pixel_area"][a])
+            anns.append(CvatAnnotation.model_construct(
+                id=int(c["ann_id"][a]),
+                image_id=image_id,
+                label=self._labels[c["ann_label"][a]],
+                points=c["ann_points"][p0:p1].tolist(),
+                pixel_area=None if np.isnan(area) else area,
+                shape_type=self._shape_types[c["ann_shape_type"][a]],
+                proposed=bool(self._proposed[a]) if self._proposed is not None else False,
+            ))
+        return anns
+
+    def _cost(self, obj) -> int:
+        return sum(_ANNOTATION_BYTES + _VERTEX_BYTES * len(ann.points) for ann in obj)
+
+
+class _LabelPixelColumns(_PartitionedColumns):
+    kind = "label_pixels"
+
+    def __init__(self, cols: dict[str, np.ndarray], meta: dict, generation: int):
+        self._rows = np.flatnonzero(cols["image_label_present"].any(axis=1))
+        super().__init__(cols["image_id"][self._rows], cols["image_task_id"][self._rows], generation)
+        self._cols = cols
+        self._labels = meta["labels"]
+
+    def _cost(self, obj) -> int:
+        return _LABEL_BYTES * len(obj)
+
+    def _build(self, row: int) -> Mapping[str, float]:
+        image_row = self._rows[row]
+        present = self._cols["image_label_present"][image_row]
+        pixels = self._cols["image_label_pixels"][image_row]
+        return MappingProxyType({
+            self._labels[i]: float(pixels[i]) for i in np.flatnonzero(present)
+        })
+
+
+def open_dataset(
+    cols: dict[str, np.ndarray], meta: dict, generation: int,
+) -> tuple[Mapping[int, CvatImage], Mapping[int, list[CvatAnnotation]], Mapping[int, Mapping[str, float]]]:
+    """Return lazy (images, annotations, label_pixels) mappings over snapshot columns.
+
+    Built objects are memoised in the site partitions of `generation` (partitions.new_generation()).
+    """
+    return (
+        _ImageColumns(cols, generation),
+        _AnnotationColumns(cols, meta, generation),
+        _LabelPixelColumns(cols, meta, generation),
+    )
+
+
+# --- Georefs ---
+
+
+def encode_georefs(georefs: Mapping[int, ImageGeoReference]) -> dict[str, np.ndarray]:
+    ordered = sorted(georefs.values(), key=lambda ref: ref.image_id)
+    return {
+        "image_id": np.array([ref.image_id for ref in ordered], dtype=np.int64),
+        "lat": np.array([ref.center.lat for ref in ordered], dtype=np.float64),
+        "lng": np.array([ref.center.lng for ref in ordered], dtype=np.float64),
+        "resolution_cm": np.array(
+            [ref.ground_resolution_cm_per_pixel for ref in ordered], dtype=np.float64
+        ),
+    }
+
+
+class _GeorefColumns(_LazyColumns):
+    def __init__(self, cols: dict[str, np.ndarray]):
+        super().__init__(cols["image_id"])
+        self._cols = cols
+
+    def _build(self, row: int) -> ImageGeoReference:
+        c = self._cols
+        return ImageGeoReference.model_construct(
+            image_id=int(c["image_id"][row]),
+            center=GeoCoordinate.model_construct(lat=float(c["lat"][row]), lng=float(c["lng"][row])),
+            ground_resolution_cm_per_pixel=float(c["resolution_cm"][row]),
+        )
+
+
+def open_georefs(cols: dict[str, np.ndarray]) -> Mapping[int, ImageGeoReference]:
+    """Return a lazy image_id -> georef mapping over snapshot columns."""
+    return _GeorefColumns(cols)
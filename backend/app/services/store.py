@@ -1,7 +1,24 @@
+import fcntl
 import json
+import os
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
 
-_DB_DIR = Path(__file__).resolve().parents[3] / "db"
+import numpy as np
+
+from app.config import settings
+
+_DB_DIR = Path(settings.db_dir) if settings.db_dir else Path(__file__).resolve().parents[3] / "db"
+
+# Identity of a db file as (inode, mtime_ns, size). Writes go through
+# os.replace, so any write from any worker process changes the token.
+FileToken = tuple[int, int, int]
+
+
+def db_path(*parts: str) -> Path:
+    """Path under db/ for services that keep more than a single file there."""
+    return _DB_DIR.joinpath(*parts)
 
 
 def load_json(filename: str) -> dict:
@@ -16,6 +33,90 @@ def load_json(filename: str) -> dict:
 
 
 def save_json(filename: str, data: dict) -> None:
-    """Write data as JSON to db/<filename>, creating db/ if needed."""
+    """Atomically write data as JSON to db/<filename>, creating db/ if needed."""
+    _DB_DIR.mkdir(parents=True, exist_ok=True)
+    path = _DB_DIR / filename
+    tmp = path.with_name(f".{filename}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+# Columnar snapshot layout: magic, u64 header length, JSON header, then each
+# array's raw bytes at a 64-byte aligned offset so it can be memory-mapped.
+_SNAPSHOT_MAGIC = b"CLNSNAP1"
+_ALIGN = 64
+
+
+def save_columns(filename: str, arrays: dict[str, np.ndarray], meta: dict) -> None:
+    """Atomically write named numpy arrays plus JSON metadata to db/<filename>."""
+    _DB_DIR.mkdir(parents=True, exist_ok=True)
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    layout: dict[str, list] = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = [arr.dtype.str, list(arr.shape), offset]
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"arrays": layout, "meta": meta}).encode()
+    data_start = -(-(len(_SNAPSHOT_MAGIC) + 8 + len(header)) // _ALIGN) * _ALIGN
+
+    path = _DB_DIR / filename
+    tmp = path.with_name(f".{filename}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(_SNAPSHOT_MAGIC)
+        fh.write(len(header).to_bytes(8, "little"))
+        fh.write(header)
+        for name, arr in arrays.items():
+            fh.seek(data_start + layout[name][2])
+            fh.write(arr.tobytes())
+        fh.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+def load_columns(filename: str) -> tuple[dict[str, np.ndarray], dict] | None:
+    """Memory-map a snapshot written by save_columns. Returns None if missing or unreadable.
+
+    Arrays are read-only views into the page cache; nothing is copied until touched.
+    """
+    path = _DB_DIR / filename
+    try:
+        with open(path, "rb") as fh:
+            if fh.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+                return None
+            header_len = int.from_bytes(fh.read(8), "little")
+            header = json.loads(fh.read(header_len))
+        data_start = -(-(len(_SNAPSHOT_MAGIC) + 8 + header_len) // _ALIGN) * _ALIGN
+        buf = np.memmap(path, dtype=np.uint8, mode="r") if path.stat().st_size else None
+    except (OSError, ValueError):
+        return None
+
+    arrays: dict[str, np.ndarray] = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dt = np.dtype(dtype)
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dt)
+            continue
+        start = data_start + offset
+        arrays[name] = buf[start:start + count * dt.itemsize].view(dt).reshape(shape)
+    return arrays, header["meta"]
+
+
+def file_token(filename: str) -> FileToken | None:
+    """Return the current identity of db/<filename>, or None if it does not exist."""
+    try:
+        st = (_DB_DIR / filename).stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@contextmanager
+def locked(filename: str) -> Iterator[None]:
+    """Hold an exclusive cross-process lock for a read-modify-write of db/<filename>."""
     _DB_DIR.mkdir(parents=True, exist_ok=True)
-    (_DB_DIR / filename).write_text(json.dumps(data, indent=2))
+    with open(_DB_DIR / f".{filename}.lock", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from itertools import groupby
+
+from fastapi import HTTPException
+
+from app.models.schemas import Survey, SurveyInfo
+from app.services.store import file_token, load_json, locked, save_json
+
+# Survey metadata per CVAT task: which site it covers and when it was flown.
+# Each resurvey of a site is its own task, so syncing one never overwrites
+# another and change detection compares consecutive surveys of a site. A large
+# site flown in several tasks on one day is a single survey: tasks are grouped
+# by (site, surveyed_on).
+
+_surveys: dict[int, Survey] = {}
+# Bumped whenever survey metadata changes; keys response caches
+_version = 0
+# Token of the db/surveys.json this process last loaded or wrote
+_disk_token = None
+
+
+def set_survey(task_id: int, info: SurveyInfo) -> Survey:
+    """Record (or replace) the site and date of a task's survey."""
+    global _surveys
+    with locked("surveys.json"):
+        refresh_from_disk()
+        survey = Survey(task_id=task_id, **info.model_dump())
+        _surveys = {**_surveys, task_id: survey}
+        _bump_version()
+        _save_to_disk()
+    return survey
+
+
+def delete_survey(task_id: int) -> None:
+    global _surveys
+    with locked("surveys.json"):
+        refresh_from_disk()
+        if task_id not in _surveys:
+            raise HTTPException(status_code=404, detail=f"No survey recorded for task {task_id}.")
+        _surveys = {k: v for k, v in _surveys.items() if k != task_id}
+        _bump_version()
+        _save_to_disk()
+
+
+def get_surveys() -> list[Survey]:
+    return sorted(_surveys.values(), key=lambda s: (s.site, s.surveyed_on, s.task_id))
+
+
+def get_survey(task_id: int) -> Survey | None:
+    return _surveys.get(task_id)
+
+
+def site_task_ids(site: str) -> set[int]:
+    """Task ids of a site's surveys; 404 for a site with none recorded."""
+    task_ids = {s.task_id for s in _surveys.values() if s.site == site}
+    if not task_ids:
+        raise HTTPException(status_code=404, detail=f"No surveys recorded for site {site!r}.")
+    return task_ids
+
+
+def surveys_by_site() -> dict[str, list[Survey]]:
+    """Site -> its surveys, oldest first."""
+    sites: dict[str, list[Survey]] = defaultdict(list)
+    for survey in get_surveys():
+        sites[survey.site].append(survey)
+    return dict(sites)
+
+
+def survey_groups_by_site() -> dict[str, list[list[Survey]]]:
+    """Site -> its surveys, oldest first; each survey is the tasks flown there that day."""
+    return {
+        site: [list(tasks) for _, tasks in groupby(surveys, key=lambda s: s.surveyed_on)]
+        for site, surveys in surveys_by_site().items()
+    }
+
+
+def _bump_version() -> None:
+    global _version
+    _version += 1
+
+
+def get_survey_version() -> int:
+    """Return a counter that changes whenever survey metadata changes."""
+    return _version
+
+
+def load_from_disk() -> None:
+    """Restore survey metadata from db/surveys.json."""
+    global _surveys, _disk_token
+    _disk_token = file_token("surveys.json")
+    data = load_json("surveys.json")
+    _surveys = {int(k): Survey(**v) for k, v in data.get("surveys", {}).items()}
+    _bump_version()
+
+
+def refresh_from_disk() -> bool:
+    """Reload if another worker has rewritten db/surveys.json. Returns True on reload."""
+    if file_token("surveys.json") == _disk_token:
+        return False
+    load_from_disk()
+    return True
+
+
+def _save_to_disk() -> None:
+    global _disk_token
+    save_json("surveys.json", {
+        "surveys": {str(k): v.model_dump(mode="json") for k, v in _surveys.items()},
+    })
+    _disk_token = file_token("surveys.json")
@@ -0,0 +1,61 @@
+from typing import Iterable
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+# Quantised TopoJSON for polygon feature collections. Coordinates snap to a
+# fixed 1e-7 degree grid (~1 cm) and every arc after its first point is
+# delta-encoded, so each vertex is a pair of small integers instead of two
+# full-precision floats. Rings are stored as one arc each (no shared-edge
+# detection; detections rarely share boundaries).
+
+QUANTUM_DEG = 1e-7
+GEO_FORMATS = ("geojson", "topojson")
+
+
+def negotiate_geo_format(format: str | None, accept: str = "") -> str:
+    """Pick the geometry encoding from `?format=`, falling back to the Accept header."""
+    if format is None:
+        return "topojson" if "topojson" in accept.lower() else "geojson"
+    if format not in GEO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(GEO_FORMATS)}")
+    return format
+
+
+def _feature_dict(feature) -> dict:
+    return feature.model_dump() if isinstance(feature, BaseModel) else feature
+
+
+def to_topojson(features: Iterable) -> dict:
+    """Encode GeoJSON Polygon features (models or dicts) as a quantised Topology."""
+    features = [_feature_dict(f) for f in features]
+    rings = [ring for f in features for ring in f["geometry"]["coordinates"]]
+    xs = [p[0] for ring in rings for p in ring]
+    ys = [p[1] for ring in rings for p in ring]
+    x0, y0 = (min(xs), min(ys)) if xs else (0.0, 0.0)
+
+    arcs: list[list[list[int]]] = []
+    geometries: list[dict] = []
+    for f in features:
+        polygon_arcs = []
+        for ring in f["geometry"]["coordinates"]:
+            arc: list[list[int]] = []
+            px = py = 0
+            for lng, lat, *_ in ring:
+                qx = round((lng - x0) / QUANTUM_DEG)
+                qy = round((lat - y0) / QUANTUM_DEG)
+                if arc and qx == px and qy == py:
+                    continue  # collapsed onto the previous vertex
+                arc.append([qx - px, qy - py] if arc else [qx, qy])
+                px, py = qx, qy
+            polygon_arcs.append([len(arcs)])
+            arcs.append(arc)
+        geometries.append({"type": "Polygon", "arcs": polygon_arcs, "properties": f.get("properties", {})})
+
+    return {
+        "type": "Topology",
+        "transform": {"scale": [QUANTUM_DEG, QUANTUM_DEG], "translate": [x0, y0]},
+        "bbox": [x0, y0, max(xs), max(ys)] if xs else None,
+        "objects": {"features": {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+    }
@@ -0,0 +1,157 @@
+from typing import Hashable
+
+import numpy as np
+
+from app.models.schemas import (
+    Distribution,
+    SurveyUncertainty,
+    WeightInterval,
+    WeightUncertainty,
+    ZoneUncertainty,
+)
+from app.services.cvat_service import Dataset, get_dataset
+from app.services.density_model import get_density_model, get_model_version, label_weight_g
+from app.services.single_flight import coalesce_sync
+from app.services.survey_service import get_survey, get_survey_version
+
+# Monte Carlo intervals for weight estimates. Ground resolution, label density
+# and the buried fraction are drawn from the distributions in the density
+# model's `uncertainty` block and pushed through the per-image label pixel sums
+# as one (draws x labels) @ (labels x zones) product, so thousands of draws
+# cost a few array operations. Draws are correlated the way the errors are:
+# one resolution and one buried fraction per survey (the tasks flown at a site
+# on one day; a task with no survey recorded stands alone), one density factor
+# per label. Results are cached per data, model and survey version.
+
+# Upper bound on draws x zones held in memory at once; zones go in blocks
+_BLOCK_CELLS = 4_000_000
+
+# site (None = all) -> (versions, result)
+_cache: dict[str | None, tuple[Hashable, WeightUncertainty]] = {}
+
+
+def sample(dist: Distribution, rng: np.random.Generator, shape: tuple[int, ...]) -> np.ndarray:
+    """Draw an array of `shape` from a configured distribution."""
+    if dist.kind == "uniform":
+        return rng.uniform(dist.low, dist.high, shape)
+    if dist.kind == "triangular" and dist.high > dist.low:
+        return rng.triangular(dist.low, dist.mode, dist.high, shape)
+    if dist.kind == "lognormal":
+        return dist.mode * np.exp(rng.normal(0.0, dist.sigma, shape))
+    return np.full(shape, dist.mode)
+
+
+def get_uncertainty_version() -> Hashable:
+    return (get_dataset().version, get_model_version(), get_survey_version())
+
+
+def get_uncertainty(site: str | None = None) -> WeightUncertainty:
+    """Weight intervals for the current data, or one site's; recomputed only when a version changes."""
+    dataset = get_dataset(site)
+    key = (dataset.version, get_model_version(), get_survey_version())
+    cached = _cache.get(site)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    result = coalesce_sync("uncertainty", (site, key), lambda: compute_uncertainty(dataset))
+    _cache[site] = (key, result)
+    return result
+
+
+def _interval(grams: np.ndarray, confidence: float) -> np.ndarray:
+    """(low, median, high) quantiles over the draws axis, in kg."""
+    tail = (1 - confidence) / 2
+    return np.quantile(grams, [tail, 0.5, 1 - tail], axis=0) / 1000.0
+
+
+def _to_model(q: np.ndarray) -> WeightInterval:
+    return WeightInterval(low_kg=round(float(q[0]), 4), median_kg=round(float(q[1]), 4), high_kg=round(float(q[2]), 4))
+
+
+def compute_uncertainty(dataset: Dataset) -> WeightUncertainty:
+    """Sample the weight of every annotated image, survey and the whole dataset."""
+    config = get_density_model().uncertainty
+    rng = np.random.default_rng(config.seed)
+    draws = config.draws
+
+    # Point-estimate weight per (zone, label); the factors below scale it per draw
+    zone_ids: list[int] = []
+    zone_tasks: list[int] = []
+    labels: dict[str, int] = {}
+    cells: list[tuple[int, int, float]] = []
+    for image_id, pixels in dataset.label_pixels.items():
+        image = dataset.images.get(image_id)
+        if image is None or not pixels:
+            continue
+        row = len(zone_ids)
+        zone_ids.append(image_id)
+        zone_tasks.append(image.task_id)
+        for label, px in pixels.items():
+            col = labels.setdefault(label, len(labels))
+            cells.append((row, col, label_weight_g(label, px, image.task_id)))
+
+    survey_tasks: dict[Hashable, list[int]] = {}
+    for task_id in sorted(set(zone_tasks)):
+        survey = get_survey(task_id)
+        survey_tasks.setdefault((survey.site, survey.surveyed_on) if survey else task_id, []).append(task_id)
+    task_ids = list(survey_tasks.values())
+    n_zones, n_labels, n_surveys = len(zone_ids), len(labels), len(task_ids)
+    base = np.zeros((n_zones, n_labels))
+    if cells:
+        rows, cols, weights = zip(*cells)
+        base[list(rows), list(cols)] = weights
+    survey_index = {task_id: i for i, tasks in enumerate(task_ids) for task_id in tasks}
+    zone_survey = np.array([survey_index[t] for t in zone_tasks], dtype=np.intp)
+
+    area_factor = sample(config.resolution_factor, rng, (draws, n_surveys)) ** 2  # area scales with resolution²
+    density_factor = sample(config.density_factor, rng, (draws, n_labels))
+    buried_fraction = sample(config.buried_fraction, rng, (draws, n_surveys))
+
+    survey_surface = np.zeros((draws, n_surveys))
+    zone_surface_q = np.empty((3, n_zones))
+    zone_total_q = np.empty((3, n_zones))
+    block = max(1, _BLOCK_CELLS // draws)
+    for start in range(0, n_zones, block):
+        part = slice(start, start + block)
+        part_surveys = zone_survey[part]
+        surface = (density_factor @ base[part].T) * area_factor[:, part_surveys]  # (draws, zones in block)
+        survey_surface += surface @ np.eye(n_surveys)[part_surveys]
+        zone_surface_q[:, part] = _interval(surface, config.confidence)
+        zone_total_q[:, part] = _interval(surface * (1 + buried_fraction[:, part_surveys]), config.confidence)
+
+    survey_buried = survey_surface * buried_fraction
+    surveys_q = [_interval(a, config.confidence) for a in (survey_surface, survey_buried, survey_surface + survey_buried)]
+    totals = [_interval(a.sum(axis=1), config.confidence) for a in (survey_surface, survey_buried)]
+    totals.append(_interval((survey_surface + survey_buried).sum(axis=1), config.confidence))
+
+    surveys = []
+    for i, tasks in enumerate(task_ids):
+        survey = get_survey(tasks[0])
+        surface_q, buried_q, total_q = (q[:, i] for q in surveys_q)
+        surveys.append(SurveyUncertainty(
+            task_ids=tasks,
+            site=survey.site if survey else None,
+            surveyed_on=survey.surveyed_on if survey else None,
+            surface=_to_model(surface_q),
+            buried=_to_model(buried_q),
+            total=_to_model(total_q),
+        ))
+
+    order = np.argsort(-zone_surface_q[1], kind="stable")
+    zones = [
+        ZoneUncertainty(
+            image_id=zone_ids[i],
+            task_id=zone_tasks[i],
+            surface=_to_model(zone_surface_q[:, i]),
+            total=_to_model(zone_total_q[:, i]),
+        )
+        for i in order
+    ]
+    return WeightUncertainty(
+        draws=draws,
+        confidence=config.confidence,
+        surface=_to_model(totals[0]),
+        buried=_to_model(totals[1]),
+        total=_to_model(totals[2]),
+        surveys=surveys,
+        zones=zones,
+    )
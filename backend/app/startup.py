@@ -0,0 +1,121 @@
+import importlib.abc
+import os
+import sys
+import time
+from collections import defaultdict
+
+# Boot metrics for this worker, served at GET /health/startup: how long the
+# app's imports took broken down by package, time until the lifespan startup
+# finished, and resident memory. Importing this module installs an import
+# timer; main.py imports it first and stops the timer once its own imports are
+# done, so the breakdown covers exactly what a worker loads before serving.
+#
+# Heavy SDKs (cvat_sdk, openai, shapely) are imported inside the service
+# functions that use them; `heavy_modules` shows whether this worker has
+# loaded them yet.
+
+HEAVY_MODULES = ("cvat_sdk", "openai", "shapely")
+
+_started = time.perf_counter()
+_imports_done: float | None = None
+_ready: float | None = None
+_self_s: dict[str, float] = defaultdict(float)  # package -> import time excluding nested imports
+_children: list[float] = []  # time spent in nested imports, per active import
+
+
+def _bucket(name: str) -> str:
+    """app modules are reported individually (app.services.cvat_service), others per top-level package."""
+    parts = name.split(".")
+    return ".".join(parts[:3]) if parts[0] == "app" else parts[0]
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def _timed(self, call, *args):
+        _children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            _self_s[_bucket(self._name)] += elapsed - _children.pop()
+            if _children:
+                _children[-1] += elapsed
+
+    def create_module(self, spec):
+        return self._timed(self._loader.create_module, spec)
+
+    def exec_module(self, module):
+        try:
+            self._timed(self._loader.exec_module, module)
+        finally:
+            # Put the real loader back so nothing keeps a reference to the wrapper
+            module.__loader__ = self._loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self._loader
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, name)
+                return spec
+        return None
+
+
+_finder = _TimingFinder()
+sys.meta_path.insert(0, _finder)
+
+
+def finish_imports() -> None:
+    """Stop timing imports; later (lazy) imports are not part of the boot breakdown."""
+    global _imports_done
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+    _imports_done = time.perf_counter()
+
+
+def mark_ready() -> None:
+    """Record the end of startup (state loaded, background tasks started)."""
+    global _ready
+    _ready = time.perf_counter()
+
+
+def _memory_mb() -> tuple[float | None, float | None]:
+    """(current, peak) resident set size from /proc; None where unavailable."""
+    values: dict[str, float] = {}
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def startup_report() -> dict:
+    rss_mb, peak_rss_mb = _memory_mb()
+    imports_s = (_imports_done or time.perf_counter()) - _started
+    breakdown = sorted(_self_s.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "pid": os.getpid(),
+        "imports_s": round(imports_s, 4),
+        "ready_s": round(_ready - _started, 4) if _ready is not None else None,
+        "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+        "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+        "import_ms": {name: round(seconds * 1000, 1) for name, seconds in breakdown if seconds >= 0.0005},
+        "heavy_modules": {name: name in sys.modules for name in HEAVY_MODULES},
+    }
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import io
+import math
+import random
+from dataclasses import dataclass
+from functools import lru_cache
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+from PIL import Image
+
+# Stand-in for the CVAT REST endpoints cvat_service uses: task list, labels,
+# frame metadata, jobs, job annotations and frame downloads. Tasks, frames and
+# shapes are generated deterministically from a seed; frame names carry the
+# _y<row>_x<col> offsets geo_service georeferences from.
+#
+#   python -m loadtest.fake_cvat --port 8081 --tasks 4 --frames 500 --latency-ms 40
+#   CVAT_BASE_URL=http://127.0.0.1:8081 uvicorn app.main:app
+
+LABELS = ["plastique", "filet", "bois", "metal", "verre", "inconnu"]
+
+
+@dataclass
+class FakeCvatConfig:
+    tasks: int = 2
+    first_task_id: int = 100
+    frames: int = 200  # per task
+    job_size: int = 50  # frames per job
+    shapes_per_frame: int = 4
+    frame_width: int = 1024
+    frame_height: int = 768
+    latency_ms: float = 20.0
+    jitter_ms: float = 10.0
+    error_rate: float = 0.0  # share of annotation requests answered 503
+    seed: int = 0
+
+
+def create_app(config: FakeCvatConfig) -> FastAPI:
+    app = FastAPI(title="Fake CVAT")
+    task_ids = [config.first_task_id + i for i in range(config.tasks)]
+    cols = max(1, round(config.frames**0.5))
+    rng = random.Random(config.seed)
+
+    @app.middleware("http")
+    async def strip_trailing_slash(request: Request, call_next):
+        # The SDK requests "/api/jobs/1/annotations/"; answer without a redirect
+        if request.scope["path"] != "/" and request.scope["path"].endswith("/"):
+            request.scope["path"] = request.scope["path"].rstrip("/")
+        return await call_next(request)
+
+    async def delay() -> None:
+        await asyncio.sleep(max(0.0, config.latency_ms + rng.uniform(-1, 1) * config.jitter_ms) / 1000)
+
+    def check_task(task_id: int) -> None:
+        if task_id not in task_ids:
+            raise HTTPException(status_code=404, detail="Not found.")
+
+    def page(results: list) -> dict:
+        return {"count": len(results), "next": None, "previous": None, "results": results}
+
+    def frame_shapes(task_id: int, frame: int) -> list[dict]:
+        frame_rng = random.Random(hash((config.seed, task_id, frame)))
+        shapes = []
+        for n in range(config.shapes_per_frame):
+            cx = frame_rng.uniform(50, config.frame_width - 50)
+            cy = frame_rng.uniform(50, config.frame_height - 50)
+            r = frame_rng.uniform(5, 40)
+            points = []
+            vertices = frame_rng.randint(4, 12)
+            for k in range(vertices):
+                angle = k / vertices * 2 * math.pi
+                radius = r * frame_rng.uniform(0.6, 1.0)
+                points += [cx + radius * math.cos(angle), cy + radius * math.sin(angle)]
+            shapes.append({
+                "id": (task_id * 100000 + frame) * 100 + n,
+                "frame": frame,
+                "label_id": frame_rng.randrange(len(LABELS)) + 1,
+                "type": "polygon",
+                "points": points,
+                "attributes": [],
+                "group": 0,
+                "source": "manual",
+                "occluded": False,
+                "z_order": 0,
+                "rotation": 0.0,
+                "outside": False,
+            })
+        return shapes
+
+    @lru_cache(maxsize=1)
+    def frame_bytes() -> bytes:
+        noise = Image.effect_noise((config.frame_width, config.frame_height), 40).convert("RGB")
+        sand = Image.new("RGB", noise.size, (214, 196, 160))
+        buf = io.BytesIO()
+        Image.blend(sand, noise, 0.3).save(buf, "JPEG", quality=85)
+        return buf.getvalue()
+
+    @app.get("/api/tasks")
+    async def list_tasks():
+        await delay()
+        jobs = -(-config.frames // config.job_size)
+        return page([
+            {
+                "id": tid,
+                "name": f"survey-{tid}",
+                "size": config.frames,
+                "jobs": {"url": "", "count": jobs, "completed": 0, "validation": 0},
+                "labels": {"url": ""},
+            }
+            for tid in task_ids
+        ])
+
+    @app.get("/api/labels")
+    async def list_labels(task_id: int):
+        await delay()
+        check_task(task_id)
+        return page([{"id": i + 1, "name": name} for i, name in enumerate(LABELS)])
+
+    @app.get("/api/tasks/{task_id}/data/meta")
+    async def data_meta(task_id: int):
+        await delay()
+        check_task(task_id)
+        frames = [
+            {
+                "name": f"task{task_id}_y{(f // cols) * config.frame_height}_x{(f % cols) * config.frame_width}.jpg",
+                "width": config.frame_width,
+                "height": config.frame_height,
+                "related_files": 0,
+            }
+            for f in range(config.frames)
+        ]
+        return {"chunks_updated_date": "2025-01-01T00:00:00Z", "deleted_frames": [], "frames": frames}
+
+    @app.get("/api/jobs")
+    async def list_jobs(task_id: int, page_size: int = 100, page: int = 1):
+        await delay()
+        check_task(task_id)
+        jobs = [
+            {
+                "id": task_id * 1000 + n,
+                "task_id": task_id,
+                "type": "annotation",
+                "start_frame": start,
+                "stop_frame": min(start + config.job_size, config.frames) - 1,
+                "updated_date": "2025-01-01T00:00:00Z",
+                "issues": {"url": "", "count": 0},
+                "labels": {"url": ""},
+            }
+            for n, start in enumerate(range(0, config.frames, config.job_size))
+        ]
+        results = jobs[(page - 1) * page_size:page * page_size]
+        return {
+            "count": len(jobs),
+            "next": f"/api/jobs?task_id={task_id}&page={page + 1}" if page * page_size < len(jobs) else None,
+            "previous": None,
+            "results": results,
+        }
+
+    @app.get("/api/jobs/{job_id}/annotations")
+    async def job_annotations(job_id: int):
+        await delay()
+        task_id, n = divmod(job_id, 1000)
+        check_task(task_id)
+        if rng.random() < config.error_rate:
+            raise HTTPException(status_code=503, detail="Service unavailable.")
+        start = n * config.job_size
+        shapes = [s for f in range(start, min(start + config.job_size, config.frames)) for s in frame_shapes(task_id, f)]
+        return {"version": 0, "tags": [], "shapes": shapes, "tracks": []}
+
+    @app.get("/api/tasks/{task_id}/data")
+    async def frame_data(task_id: int, number: int = 0, quality: str = "original", type: str = "frame"):
+        # Any task id: frames of tasks imported from real exports (e.g. the sample data) load too
+        await delay()
+        return Response(frame_bytes(), media_type="image/jpeg")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake CVAT server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    defaults = FakeCvatConfig()
+    for field, value in vars(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    config = FakeCvatConfig(**{field: getattr(args, field) for field in vars(defaults)})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+# Stand-in for the OpenAI chat-completions endpoint used by the agent and the
+# expedition planner. Latency is a fixed time-to-first-token plus a per-token
+# generation time, so reply size drives response time as it does upstream.
+# JSON-mode requests get a valid ExpeditionPlan.
+#
+#   python -m loadtest.fake_openai --port 8082 --ttft-ms 400 --ms-per-token 15
+#   OPENAI_BASE_URL=http://127.0.0.1:8082/v1 OPENAI_API_KEY=fake uvicorn app.main:app
+
+
+@dataclass
+class FakeOpenAIConfig:
+    ttft_ms: float = 300.0
+    ms_per_token: float = 10.0
+    jitter_ms: float = 50.0
+    reply_tokens: int = 200  # approximate words in a chat reply
+    error_rate: float = 0.0  # share of requests answered 503
+    seed: int = 0
+
+
+_WORDS = (
+    "plastic debris nets buoys shoreline transect zone cleanup crew vessel tide survey weight "
+    "density hotspot north south reef lagoon collection priority estimate kilograms"
+).split()
+
+
+def _plan(request_body: dict, rng: random.Random) -> dict:
+    try:
+        facts = json.loads(request_body["messages"][-1]["content"])
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError):
+        facts = {}
+    employees = facts.get("employees", [])[:4]
+    return {
+        "site_name": facts.get("site_name", "Unknown Site"),
+        "summary": " ".join(rng.choices(_WORDS, k=40)),
+        "total_estimated_weight_kg": facts.get("total_estimated_weight_kg", 0.0),
+        "total_area_m2": facts.get("total_area_m2", 0.0),
+        "vessels": [{"vessel_type": "RHIB", "count": 2, "rationale": " ".join(rng.choices(_WORDS, k=12))}],
+        "team": [
+            {
+                "employee_id": e.get("id", ""),
+                "name": e.get("name", ""),
+                "role": e.get("role", ""),
+                "skills": e.get("skills", []),
+                "rationale": " ".join(rng.choices(_WORDS, k=10)),
+            }
+            for e in employees
+        ],
+        "estimated_duration_days": rng.randint(2, 10),
+        "notes": facts.get("notes", ""),
+    }
+
+
+def create_app(config: FakeOpenAIConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(config.seed)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if rng.random() < config.error_rate:
+            raise HTTPException(status_code=503, detail="Service unavailable.")
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = json.dumps(_plan(body, rng)) if json_mode else " ".join(rng.choices(_WORDS, k=config.reply_tokens))
+        completion_tokens = len(content.split())
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+
+        delay_ms = config.ttft_ms + completion_tokens * config.ms_per_token + rng.uniform(-1, 1) * config.jitter_ms
+        await asyncio.sleep(max(0.0, delay_ms) / 1000)
+        return {
+            "id": f"chatcmpl-fake-{rng.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"},
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat-completions server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    defaults = FakeOpenAIConfig()
+    for field, value in vars(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    config = FakeOpenAIConfig(**{field: getattr(args, field) for field in vars(defaults)})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
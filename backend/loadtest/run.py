@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+
+# Async load generator. Virtual users loop over weighted scenarios that replay
+# what the frontend does (dashboard polling, map panning, frame browsing,
+# agent chat, expedition planning) with think time between steps, and every
+# request is timed under its route template. Prints p50/p95/p99 latency,
+# throughput and errors per route; --json writes the same as a report.
+#
+# With --serve the app itself is started under uvicorn with DB_DIR set to a
+# scratch directory (removed afterwards), so synced fake tasks, frames and LLM
+# plans never land in the real db/.
+#
+#   python -m loadtest.run --base-url http://127.0.0.1:8000 --users 50 --duration 60
+#   python -m loadtest.run --serve --sync --mix dashboard=1,map=1   # scratch app, sync from CVAT first
+
+DEFAULT_MIX = {"dashboard": 3, "map": 4, "frames": 3, "chat": 1, "plan": 0.2}
+
+
+@dataclass
+class _Route:
+    latencies_ms: list[float] = field(default_factory=list)
+    errors: int = 0
+    bytes: int = 0
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, think_s: float, seed: int):
+        self.client = client
+        self.think_s = think_s
+        self.rng = random.Random(seed)
+        self.routes: dict[str, _Route] = {}
+        self.image_ids: list[int] = []  # georeferenced, in listing order, for map panning
+        self.frame_refs: list[tuple[int, int]] = []  # (task_id, frame)
+        self.sites: list[str] = []
+
+    async def request(self, route: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        stats = self.routes.setdefault(route, _Route())
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            await response.aread()
+        except httpx.HTTPError:
+            stats.errors += 1
+            return None
+        stats.latencies_ms.append((time.perf_counter() - start) * 1000)
+        stats.bytes += len(response.content)
+        if response.status_code >= 400:
+            stats.errors += 1
+            return None
+        return response
+
+    async def think(self) -> None:
+        await asyncio.sleep(self.rng.expovariate(1 / self.think_s) if self.think_s else 0)
+
+    async def discover(self) -> None:
+        """Collect image ids, frames and survey sites for the scenarios to pick from."""
+        cursor = None
+        while True:
+            params = {"limit": 1000, "fields": "id,task_id"}
+            if cursor:
+                params["cursor"] = cursor
+            page = (await self.client.get("/cvat/images", params=params)).json()
+            for item in page["items"]:
+                self.frame_refs.append((item["task_id"], item["id"] - item["task_id"] * 100000))
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+        georefs = (await self.client.get("/map/georefs")).json()["georefs"]
+        self.image_ids = sorted(int(image_id) for image_id in georefs)
+        surveys = (await self.client.get("/surveys")).json()
+        self.sites = sorted({s["site"] for s in surveys})
+
+    # --- Scenarios ---
+
+    async def dashboard(self) -> None:
+        for _ in range(3):  # the dashboard polls while open
+            await self.request("GET /dashboard/summary", "GET", "/dashboard/summary", params={"format": "topojson"})
+            await self.request("GET /dashboard/trends", "GET", "/dashboard/trends")
+            await self.think()
+
+    async def map(self) -> None:
+        await self.request("GET /map/georefs", "GET", "/map/georefs")
+        await self.request("GET /map/heatmap", "GET", "/map/heatmap")
+        await self.request("GET /map/mosaics", "GET", "/map/mosaics")
+        if not self.image_ids:
+            return
+        # Panning: a run of neighbouring images
+        start = self.rng.randrange(len(self.image_ids))
+        for image_id in self.image_ids[start:start + self.rng.randint(3, 10)]:
+            await self.request("GET /map/{image_id}", "GET", f"/map/{image_id}", params={"format": "topojson"})
+            await self.think()
+        if self.sites:
+            site = self.rng.choice(self.sites)
+            await self.request("GET /map/changes", "GET", "/map/changes", params={"site": site, "format": "topojson"})
+
+    async def frames(self) -> None:
+        page = await self.request("GET /cvat/images", "GET", "/cvat/images", params={"limit": 50})
+        if page is None or not self.frame_refs:
+            return
+        start = self.rng.randrange(len(self.frame_refs))
+        for task_id, frame in self.frame_refs[start:start + self.rng.randint(5, 20)]:
+            await self.request(
+                "GET /cvat/images/{task_id}/frames/{frame}", "GET", f"/cvat/images/{task_id}/frames/{frame}",
+            )
+            image_id = task_id * 100000 + frame
+            await self.request("GET /cvat/annotations/{image_id}", "GET", f"/cvat/annotations/{image_id}")
+            await self.think()
+
+    async def chat(self) -> None:
+        history: list[dict] = []
+        for question in ("Where is the most plastic?", "How many crew for the worst zone?"):
+            response = await self.request(
+                "POST /agent/chat", "POST", "/agent/chat",
+                json={"message": question, "history": history or None},
+            )
+            if response is None:
+                return
+            history += [{"role": "user", "content": question}, {"role": "assistant", "content": response.json()["reply"]}]
+            await self.think()
+
+    async def plan(self) -> None:
+        await self.request(
+            "POST /plan-expedition", "POST", "/plan-expedition",
+            json={"site_name": self.rng.choice(self.sites or ["Load test site"]), "notes": "load test"},
+        )
+
+    async def user(self, mix: dict[str, float], deadline: float) -> None:
+        scenarios = list(mix)
+        weights = [mix[s] for s in scenarios]
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(scenarios, weights)[0])()
+            await self.think()
+
+    def report(self, elapsed_s: float) -> dict:
+        routes = {}
+        for route, stats in sorted(self.routes.items()):
+            lat = np.array(stats.latencies_ms) if stats.latencies_ms else np.zeros(1)
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            routes[route] = {
+                "requests": len(stats.latencies_ms),
+                "errors": stats.errors,
+                "rps": round(len(stats.latencies_ms) / elapsed_s, 2),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "mean_kb": round(stats.bytes / max(len(stats.latencies_ms), 1) / 1024, 1),
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {
+            "elapsed_s": round(elapsed_s, 2),
+            "requests": total,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "rps": round(total / elapsed_s, 2),
+            "routes": routes,
+        }
+
+
+def _parse_mix(raw: str | None) -> dict[str, float]:
+    if not raw:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _print_report(report: dict) -> None:
+    print(f"{'route':<44}{'reqs':>7}{'err':>6}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'kB':>8}")
+    for route, r in report["routes"].items():
+        print(f"{route:<44}{r['requests']:>7}{r['errors']:>6}{r['rps']:>8.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['mean_kb']:>8.1f}")
+    print(f"total: {report['requests']} requests, {report['errors']} errors, "
+          f"{report['rps']:.1f} req/s over {report['elapsed_s']:.1f}s")
+
+
+@contextmanager
+def _serve(args: argparse.Namespace) -> Iterator[None]:
+    """Run the app on --base-url's host and port with its state in a scratch DB_DIR."""
+    db_dir = tempfile.mkdtemp(prefix="cleanly-loadtest-")
+    url = urlparse(args.base_url)
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", url.hostname or "127.0.0.1", "--port", str(url.port or 8000), "--workers", str(args.workers),
+    ]
+    proc = subprocess.Popen(command, env={**os.environ, "DB_DIR": db_dir})
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f"app exited with status {proc.returncode}")
+            try:
+                if httpx.get(f"{args.base_url}/health/startup", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit("app did not start within 60 s")
+            time.sleep(0.2)
+        print(f"app serving from scratch state in {db_dir}")
+        yield
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        if args.keep_db:
+            print(f"scratch state kept in {db_dir}")
+        else:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    headers = {"Accept-Encoding": "br, gzip"}
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits, headers=headers) as client:
+        if args.sync:
+            (await client.post("/cvat/sync", json={}, timeout=None)).raise_for_status()
+        load = LoadRun(client, args.think_ms / 1000, args.seed)
+        await load.discover()
+        mix = _parse_mix(args.mix)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(load.user(mix, deadline) for _ in range(args.users)))
+        return load.report(time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a realistic traffic mix against the API.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="Mean pause between a user's steps")
+    parser.add_argument("--mix", default=None, help="Scenario weights, e.g. dashboard=3,map=4,frames=3,chat=1")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sync", action="store_true", help="POST /cvat/sync before starting")
+    parser.add_argument("--serve", action="store_true",
+                        help="Start the app (uvicorn) with a scratch DB_DIR instead of using a running one")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes with --serve")
+    parser.add_argument("--keep-db", action="store_true", help="Keep the --serve scratch directory")
+    parser.add_argument("--json", default=None, help="Also write the report to this path")
+    args = parser.parse_args()
+
+    if args.serve:
+        with _serve(args):
+            report = asyncio.run(run(args))
+    else:
+        report = asyncio.run(run(args))
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
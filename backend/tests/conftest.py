@@ -0,0 +1,24 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Tests never touch the real db/: state goes to a scratch DB_DIR, set before any app module loads
+os.environ["DB_DIR"] = tempfile.mkdtemp(prefix="cleanly-tests-")
+atexit.register(shutil.rmtree, os.environ["DB_DIR"], ignore_errors=True)
+
+
+@pytest.fixture
+def scratch_db(tmp_path, monkeypatch):
+    """A fresh, empty db dir for one test; the services are reloaded from the session db afterwards."""
+    from app.services import change_service, cvat_service, geo_service, store, survey_service
+
+    monkeypatch.setattr(store, "_DB_DIR", tmp_path)
+    yield tmp_path
+    monkeypatch.undo()
+    survey_service.load_from_disk()
+    cvat_service.load_from_disk()
+    geo_service.load_from_disk()
+    change_service.load_from_disk()
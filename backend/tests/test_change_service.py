@@ -0,0 +1,100 @@
+from datetime import date
+
+import pytest
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeoCoordinate, SurveyInfo
+from app.services import change_service, cvat_service, geo_service, survey_service
+
+CENTER = GeoCoordinate(lat=43.3, lng=5.4)
+# 0.5 cm/px: the two corners are ~13 m apart, far beyond the 1 m match tolerance
+CORNER, FAR_CORNER = (100, 100), (1900, 1900)
+
+
+def _square(ann_id: int, image_id: int, corner: tuple[int, int], label: str = "bottle") -> CvatAnnotation:
+    x, y = corner
+    return CvatAnnotation(
+        id=ann_id, image_id=image_id, label=label, points=[[x, y], [x + 20, y], [x + 20, y + 20], [x, y + 20]],
+    )
+
+
+def _publish_task(task_id: int, *corners: tuple[int, int]) -> None:
+    """One 2000 px frame for the task, centred on CENTER, with a square at each corner."""
+    image_id = task_id * 100000
+    image = CvatImage(id=image_id, name=f"t{task_id}.jpg", width=2000, height=2000, task_id=task_id)
+    annotations = [_square(task_id * 100 + n, image_id, corner) for n, corner in enumerate(corners)]
+    cvat_service.replace_tasks({task_id}, {image_id: image}, {image_id: annotations})
+    geo_service.register_georeference(image_id, CENTER)
+
+
+@pytest.fixture
+def beach(scratch_db, monkeypatch):
+    """Site "beach": task 1 in May, tasks 2 and 3 flown on one day in June, task 4 in July."""
+    monkeypatch.setattr(change_service, "_changes", {})
+    monkeypatch.setattr(change_service, "_checked_version", None)
+    _publish_task(1, CORNER)
+    _publish_task(2, CORNER)
+    _publish_task(3, FAR_CORNER)
+    _publish_task(4, CORNER, FAR_CORNER)
+    for task_id, day in ((1, date(2025, 5, 1)), (2, date(2025, 6, 1)), (3, date(2025, 6, 1)), (4, date(2025, 7, 1))):
+        survey_service.set_survey(task_id, SurveyInfo(site="beach", surveyed_on=day))
+
+    diffed: list[str] = []
+    diff = change_service._diff
+
+    def spy(before, after, old, new):
+        diffed.append(change_service._pair_key(before, after))
+        return diff(before, after, old, new)
+
+    monkeypatch.setattr(change_service, "_diff", spy)
+    return diffed
+
+
+def test_same_day_tasks_form_one_survey(beach):
+    first, second = change_service.get_site_changes("beach")
+
+    assert (first.before_task_ids, first.after_task_ids) == ([1], [2, 3])
+    assert (first.before_date, first.after_date) == (date(2025, 5, 1), date(2025, 6, 1))
+    # Task 2 re-finds the May detection, task 3 adds one elsewhere: one survey between them
+    assert (first.persisting, first.new, first.removed) == (1, 1, 0)
+    assert first.weight_after_g == pytest.approx(2 * first.weight_before_g)
+
+    assert (second.before_task_ids, second.after_task_ids) == ([2, 3], [4])
+    assert (second.persisting, second.new, second.removed) == (2, 0, 0)
+    assert second.delta_g == 0
+
+    (trend,) = change_service.get_trends("beach")
+    assert [s["task_ids"] for s in trend["surveys"]] == [[1], [2, 3], [4]]
+    assert [s["detections"] for s in trend["surveys"]] == [1, 2, 2]
+
+
+def test_only_changed_survey_pairs_are_recomputed(beach):
+    assert change_service.refresh_changes() == 2
+    assert beach == ["1:2,3", "2,3:4"]
+    stored = dict(change_service._changes)
+
+    # Nothing changed: nothing is recomputed, whatever else bumped a version
+    change_service._checked_version = None
+    assert change_service.refresh_changes() == 0
+
+    # Task 4 loses a detection: only the June -> July pair depends on it
+    beach.clear()
+    _publish_task(4, CORNER)
+    assert change_service.refresh_changes() == 1
+    assert beach == ["2,3:4"]
+    assert change_service._changes["1:2,3"] is stored["1:2,3"]
+    (_, july) = change_service.get_site_changes("beach")
+    assert (july.persisting, july.removed) == (1, 1)
+
+    # Task 3 is part of both pairs
+    beach.clear()
+    _publish_task(3)
+    assert change_service.refresh_changes() == 2
+    assert sorted(beach) == ["1:2,3", "2,3:4"]
+
+
+def test_stored_diffs_survive_a_restart(beach):
+    change_service.refresh_changes()
+    beach.clear()
+    change_service.load_from_disk()
+    assert len(change_service.get_site_changes("beach")) == 2
+    assert beach == []
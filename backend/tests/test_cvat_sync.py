@@ -0,0 +1,100 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+from app.config import settings
+from app.services import cvat_service
+from loadtest.fake_cvat import FakeCvatConfig, create_app
+
+FIRST_TASK = 100
+JOBS_PER_TASK = 4
+
+
+@pytest.fixture(scope="module")
+def fake_cvat():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = FakeCvatConfig(
+        tasks=2, first_task_id=FIRST_TASK, frames=8, job_size=2, shapes_per_frame=2, latency_ms=0, jitter_ms=0,
+    )
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
+
+
+class _Fetches(list):
+    """Job ids fetched from CVAT, in order. Fetching a job listed in `fail_on` raises instead."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_on: set[int] = set()
+
+
+@pytest.fixture
+def fetched(fake_cvat, scratch_db, monkeypatch):
+    monkeypatch.setattr(settings, "cvat_base_url", fake_cvat)
+    monkeypatch.setattr(cvat_service, "SYNC_DIR", scratch_db / "sync")
+    fetches = _Fetches()
+    fetch = cvat_service._fetch_job
+
+    def fetch_job(client, task_id, job, label_map, path):
+        if job.id in fetches.fail_on:
+            raise RuntimeError(f"connection lost on job {job.id}")
+        fetches.append(job.id)
+        return fetch(client, task_id, job, label_map, path)
+
+    monkeypatch.setattr(cvat_service, "_fetch_job", fetch_job)
+    return fetches
+
+
+def _sync(task_id: int | None = None):
+    return asyncio.run(cvat_service.sync_cvat_data(task_id))
+
+
+def _jobs(task_id: int, *numbers: int) -> list[int]:
+    return [task_id * 1000 + n for n in numbers]
+
+
+def test_resume_fetches_only_missing_jobs(fetched):
+    fetched.fail_on = set(_jobs(FIRST_TASK, 2))
+    with pytest.raises(RuntimeError):
+        _sync(FIRST_TASK)
+    assert fetched == _jobs(FIRST_TASK, 0, 1)
+    assert not cvat_service.get_cached_images()
+
+    fetched.clear()
+    fetched.fail_on = set()
+    result = _sync(FIRST_TASK)
+    assert fetched == _jobs(FIRST_TASK, 2, 3)
+    assert len(result.images) == 8
+    assert result.annotations_count == 16
+    # All shapes made it in, from checkpointed and freshly fetched jobs alike
+    assert sum(len(cvat_service.get_cached_annotations(img.id)) for img in result.images) == 16
+    assert not (cvat_service.SYNC_DIR / str(FIRST_TASK)).exists()
+
+
+def test_each_task_is_published_once_pulled(fetched):
+    second = FIRST_TASK + 1
+    fetched.fail_on = set(_jobs(second, 1))
+    with pytest.raises(RuntimeError):
+        _sync()
+    assert fetched == _jobs(FIRST_TASK, *range(JOBS_PER_TASK)) + _jobs(second, 0)
+    # The first task is in the dataset and its checkpoints are gone; the second resumes
+    assert {img.task_id for img in cvat_service.get_cached_images().values()} == {FIRST_TASK}
+    assert not (cvat_service.SYNC_DIR / str(FIRST_TASK)).exists()
+
+    fetched.clear()
+    fetched.fail_on = set()
+    _sync(second)
+    assert fetched == _jobs(second, 1, 2, 3)
+    assert {img.task_id for img in cvat_service.get_cached_images().values()} == {FIRST_TASK, second}
@@ -0,0 +1,48 @@
+from datetime import date
+
+import pytest
+
+from app.models.schemas import DensityModel, SiteDensityOverride, SurveyInfo
+from app.services import density_model, survey_service
+
+
+@pytest.fixture
+def model(scratch_db, monkeypatch):
+    model = DensityModel(
+        ground_resolution_cm=0.5,
+        default_density_g_cm2=0.5,
+        label_density_g_cm2={"can": 0.2},
+        site_overrides={"beach": SiteDensityOverride(ground_resolution_cm=1.0, label_density_g_cm2={"can": 0.4})},
+    )
+    monkeypatch.setattr(density_model, "_model", model)
+    survey_service.set_survey(1, SurveyInfo(site="beach", surveyed_on=date(2025, 5, 1)))
+    survey_service.set_survey(2, SurveyInfo(site="beach", surveyed_on=date(2025, 6, 1)))
+    survey_service.set_survey(3, SurveyInfo(site="dunes", surveyed_on=date(2025, 5, 1)))
+    return model
+
+
+def test_overrides_apply_to_every_task_of_the_site(model):
+    for task_id in (1, 2):
+        assert density_model.resolution_cm(task_id) == 1.0
+        assert density_model.density_g_cm2("can", task_id) == 0.4
+        assert density_model.density_g_cm2("net", task_id) == 0.5
+        assert density_model.label_weight_g("can", 10, task_id) == pytest.approx(10 * 1.0**2 * 0.4)
+
+
+@pytest.mark.parametrize("task_id", [3, 4, None])
+def test_other_sites_and_unsurveyed_tasks_use_global_values(model, task_id):
+    assert density_model.resolution_cm(task_id) == 0.5
+    assert density_model.density_g_cm2("can", task_id) == 0.2
+    assert density_model.weight_g({"can": 10, "net": 10}, task_id) == pytest.approx(10 * 0.25 * (0.2 + 0.5))
+
+
+def test_task_ids_are_not_override_keys(model):
+    model.site_overrides["3"] = SiteDensityOverride(ground_resolution_cm=9.0)
+    assert density_model.resolution_cm(3) == 0.5
+
+
+def test_moving_a_task_to_another_site_changes_model_version(model):
+    version = density_model.get_model_version()
+    survey_service.set_survey(3, SurveyInfo(site="beach", surveyed_on=date(2025, 5, 1)))
+    assert density_model.get_model_version() != version
+    assert density_model.resolution_cm(3) == 1.0
@@ -0,0 +1,32 @@
+import math
+
+import pytest
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeoCoordinate, ImageGeoReference
+from app.services import change_service, geo_service
+from app.services.cvat_service import Dataset
+
+GEOREF = ImageGeoReference(image_id=1, center=GeoCoordinate(lat=60.0, lng=5.0), ground_resolution_cm_per_pixel=1.0)
+
+
+def test_pixel_offsets_are_metres_on_both_axes():
+    # 100 px at 1 cm/px is 1 m east and 1 m north of the centre of a 200 x 200 frame
+    ring = geo_service.annotation_ring([[200, 100], [100, 0], [100, 100]], 200, 200, GEOREF)
+    (east_lng, east_lat), (north_lng, north_lat) = ring[0], ring[1]
+    assert (east_lat, north_lng) == (60.0, 5.0)
+    assert (north_lat - 60.0) * 111_320 == pytest.approx(1.0)
+    assert (east_lng - 5.0) * 111_320 * math.cos(math.radians(60.0)) == pytest.approx(1.0)
+    assert ring[-1] == ring[0]
+
+
+def test_projection_version_keys_georef_version_and_change_fingerprints(monkeypatch):
+    image = CvatImage(id=1, name="a.jpg", width=200, height=200, task_id=1)
+    ann = CvatAnnotation(id=1, image_id=1, label="can", points=[[0, 0], [10, 0], [0, 10]], pixel_area=50)
+    dataset = Dataset(version=1, images={1: image}, annotations={1: [ann]}, label_pixels={1: {"can": 50.0}})
+    monkeypatch.setattr(change_service, "get_all_georefs", lambda: {1: GEOREF})
+
+    version, fingerprint = geo_service.get_georef_version(), change_service._fingerprint(dataset, [1])
+    monkeypatch.setattr(geo_service, "PROJECTION_VERSION", geo_service.PROJECTION_VERSION + 1)
+    monkeypatch.setattr(change_service, "PROJECTION_VERSION", geo_service.PROJECTION_VERSION)
+    assert geo_service.get_georef_version() != version
+    assert change_service._fingerprint(dataset, [1]) != fingerprint
@@ -0,0 +1,145 @@
+import itertools
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeoCoordinate, ImageGeoReference
+from app.services import image_index
+from app.services.cvat_service import Dataset
+from app.services.density_model import weight_g
+
+SITES = {"beach": {1, 2}, "dunes": {3}}
+LABELS = ("bottle", "can", "net")
+
+
+def _dataset(version: int, frames: int = 30) -> Dataset:
+    """Three tasks with repeated names and weights, so ties must be broken by id."""
+    images, annotations, label_pixels = {}, {}, {}
+    for task_id in (1, 2, 3):
+        for frame in range(frames):
+            image_id = task_id * 100000 + frame
+            images[image_id] = CvatImage(
+                id=image_id, name=f"frame_{frame % 7:02d}.jpg", width=100, height=100, task_id=task_id,
+            )
+            labels = LABELS[:(frame + task_id) % 4]
+            if labels:
+                annotations[image_id] = [
+                    CvatAnnotation(id=image_id * 10 + i, image_id=image_id, label=label, points=[[0, 0], [1, 1]])
+                    for i, label in enumerate(labels)
+                ]
+                label_pixels[image_id] = {label: float(100 * (frame % 5)) for label in labels}
+    return Dataset(version=version, images=images, annotations=annotations, label_pixels=label_pixels)
+
+
+@pytest.fixture
+def index_state(monkeypatch):
+    state = {
+        "dataset": _dataset(1),
+        "georefs": {
+            i: ImageGeoReference(image_id=i, center=GeoCoordinate(lat=0, lng=0))
+            for i in (100000, 100003, 200005, 300001, 300002, 999999)
+        },
+        "georef_version": 1,
+    }
+    monkeypatch.setattr(image_index, "_index", None)
+    monkeypatch.setattr(image_index, "get_dataset", lambda: state["dataset"])
+    monkeypatch.setattr(image_index, "get_all_georefs", lambda: state["georefs"])
+    monkeypatch.setattr(image_index, "get_georef_version", lambda: state["georef_version"])
+    monkeypatch.setattr(image_index, "site_task_ids", lambda site: SITES.get(site, set()))
+    return state
+
+
+def _all_pages(limit: int, cursor: str | None = None, **query) -> list[dict]:
+    items = []
+    while True:
+        page = image_index.query_images(limit=limit, cursor=cursor, **query)
+        assert len(page["items"]) <= limit
+        items += page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def _expected(state, sort="name", task_id=None, site=None, has_annotations=None, label=None,
+              min_weight_g=None, georeferenced=None) -> list[int]:
+    """Brute-force answer: filter every image, then sort."""
+    dataset, georefs = state["dataset"], state["georefs"]
+    rows = []
+    for image_id, img in dataset.images.items():
+        label_pixels = dataset.label_pixels_for(image_id)
+        weight = weight_g(label_pixels, img.task_id)
+        if (
+            (task_id is None or img.task_id == task_id)
+            and (site is None or img.task_id in SITES.get(site, set()))
+            and (has_annotations is None or bool(dataset.annotations_for(image_id)) == has_annotations)
+            and (label is None or label in label_pixels)
+            and (min_weight_g is None or weight >= min_weight_g)
+            and (georeferenced is None or (image_id in georefs) == georeferenced)
+        ):
+            rows.append(((-weight, image_id) if sort == "weight" else (img.name, image_id), image_id))
+    return [image_id for _, image_id in sorted(rows)]
+
+
+@pytest.mark.parametrize("sort", image_index.SORT_KEYS)
+@pytest.mark.parametrize("limit", [1, 4, 1000])
+def test_pages_cover_every_image_once_in_order(index_state, sort, limit):
+    ids = [item["id"] for item in _all_pages(limit, sort=sort)]
+    assert ids == _expected(index_state, sort=sort)
+
+
+FILTERS = {
+    "task_id": [None, 2, 4],
+    "site": [None, "beach", "nowhere"],
+    "has_annotations": [None, True, False],
+    "label": [None, "can", "tyre"],
+    "min_weight_g": [None, 0, 24, 36.0, 1e9],
+    "georeferenced": [None, True, False],
+}
+
+
+@pytest.mark.parametrize("sort", image_index.SORT_KEYS)
+def test_filter_combinations_match_brute_force(index_state, sort):
+    for values in itertools.product(*FILTERS.values()):
+        query = dict(zip(FILTERS, values))
+        ids = [item["id"] for item in _all_pages(5, sort=sort, **query)]
+        assert ids == _expected(index_state, sort=sort, **query), query
+
+
+def test_cursor_is_stable_across_data_changes(index_state):
+    first = image_index.query_images(limit=10, sort="name")
+    seen = [item["id"] for item in first["items"]]
+
+    # New images sorting before and after the cursor, and one already-served image removed
+    dataset = _dataset(2, frames=40)
+    del dataset.images[seen[0]]
+    index_state["dataset"] = dataset
+
+    rest = [item["id"] for item in _all_pages(10, sort="name", cursor=first["next_cursor"])]
+    last_key = (first["items"][-1]["name"], seen[-1])
+    assert not set(rest) & set(seen)
+    assert rest == [i for i in _expected(index_state) if (dataset.images[i].name, i) > last_key]
+
+
+def test_georeferenced_follows_georef_version(index_state):
+    before = [item["id"] for item in _all_pages(100, georeferenced=True)]
+    index_state["georefs"] = {**index_state["georefs"], 100001: index_state["georefs"][100000]}
+    index_state["georef_version"] = 2
+    after = [item["id"] for item in _all_pages(100, georeferenced=True)]
+    assert after == _expected(index_state, georeferenced=True)
+    assert set(after) - set(before) == {100001}
+
+
+def test_projection_and_row_fields(index_state):
+    page = image_index.query_images(limit=1, sort="weight", fields=["id", "weight_g", "georeferenced"])
+    (item,) = page["items"]
+    assert set(item) == {"id", "weight_g", "georeferenced"}
+    assert item["weight_g"] == max(
+        weight_g(index_state["dataset"].label_pixels_for(i), i // 100000) for i in index_state["dataset"].images
+    )
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", image_index._encode_cursor("weight", (0.0, 1))])
+def test_bad_cursors_are_rejected(index_state, cursor):
+    with pytest.raises(HTTPException) as exc:
+        image_index.query_images(cursor=cursor, sort="name")
+    assert exc.value.status_code == 400
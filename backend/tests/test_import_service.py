@@ -0,0 +1,180 @@
+import json
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import cvat_service, import_service
+from app.services.import_service import _ANNOTATION_ID_STRIDE, _coco_rle_counts, import_export_archive
+
+XML = """<?xml version="1.0" encoding="utf-8"?>
+<annotations>
+  <version>1.1</version>
+  <meta>
+    <task>
+      <id>12</id>
+      <name>beach</name>
+      <segments><segment><id>99</id></segment></segments>
+    </task>
+  </meta>
+  <image id="0" name="a.jpg" width="100" height="80">
+    <polygon label="bottle" points="0.00,0.00;10.00,0.00;10.00,10.00;0.00,10.00" occluded="0"/>
+    <box label="can" xtl="10" ytl="20" xbr="30" ybr="25"/>
+    <ellipse label="net" cx="50" cy="40" rx="10" ry="5"/>
+  </image>
+  <image id="1" name="b.jpg" width="100" height="80">
+    <mask label="net" rle="5, 3, 2, 4" left="10" top="20" width="3" height="4"/>
+    <polyline label="rope" points="0,0;5,5"/>
+    <tag label="reviewed"/>
+  </image>
+  <image id="2" name="c.jpg" width="100" height="80"/>
+</annotations>
+"""
+
+
+def _zip(path, members: dict[str, str]):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return path
+
+
+def _xml_images(*images: tuple[int, int, int]) -> str:
+    """<image> elements with a task_id attribute (project exports): (task id, frame, shape count)."""
+    body = "".join(
+        f'<image id="{frame}" task_id="{task}" name="t{task}-{frame}.jpg" width="10" height="10">'
+        + '<box label="can" xtl="0" ytl="0" xbr="1" ybr="1"/>' * shapes
+        + "</image>"
+        for task, frame, shapes in images
+    )
+    return f"<annotations><meta><project><id>1</id></project></meta>{body}</annotations>"
+
+
+def _annotations(image_id: int) -> list:
+    return cvat_service.get_cached_annotations(image_id)
+
+
+def test_xml_import_streams_every_shape_type(scratch_db):
+    result = import_export_archive(_zip(scratch_db / "export.zip", {"annotations.xml": XML}))
+
+    assert [img.id for img in result.images] == [1200000, 1200001, 1200002]
+    assert {img.task_id for img in result.images} == {12}
+    assert result.annotations_count == 5
+    first, second = _annotations(1200000), _annotations(1200001)
+    assert [(a.label, a.shape_type) for a in first] == [("bottle", "polygon"), ("can", "rectangle"), ("net", "ellipse")]
+    assert [(a.label, a.shape_type) for a in second] == [("net", "mask"), ("rope", "polyline")]
+    assert [a.id for a in first + second] == [12 * _ANNOTATION_ID_STRIDE + seq for seq in range(5)]
+    assert first[0].pixel_area == pytest.approx(100.0)  # polygons are measured by geometry validation
+    assert first[1].pixel_area == pytest.approx(100.0)
+    assert second[0].pixel_area == 7.0  # foreground runs of the mask
+    assert second[0].points[0] == [10.0, 20.0]
+    assert _annotations(1200002) == []
+
+
+def test_xml_task_ids_come_from_images_then_meta_then_argument(scratch_db):
+    archive = _zip(scratch_db / "project.zip", {"annotations.xml": _xml_images((3, 0, 1), (4, 0, 2))})
+    result = import_export_archive(archive, task_id=7)
+    assert [img.id for img in result.images] == [300000, 400000]
+    assert [a.id for a in _annotations(400000)] == [4 * _ANNOTATION_ID_STRIDE, 4 * _ANNOTATION_ID_STRIDE + 1]
+
+    bare = "<annotations><image id='5' name='x.jpg' width='1' height='1'/></annotations>"
+    result = import_export_archive(_zip(scratch_db / "bare.zip", {"annotations.xml": bare}), task_id=7)
+    assert [img.id for img in result.images] == [700005]
+
+
+def test_annotation_ids_stop_at_the_task_stride(scratch_db, monkeypatch):
+    monkeypatch.setattr(import_service, "_ANNOTATION_ID_STRIDE", 3)
+    full = _xml_images((1, 0, 2), (1, 1, 1), (2, 0, 1))
+    import_export_archive(_zip(scratch_db / "full.zip", {"annotations.xml": full}))
+    ids = [a.id for image_id in (100000, 100001, 200000) for a in _annotations(image_id)]
+    # The last id of task 1 sits just below the first of task 2
+    assert ids == [3, 4, 5, 6]
+
+    over = _xml_images((1, 0, 2), (1, 1, 2), (2, 0, 1))
+    with pytest.raises(HTTPException) as exc:
+        import_export_archive(_zip(scratch_db / "over.zip", {"annotations.xml": over}))
+    assert exc.value.status_code == 400
+    # Nothing was published from the rejected archive
+    assert [a.id for a in _annotations(100001)] == [5]
+
+
+def _encode_rle(counts: list[int]) -> str:
+    """Reference port of pycocotools rleToString."""
+    out = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            out.append(chr((c | 0x20 if more else c) + 48))
+    return "".join(out)
+
+
+@pytest.mark.parametrize("counts", [
+    [],
+    [0],
+    [5, 3],
+    [7, 2, 9, 1, 3],  # later runs shorter than two before: negative deltas
+    [0, 40000, 12, 70000, 3, 1],  # values spanning several 5-bit groups
+])
+def test_coco_rle_counts_decodes_pycocotools_strings(counts):
+    assert _coco_rle_counts(_encode_rle(counts)) == counts
+
+
+def _coco(images: list[dict], annotations: list[dict]) -> str:
+    # Categories last, as some exporters write them: the category pass must not depend on order
+    return json.dumps({"images": images, "annotations": annotations, "categories": [
+        {"id": 1, "name": "bottle"}, {"id": 2, "name": "net"},
+    ]})
+
+
+def test_coco_import_three_passes(scratch_db):
+    images = [
+        {"id": 41, "file_name": "a.jpg", "width": 20, "height": 10},
+        {"id": 42, "file_name": "b.jpg", "width": 20, "height": 10},
+        {"id": 43, "file_name": "empty.jpg", "width": 20, "height": 10},
+    ]
+    annotations = [
+        # Two rings of one object become two polygons
+        {"id": 1, "image_id": 41, "category_id": 1, "bbox": [0, 0, 4, 4],
+         "segmentation": [[0, 0, 4, 0, 4, 4, 0, 4], [10, 0, 12, 0, 12, 2]]},
+        {"id": 2, "image_id": 41, "category_id": 9, "bbox": [1, 2, 3, 4]},
+        {"id": 3, "image_id": 42, "category_id": 2, "bbox": [2, 1, 5, 3],
+         "segmentation": {"size": [10, 20], "counts": _encode_rle([30, 6, 50, 9, 105])}},
+        {"id": 4, "image_id": 42, "category_id": 2, "bbox": [0, 0, 1, 1],
+         "segmentation": {"size": [10, 20], "counts": [0, 2, 198]}},
+    ]
+    archive = _zip(scratch_db / "coco.zip", {
+        "images/a.jpg": "",
+        "annotations/instances_default.json": _coco(images, annotations),
+    })
+    result = import_export_archive(archive, task_id=9)
+
+    assert [(img.id, img.name) for img in result.images] == [
+        (900000, "a.jpg"), (900001, "b.jpg"), (900002, "empty.jpg"),
+    ]
+    a, b = _annotations(900000), _annotations(900001)
+    assert [(x.label, x.shape_type) for x in a] == [("bottle", "polygon"), ("bottle", "polygon"), ("9", "rectangle")]
+    assert a[0].pixel_area == pytest.approx(16.0) and a[1].pixel_area == pytest.approx(2.0)
+    assert a[2].points == [[1.0, 2.0], [4.0, 2.0], [4.0, 6.0], [1.0, 6.0]]
+    assert [(x.label, x.shape_type, x.pixel_area) for x in b] == [("net", "mask", 15.0), ("net", "mask", 2.0)]
+    assert [x.id for x in a + b] == [9 * _ANNOTATION_ID_STRIDE + seq for seq in range(5)]
+    assert _annotations(900002) == []
+
+
+def test_coco_needs_a_task_id(scratch_db):
+    archive = _zip(scratch_db / "coco.zip", {"instances.json": _coco([], [])})
+    with pytest.raises(HTTPException) as exc:
+        import_export_archive(archive)
+    assert exc.value.status_code == 400
+
+
+def test_rejects_archives_without_annotations(scratch_db):
+    with pytest.raises(HTTPException):
+        import_export_archive(_zip(scratch_db / "empty.zip", {"readme.txt": "hi"}))
+    (scratch_db / "not.zip").write_bytes(b"plain bytes")
+    with pytest.raises(HTTPException):
+        import_export_archive(scratch_db / "not.zip")
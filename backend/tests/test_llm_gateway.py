@@ -0,0 +1,137 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from app.config import settings
+from app.services import llm_gateway
+
+_REQUEST = httpx.Request("POST", "https://api.test/v1/chat/completions")
+
+
+def _status_error(status: int) -> openai.APIStatusError:
+    return openai.APIStatusError("error", response=httpx.Response(status, request=_REQUEST), body=None)
+
+
+@pytest.fixture(autouse=True)
+def scratch_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "CACHE_DIR", tmp_path / "llm_cache")
+    monkeypatch.setattr(settings, "llm_backoff_s", 0.0)
+    monkeypatch.setattr(settings, "openai_base_url", "")
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Replace the API call with canned replies; records each call."""
+    calls = []
+    replies = []
+
+    async def fake(model, messages, params):
+        calls.append(messages)
+        return {"content": replies.pop(0), "prompt_tokens": 3, "completion_tokens": 5, "attempts": 1}
+
+    monkeypatch.setattr(llm_gateway, "_call_upstream", fake)
+    return SimpleNamespace(calls=calls, replies=replies)
+
+
+def _complete(purpose: str, **kwargs):
+    return asyncio.run(llm_gateway.complete([{"role": "user", "content": purpose}], purpose=purpose, **kwargs))
+
+
+@pytest.mark.parametrize("exc, transient", [
+    (openai.APIConnectionError(request=_REQUEST), True),
+    (openai.APITimeoutError(request=_REQUEST), True),
+    (_status_error(429), True),
+    (_status_error(503), True),
+    (_status_error(400), False),
+    (_status_error(401), False),
+    (ValueError("bad"), False),
+])
+def test_transient_classification(exc, transient):
+    assert llm_gateway._transient(exc) is transient
+
+
+def _fake_client(monkeypatch, outcomes):
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))],
+            usage=SimpleNamespace(prompt_tokens=1, completion_tokens=2),
+        )
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm_gateway, "_get_client", lambda: (client, asyncio.Semaphore(1)))
+    return calls
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    calls = _fake_client(monkeypatch, [_status_error(503), openai.APITimeoutError(request=_REQUEST), "ok"])
+    result = asyncio.run(llm_gateway._call_upstream("m", [], {}))
+    assert result["content"] == "ok"
+    assert result["attempts"] == 3
+    assert len(calls) == 3
+
+
+def test_permanent_errors_are_not_retried(monkeypatch):
+    calls = _fake_client(monkeypatch, [_status_error(400), "ok"])
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(llm_gateway._call_upstream("m", [], {}))
+    assert len(calls) == 1
+
+
+def test_retries_stop_at_the_limit(monkeypatch):
+    monkeypatch.setattr(settings, "llm_retries", 2)
+    calls = _fake_client(monkeypatch, [_status_error(503)] * 5)
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(llm_gateway._call_upstream("m", [], {}))
+    assert len(calls) == 3
+
+
+def test_cache_miss_then_hit(upstream):
+    upstream.replies.append("answer")
+    assert _complete("cache-hit", cache=True) == "answer"
+    assert _complete("cache-hit", cache=True) == "answer"
+    assert len(upstream.calls) == 1
+    stats = llm_gateway.get_llm_stats()["purposes"]["cache-hit"]
+    assert (stats["calls"], stats["cache_hits"]) == (2, 1)
+
+
+def test_uncached_calls_always_go_upstream(upstream):
+    upstream.replies.extend(["one", "two"])
+    assert _complete("no-cache") == "one"
+    assert _complete("no-cache") == "two"
+    assert not llm_gateway.CACHE_DIR.exists()
+
+
+def test_cache_is_scoped_to_the_endpoint(upstream, monkeypatch):
+    upstream.replies.extend(["from fake", "from real"])
+    monkeypatch.setattr(settings, "openai_base_url", "http://127.0.0.1:8082/v1")
+    assert _complete("endpoint", cache=True) == "from fake"
+    monkeypatch.setattr(settings, "openai_base_url", "")
+    assert _complete("endpoint", cache=True) == "from real"
+    assert len(upstream.calls) == 2
+
+
+def test_rejected_completion_is_not_cached(upstream):
+    upstream.replies.extend(["not json", json.dumps({"ok": True})])
+    with pytest.raises(json.JSONDecodeError):
+        _complete("validate", cache=True, validate=json.loads)
+    assert not list(llm_gateway.CACHE_DIR.glob("*.json"))
+    assert _complete("validate", cache=True, validate=json.loads) == {"ok": True}
+    assert _complete("validate", cache=True, validate=json.loads) == {"ok": True}
+    assert len(upstream.calls) == 2
+
+
+def test_cached_entry_failing_validation_is_refetched(upstream):
+    upstream.replies.extend(["old format", json.dumps({"ok": True})])
+    assert _complete("revalidate", cache=True) == "old format"
+    assert _complete("revalidate", cache=True, validate=json.loads) == {"ok": True}
+    assert len(upstream.calls) == 2
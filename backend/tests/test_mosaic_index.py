@@ -0,0 +1,49 @@
+import pytest
+
+from app.models.schemas import CvatImage
+from app.services import mosaic_index
+from app.services.cvat_service import Dataset
+
+TASK = 7
+
+
+def _image_id(frame: int) -> int:
+    return TASK * 100000 + frame
+
+
+@pytest.fixture
+def edge_shifted_mosaic(monkeypatch):
+    """Two rows of 1000 px frames whose last column is shifted back: x = 0, 1000, 2000, 2500."""
+    images = {}
+    for r, y in enumerate((0, 1000)):
+        for c, x in enumerate((0, 1000, 2000, 2500)):
+            frame = r * 4 + c + 1
+            images[_image_id(frame)] = CvatImage(
+                id=_image_id(frame), name=f"{TASK}-{frame}_y{y}_x{x}.jpg", width=1000, height=1000, task_id=TASK,
+            )
+    index = mosaic_index._build(Dataset(version=1, images=images, annotations={}, label_pixels={}))
+    monkeypatch.setattr(mosaic_index, "get_index", lambda: index)
+    return index
+
+
+def test_frames_sharing_a_cell_are_all_kept(edge_shifted_mosaic):
+    grid = edge_shifted_mosaic.grids[TASK]
+    assert (grid.rows, grid.cols) == (2, 3)
+    assert grid.tiles == 8
+    assert grid.collisions == 4  # frames 3/4 and 7/8 share a cell
+    assert sorted(grid.cell_ids.tolist()) == [_image_id(f) for f in range(1, 9)]
+
+
+def test_tiles_in_rect_finds_shifted_column(edge_shifted_mosaic):
+    assert mosaic_index.tiles_in_rect(TASK, 3000, 0, 3500, 2000) == [_image_id(4), _image_id(8)]
+    assert mosaic_index.tiles_in_rect(TASK, 2900, 0, 3000, 1000) == [_image_id(3), _image_id(4)]
+    assert mosaic_index.tiles_in_rect(TASK, 3500, 0, 4000, 1000) == []
+
+
+def test_neighbours_include_cell_mates(edge_shifted_mosaic):
+    found = {image_id: (d_col, d_row) for image_id, d_col, d_row in mosaic_index.neighbours(_image_id(3))}
+    assert found[_image_id(4)] == (0, 0)
+    assert found[_image_id(8)] == (0, 1)
+    assert found[_image_id(2)] == (-1, 0)
+    assert _image_id(3) not in found
+    assert len(found) == 5
@@ -0,0 +1,114 @@
+from datetime import date
+
+import pytest
+
+from app.config import settings
+from app.models.schemas import CvatAnnotation, CvatImage, SurveyInfo
+from app.services import cvat_service, partitions, snapshot_columns, survey_service
+from app.services.snapshot_columns import encode_dataset, open_dataset
+
+MB = 1024 * 1024
+
+
+def _task(task_id: int, frames: int, prefix: str = "") -> tuple[dict, dict]:
+    images, annotations = {}, {}
+    for frame in range(frames):
+        image_id = task_id * 100000 + frame
+        images[image_id] = CvatImage(
+            id=image_id, name=f"{prefix}{task_id}-{frame}.jpg", width=640, height=480, task_id=task_id,
+        )
+        annotations[image_id] = [
+            CvatAnnotation(id=image_id, image_id=image_id, label="can", points=[[0, 0], [4, 0], [4, 4]]),
+        ]
+    return images, annotations
+
+
+def _resident(generation: int) -> dict:
+    return {key[1]: part for key, part in partitions._resident.items() if key[0] == generation}
+
+
+@pytest.fixture
+def dataset(monkeypatch):
+    """Lazy columns over three tasks of 4 images, each image charged as 0.25 MB."""
+    monkeypatch.setattr(settings, "partition_memory_mb", 2)
+    monkeypatch.setattr(snapshot_columns, "_IMAGE_BYTES", MB // 4)
+    # The budget is global: start from no resident partitions, whatever earlier tests read
+    for generation in {key[0] for key in partitions._resident}:
+        partitions.release(generation)
+    images, annotations = {}, {}
+    for task_id in (1, 2, 3):
+        task_images, task_annotations = _task(task_id, 4)
+        images.update(task_images)
+        annotations.update(task_annotations)
+    generation = partitions.new_generation()
+    loaded, _, _ = open_dataset(*encode_dataset(images, annotations, {}), generation)
+    yield generation, loaded
+    partitions.release(generation)
+
+
+def test_eviction_keeps_resident_bytes_under_budget(dataset):
+    generation, images = dataset
+    evictions = partitions.get_partition_stats()["evictions"]
+
+    for image_id in images:
+        assert images[image_id].id == image_id
+        assert partitions._bytes <= settings.partition_memory_mb * MB
+
+    # Task 1 and 2 are a full 1 MB partition each: reading task 3 evicted task 1
+    assert list(_resident(generation)) == ["task:2", "task:3"]
+    assert partitions.get_partition_stats()["evictions"] == evictions + 1
+    assert sum(p.bytes for p in _resident(generation).values()) == 2 * MB
+
+
+def test_evicted_partition_is_rebuilt_on_next_read(dataset):
+    generation, images = dataset
+    first = images[100000]
+    for image_id in images:
+        images[image_id]
+    assert "task:1" not in _resident(generation)
+
+    again = images[100000]
+    assert again == first and again is not first
+    assert "task:1" in _resident(generation)
+
+
+def test_partition_over_budget_alone_is_kept(dataset, monkeypatch):
+    generation, images = dataset
+    monkeypatch.setattr(settings, "partition_memory_mb", 0)
+    for image_id in images:
+        images[image_id]
+    # Only the partition being read survives, even though it alone is over budget
+    assert list(_resident(generation)) == ["task:3"]
+
+
+def test_partitions_follow_sites(dataset, scratch_db):
+    survey_service.set_survey(1, SurveyInfo(site="beach", surveyed_on=date(2025, 5, 1)))
+    survey_service.set_survey(2, SurveyInfo(site="beach", surveyed_on=date(2025, 6, 1)))
+    generation, images = dataset
+    images[100000]
+    images[200000]
+    assert list(_resident(generation)) == ["beach"]
+    assert _resident(generation)["beach"].bytes == MB // 2
+
+
+def test_reads_after_replace_tasks_never_use_an_older_generation(scratch_db):
+    survey_service.set_survey(7, SurveyInfo(site="beach", surveyed_on=date(2025, 5, 1)))
+    cvat_service.replace_tasks({7}, *_task(7, 3, prefix="old-"))
+    old_dataset = cvat_service.get_dataset()
+    old_generation = cvat_service._generation
+    assert cvat_service.get_dataset("beach").images[700000].name == "old-7-0.jpg"
+    old_part = _resident(old_generation)["beach"]
+
+    cvat_service.replace_tasks({7}, *_task(7, 3, prefix="new-"))
+    assert cvat_service._generation != old_generation
+    assert old_part.evicted
+    assert not _resident(old_generation)
+
+    for view in (cvat_service.get_dataset(), cvat_service.get_dataset("beach")):
+        assert [img.name for img in view.images.values()] == ["new-7-0.jpg", "new-7-1.jpg", "new-7-2.jpg"]
+        assert all(ann.id == image_id for image_id, anns in view.annotations.items() for ann in anns)
+    assert list(_resident(cvat_service._generation)) == ["beach"]
+    assert not _resident(old_generation)
+
+    # A reader still holding the old dataset rebuilds from its own snapshot, not the new one
+    assert old_dataset.images[700001].name == "old-7-1.jpg"
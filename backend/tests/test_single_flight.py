@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services import single_flight
+from app.services.single_flight import coalesce, coalesce_sync, get_single_flight_stats
+
+
+class _Boom(Exception):
+    pass
+
+
+def _stats(namespace: str) -> dict:
+    return get_single_flight_stats()[namespace]
+
+
+def test_concurrent_callers_share_one_execution():
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": 42}
+
+    async def main():
+        return await asyncio.gather(*(coalesce("share", "k", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert runs == [1]
+    assert all(r is results[0] for r in results)
+    assert _stats("share") == {
+        "calls": 5, "executed": 1, "coalesced": 4, "errors": 0, "in_flight": 0, "coalesced_ratio": 0.8,
+    }
+    assert not single_flight._async_flights
+
+
+def test_different_keys_and_later_calls_run_again():
+    runs = []
+
+    async def work(key):
+        runs.append(key)
+        await asyncio.sleep(0)
+        return key
+
+    async def main():
+        first = await asyncio.gather(coalesce("keys", "a", lambda: work("a")), coalesce("keys", "b", lambda: work("b")))
+        # Nothing is cached: once a flight lands, the next caller starts a new one
+        return first, await coalesce("keys", "a", lambda: work("a"))
+
+    assert asyncio.run(main()) == (["a", "b"], "a")
+    assert runs == ["a", "b", "a"]
+
+
+def test_cancelling_the_first_caller_leaves_the_flight_running():
+    runs = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            runs.append(1)
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(coalesce("cancel", "k", work))
+        await asyncio.sleep(0)
+        others = [asyncio.create_task(coalesce("cancel", "k", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.gather(*others)
+
+    assert asyncio.run(main()) == ["done", "done"]
+    assert runs == [1]
+    assert _stats("cancel")["errors"] == 0
+
+
+def test_exceptions_reach_every_waiter():
+    async def work():
+        await asyncio.sleep(0.01)
+        raise _Boom("upstream failed")
+
+    async def main():
+        return await asyncio.gather(*(coalesce("error", "k", work) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [type(e) for e in errors] == [_Boom] * 3
+    assert _stats("error")["errors"] == 1
+    assert not single_flight._async_flights
+
+
+def test_sync_callers_share_one_execution_and_its_error():
+    runs = []
+    barrier = threading.Barrier(4)
+
+    def work():
+        runs.append(1)
+        time.sleep(0.05)
+        if len(runs) == 1:
+            raise _Boom("first flight fails")
+        return "ok"
+
+    def call(out: list):
+        barrier.wait()
+        try:
+            out.append(coalesce_sync("sync", "k", work))
+        except _Boom as exc:
+            out.append(exc)
+
+    outcomes: list = []
+    threads = [threading.Thread(target=call, args=(outcomes,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert runs == [1]
+    assert len(outcomes) == 4 and all(isinstance(o, _Boom) for o in outcomes)
+    # The failed flight is gone; the next call runs again
+    assert coalesce_sync("sync", "k", work) == "ok"
+    assert _stats("sync")["executed"] == 2
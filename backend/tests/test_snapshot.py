@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+
+from app.models.schemas import CvatAnnotation, CvatImage, GeoCoordinate, ImageGeoReference
+from app.services import cvat_service, geo_service, partitions
+from app.services.snapshot_columns import encode_dataset, encode_georefs, open_dataset, open_georefs
+from app.services.store import load_columns, load_json, save_columns, save_json
+
+TASK = 7
+
+
+def _image(frame: int, name: str | None = None) -> CvatImage:
+    image_id = TASK * 100000 + frame
+    return CvatImage(id=image_id, name=name or f"frame_{frame}.jpg", width=640, height=480, task_id=TASK)
+
+
+def test_columns_round_trip(scratch_db):
+    arrays = {
+        "ids": np.array([3, 1, 2], dtype=np.int64),
+        "points": np.arange(12, dtype=np.float64).reshape(6, 2),
+        "flags": np.array([True, False, True]),
+        "empty": np.zeros((0, 2), dtype=np.float32),
+        "names": np.frombuffer("naïve".encode(), dtype=np.uint8),
+    }
+    save_columns("t.snap", arrays, {"labels": ["bottle", "can"]})
+
+    cols, meta = load_columns("t.snap")
+    assert meta == {"labels": ["bottle", "can"]}
+    assert cols.keys() == arrays.keys()
+    for name, arr in arrays.items():
+        assert cols[name].dtype == arr.dtype
+        np.testing.assert_array_equal(cols[name], arr)
+    assert not cols["ids"].flags.writeable
+
+
+def test_load_columns_rejects_other_files(scratch_db):
+    assert load_columns("missing.snap") is None
+    (scratch_db / "bad.snap").write_bytes(b"not a snapshot")
+    assert load_columns("bad.snap") is None
+
+
+def test_dataset_round_trip(scratch_db):
+    images = {img.id: img for img in (_image(2, "b.jpg"), _image(1, "á.jpg"), _image(3, "c.jpg"))}
+    annotations = {
+        _image(1).id: [
+            CvatAnnotation(id=11, image_id=_image(1).id, label="can", points=[[0, 0], [4, 0], [4, 4]], pixel_area=8.0),
+            CvatAnnotation(
+                id=12, image_id=_image(1).id, label="net", points=[[1, 1], [2, 2]], shape_type="rectangle",
+                proposed=True,
+            ),
+        ],
+        _image(3).id: [CvatAnnotation(id=31, image_id=_image(3).id, label="can", points=[[0, 0], [1, 0], [0, 1]])],
+        # Annotations of an unknown image are dropped
+        999: [CvatAnnotation(id=99, image_id=999, label="can", points=[[0, 0], [1, 0], [0, 1]])],
+    }
+    label_pixels = {_image(1).id: {"can": 8.0, "net": 0.0}}
+    save_columns("cvat.snap", *encode_dataset(images, annotations, label_pixels))
+
+    cols, meta = load_columns("cvat.snap")
+    loaded_images, loaded_annotations, loaded_pixels = open_dataset(cols, meta, partitions.new_generation())
+    assert list(loaded_images) == sorted(images)
+    assert {i: loaded_images[i] for i in loaded_images} == images
+    assert dict(loaded_annotations) == {i: anns for i, anns in annotations.items() if i in images}
+    assert _image(2).id not in loaded_annotations
+    assert {i: dict(px) for i, px in loaded_pixels.items()} == label_pixels
+    assert 999 not in loaded_images and "x" not in loaded_images
+
+
+def test_georefs_round_trip(scratch_db):
+    georefs = {
+        i: ImageGeoReference(
+            image_id=i, center=GeoCoordinate(lat=41.0 + i / 1e6, lng=2.0), ground_resolution_cm_per_pixel=0.3,
+        )
+        for i in (700003, 700001)
+    }
+    save_columns("georefs.snap", encode_georefs(georefs), {})
+    cols, _ = load_columns("georefs.snap")
+    assert dict(open_georefs(cols)) == georefs
+
+
+def _write_seed(name: str) -> None:
+    image = _image(1, name)
+    save_json("cvat.json", {"images": {str(image.id): image.model_dump()}, "annotations": {}})
+
+
+def test_seed_json_only_when_snapshot_missing(scratch_db):
+    _write_seed("seeded.jpg")
+    cvat_service.load_from_disk()
+    assert (scratch_db / "cvat.snap").exists()
+    assert cvat_service.get_cached_images()[_image(1).id].name == "seeded.jpg"
+
+    # A newer cvat.json (a checkout, a touch) no longer overrides the snapshot
+    _write_seed("stale.jpg")
+    later = (scratch_db / "cvat.snap").stat().st_mtime_ns + 10**9
+    os.utime(scratch_db / "cvat.json", ns=(later, later))
+    cvat_service.load_from_disk()
+    assert cvat_service.get_cached_images()[_image(1).id].name == "seeded.jpg"
+
+    (scratch_db / "cvat.snap").unlink()
+    cvat_service.load_from_disk()
+    assert cvat_service.get_cached_images()[_image(1).id].name == "stale.jpg"
+
+
+def test_georefs_seed_json_only_when_snapshot_missing(scratch_db):
+    ref = {"image_id": 700001, "center": {"lat": 41.0, "lng": 2.0}, "ground_resolution_cm_per_pixel": 0.5}
+    save_json("georefs.json", {"georefs": {"700001": ref}, "global_origin": {"lat": 41.0, "lng": 2.0}})
+    geo_service.load_from_disk()
+    assert (scratch_db / "georefs.snap").exists()
+
+    save_json("georefs.json", {"georefs": {}, "global_origin": None})
+    later = (scratch_db / "georefs.snap").stat().st_mtime_ns + 10**9
+    os.utime(scratch_db / "georefs.json", ns=(later, later))
+    geo_service.load_from_disk()
+    assert geo_service.get_all_georefs()[700001].center.lat == 41.0
+    assert load_json("georefs.json")["georefs"] == {}
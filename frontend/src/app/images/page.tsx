@@ -2,19 +2,10 @@
 
 import { useState, useEffect } from "react";
 import Link from "next/link";
-import { syncCvat, getImages, getAnnotations, registerGlobalOrigin, getGeorefs } from "@/lib/api";
-import type { CvatSyncResponse, CvatImage, CvatAnnotation, GeorefInfo } from "@/lib/types";
+import { syncCvat, getImages, registerGlobalOrigin, getGeorefs } from "@/lib/api";
+import type { CvatImageRow, CvatImagePage, GeorefInfo } from "@/lib/types";
 
-const WEIGHT_PER_PIXEL_G = 0.12;
-const AREA_PER_PIXEL_CM2 = 0.25;
-
-interface ImageStats {
-  annotationCount: number;
-  totalPixelArea: number;
-  areaCm2: number;
-  weightG: number;
-  weightKg: number;
-}
+const PAGE_SIZE = 60;
 
 function SyncIcon() {
   return (
@@ -45,8 +36,9 @@ function DroneIcon() {
 }
 
 export default function ImagesPage() {
-  const [images, setImages] = useState<CvatImage[]>([]);
-  const [stats, setStats] = useState<Record<number, ImageStats>>({});
+  const [images, setImages] = useState<CvatImageRow[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [pageLoading, setPageLoading] = useState(false);
   const [loading, setLoading] = useState(false);
   const [taskId, setTaskId] = useState("");
 
@@ -57,35 +49,19 @@ export default function ImagesPage() {
   const [originLoading, setOriginLoading] = useState(false);
   const [georefs, setGeorefs] = useState<Record<number, { lat: number; lng: number }>>({});
 
-  async function fetchStats(imgs: CvatImage[]) {
-    const entries = await Promise.all(
-      imgs.map(async (img) => {
-        try {
-          const anns = (await getAnnotations(img.id)) as CvatAnnotation[];
-          const totalPixelArea = anns.reduce(
-            (sum, a) => sum + (a.pixel_area ?? 0),
-            0
-          );
-          return [
-            img.id,
-            {
-              annotationCount: anns.length,
-              totalPixelArea,
-              areaCm2: totalPixelArea * AREA_PER_PIXEL_CM2,
-              weightG: totalPixelArea * WEIGHT_PER_PIXEL_G,
-              weightKg: (totalPixelArea * WEIGHT_PER_PIXEL_G) / 1000,
-            },
-          ] as const;
-        } catch {
-          return null;
-        }
-      })
-    );
-    const newStats: Record<number, ImageStats> = {};
-    for (const entry of entries) {
-      if (entry) newStats[entry[0]] = entry[1];
+  async function loadImages(cursor: string | null = null) {
+    setPageLoading(true);
+    try {
+      const page = (await getImages({
+        limit: PAGE_SIZE,
+        cursor,
+        has_annotations: true,
+      })) as CvatImagePage;
+      setImages((prev) => (cursor ? [...prev, ...page.items] : page.items));
+      setNextCursor(page.next_cursor);
+    } finally {
+      setPageLoading(false);
     }
-    setStats(newStats);
   }
 
   async function loadGeorefs() {
@@ -103,24 +79,15 @@ export default function ImagesPage() {
   }
 
   useEffect(() => {
-    getImages()
-      .then((data) => {
-        const imgs = data as CvatImage[];
-        setImages(imgs);
-        if (imgs.length > 0) fetchStats(imgs);
-      })
-      .catch(() => {});
+    loadImages().catch(() => {});
     loadGeorefs();
   }, []);
 
   async function handleSync() {
     setLoading(true);
     try {
-      const data = (await syncCvat(
-        taskId ? parseInt(taskId) : undefined
-      )) as CvatSyncResponse;
-      setImages(data.images);
-      if (data.images.length > 0) fetchStats(data.images);
+      await syncCvat(taskId ? parseInt(taskId) : undefined);
+      await loadImages();
     } catch (err) {
       console.error(err);
       alert("Sync failed — check backend connection and CVAT credentials.");
@@ -155,9 +122,6 @@ export default function ImagesPage() {
     return `${g.toFixed(1)} g`;
   }
 
-  const totalAnnotations = Object.values(stats).reduce((s, v) => s + v.annotationCount, 0);
-  const totalWeightG = Object.values(stats).reduce((s, v) => s + v.weightG, 0);
-
   return (
     <div>
       <h1 className="mb-4 text-2xl font-bold">CVAT Images</h1>
@@ -217,27 +181,17 @@ export default function ImagesPage() {
       </div>
 
       {(() => {
-        const annotatedImages = images.filter(
-          (img) => stats[img.id] && stats[img.id].annotationCount > 0
-        );
         if (images.length === 0) {
           return (
             <p className="text-gray-500">
-              No images loaded. Click &quot;Sync from CVAT&quot; to pull imagery.
-            </p>
-          );
-        }
-        if (annotatedImages.length === 0) {
-          return (
-            <p className="text-gray-500">
-              No annotated images found. Images without annotations are hidden.
+              No annotated images found. Click &quot;Sync from CVAT&quot; to pull imagery. Images without annotations are hidden.
             </p>
           );
         }
         return (
+          <>
           <div className="grid grid-cols-1 gap-4 sm:grid-cols-2 lg:grid-cols-3">
-            {annotatedImages.map((img) => {
-              const s = stats[img.id];
+            {images.map((img) => {
               return (
                 <div
                   key={img.id}
@@ -250,20 +204,20 @@ export default function ImagesPage() {
                   <div className="mt-3 space-y-1 border-t border-gray-100 pt-3 text-sm dark:border-gray-800">
                     <p>
                       <span className="text-gray-500">Annotations:</span>{" "}
-                      {s.annotationCount}
+                      {img.annotation_count}
                     </p>
                     <p>
                       <span className="text-gray-500">Pixel area:</span>{" "}
-                      {s.totalPixelArea.toLocaleString()} px
+                      {img.pixel_area.toLocaleString()} px
                     </p>
                     <p>
                       <span className="text-gray-500">Real area:</span>{" "}
-                      {s.areaCm2.toFixed(1)} cm²
+                      {img.area_cm2.toFixed(1)} cm²
                     </p>
                     <p>
                       <span className="text-gray-500">Est. plastic:</span>{" "}
                       <span className="font-semibold text-red-500">
-                        {formatWeight(s.weightG)}
+                        {formatWeight(img.weight_g)}
                       </span>
                     </p>
                     <span className="shrink-0 rounded-full bg-ocean/10 px-2 py-0.5 text-xs text-ocean-dark dark:text-ocean-light">
@@ -281,6 +235,18 @@ export default function ImagesPage() {
               );
             })}
           </div>
+          {nextCursor && (
+            <div className="mt-6 flex justify-center">
+              <button
+                onClick={() => loadImages(nextCursor)}
+                disabled={pageLoading}
+                className="rounded-lg border border-gray-300 px-4 py-2 text-sm font-medium hover:bg-gray-50 disabled:opacity-50 dark:border-gray-700 dark:hover:bg-gray-900"
+              >
+                {pageLoading ? "Loading..." : "Load more"}
+              </button>
+            </div>
+          )}
+          </>
         );
       })()}
     </div>
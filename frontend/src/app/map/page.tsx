@@ -16,8 +16,7 @@ function deriveStats(geojson: MapFeatureCollection) {
   const totalWeightKg =
     geojson.features.reduce((sum, f) => sum + (f.properties.weight_g ?? 0), 0) / 1000;
   const totalAreaM2 =
-    (geojson.features.reduce((sum, f) => sum + (f.properties.pixel_area ?? 0), 0) * 0.25) /
-    10000;
+    geojson.features.reduce((sum, f) => sum + (f.properties.area_cm2 ?? 0), 0) / 10000;
   return { features, totalWeightKg, totalAreaM2 };
 }
 
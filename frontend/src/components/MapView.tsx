@@ -1,9 +1,10 @@
 "use client";
 
-import { useEffect } from "react";
+import { useEffect, useState } from "react";
 import { MapContainer, TileLayer, GeoJSON, CircleMarker, Popup, useMap } from "react-leaflet";
 import "leaflet/dist/leaflet.css";
-import type { MapFeatureCollection, HeatmapPoint } from "@/lib/types";
+import type { MapFeatureCollection, HeatmapPoint, MosaicInfo } from "@/lib/types";
+import { getMosaics, mosaicTileUrl } from "@/lib/api";
 import * as L from "leaflet";
 
 interface Props {
@@ -108,6 +109,13 @@ function PolygonLegend() {
 
 
 export default function MapView({ geojson, heatmapPoints }: Props) {
+  const [mosaics, setMosaics] = useState<MosaicInfo[]>([]);
+  useEffect(() => {
+    getMosaics()
+      .then((data) => setMosaics(data as MosaicInfo[]))
+      .catch(() => setMosaics([]));
+  }, []);
+
   const showHeatmap = heatmapPoints && heatmapPoints.length > 0;
   const showGeojson = !showHeatmap && geojson;
 
@@ -124,6 +132,16 @@ export default function MapView({ geojson, heatmapPoints }: Props) {
           url="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
           maxZoom={19}
         />
+        {mosaics.map((m) => (
+          <TileLayer
+            key={`${m.task_id}-${m.tiles}`}
+            url={mosaicTileUrl(m.task_id)}
+            bounds={[[m.bounds[1], m.bounds[0]], [m.bounds[3], m.bounds[2]]]}
+            minNativeZoom={m.min_zoom}
+            maxNativeZoom={m.max_zoom}
+            maxZoom={23}
+          />
+        ))}
         <FitBounds geojson={showGeojson ? geojson : null} heatmapPoints={showHeatmap ? heatmapPoints : null} />
         {showHeatmap && heatmapPoints.map((p) => (
           <CircleMarker
@@ -1,3 +1,5 @@
+import { topologyToFeatureCollection, type Topology } from "./topojson";
+
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 
 async function request<T>(path: string, options?: RequestInit): Promise<T> {
@@ -20,8 +22,26 @@ export function syncCvat(taskId?: number) {
   });
 }
 
-export function getImages() {
-  return request("/cvat/images");
+export interface ImageQuery {
+  limit?: number;
+  cursor?: string | null;
+  sort?: "name" | "weight";
+  task_id?: number;
+  has_annotations?: boolean;
+  label?: string;
+  min_weight_g?: number;
+  georeferenced?: boolean;
+  fields?: string[];
+}
+
+export function getImages(query: ImageQuery = {}) {
+  const params = new URLSearchParams();
+  for (const [key, value] of Object.entries(query)) {
+    if (value === undefined || value === null) continue;
+    params.set(key, Array.isArray(value) ? value.join(",") : String(value));
+  }
+  const qs = params.toString();
+  return request(`/cvat/images${qs ? `?${qs}` : ""}`);
 }
 
 export function getAnnotations(imageId: number) {
@@ -42,8 +62,10 @@ export function getAnalysis(imageId: number) {
 }
 
 // --- Map ---
-export function getMapFeatures(imageId: number) {
-  return request(`/map/${imageId}`);
+// Geometry is fetched as quantised TopoJSON (several times smaller) and decoded to GeoJSON here
+export async function getMapFeatures(imageId: number) {
+  const topology = await request<Topology>(`/map/${imageId}?format=topojson`);
+  return topologyToFeatureCollection(topology);
 }
 
 export function registerGeoreference(
@@ -90,6 +112,14 @@ export function getHeatmapData() {
   return request("/map/heatmap");
 }
 
+export function getMosaics() {
+  return request("/map/mosaics");
+}
+
+export function mosaicTileUrl(taskId: number) {
+  return `${API_URL}/map/tiles/${taskId}/{z}/{x}/{y}.png`;
+}
+
 // --- Expedition Planning ---
 export function planExpedition(body: {
   image_ids?: number[];
@@ -108,8 +138,11 @@ export function getEmployees() {
 }
 
 // --- Dashboard ---
-export function getDashboardSummary() {
-  return request("/dashboard/summary");
+export async function getDashboardSummary() {
+  const { topology, ...summary } = await request<{ topology: Topology } & Record<string, unknown>>(
+    "/dashboard/summary?format=topojson"
+  );
+  return { ...summary, geojson: topologyToFeatureCollection(topology) };
 }
 
 // --- Raccoon Agent ---
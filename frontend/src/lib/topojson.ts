@@ -0,0 +1,38 @@
+import type { MapFeature, MapFeatureCollection } from "./types";
+
+// Decoder for the backend's quantised TopoJSON (format=topojson): one
+// delta-encoded arc per polygon ring, scaled by a fixed transform.
+
+export interface Topology {
+  type: "Topology";
+  transform: { scale: [number, number]; translate: [number, number] };
+  objects: {
+    features: {
+      type: "GeometryCollection";
+      geometries: { type: "Polygon"; arcs: number[][]; properties: MapFeature["properties"] }[];
+    };
+  };
+  arcs: number[][][];
+}
+
+export function topologyToFeatureCollection(topology: Topology): MapFeatureCollection {
+  const [sx, sy] = topology.transform.scale;
+  const [tx, ty] = topology.transform.translate;
+  const rings = topology.arcs.map((arc) => {
+    let x = 0;
+    let y = 0;
+    return arc.map(([dx, dy]) => {
+      x += dx;
+      y += dy;
+      return [x * sx + tx, y * sy + ty];
+    });
+  });
+  return {
+    type: "FeatureCollection",
+    features: topology.objects.features.geometries.map((g) => ({
+      type: "Feature",
+      geometry: { type: "Polygon", coordinates: g.arcs.map(([i]) => rings[i]) },
+      properties: g.properties,
+    })),
+  };
+}
@@ -8,12 +8,28 @@ export interface CvatImage {
   task_id: number;
 }
 
+export interface CvatImageRow extends CvatImage {
+  annotation_count: number;
+  labels: string[];
+  pixel_area: number;
+  area_cm2: number;
+  weight_g: number;
+  georeferenced: boolean;
+}
+
+export interface CvatImagePage {
+  items: CvatImageRow[];
+  next_cursor: string | null;
+}
+
 export interface CvatAnnotation {
   id: number;
   image_id: number;
   label: string;
   points: number[][];
   pixel_area: number | null;
+  shape_type: string;
+  proposed?: boolean;
 }
 
 export interface CvatSyncResponse {
@@ -42,6 +58,7 @@ export interface MapFeature {
     annotation_id: number;
     label: string;
     pixel_area: number | null;
+    area_cm2: number;
     weight_g: number;
   };
 }
@@ -94,6 +111,15 @@ export interface ItineraryStop {
   pixel_area: number | null;
 }
 
+export interface MosaicInfo {
+  task_id: number;
+  bounds: [number, number, number, number]; // west, south, east, north
+  min_zoom: number;
+  max_zoom: number;
+  frames: number;
+  tiles: number;
+}
+
 export interface HeatmapCell {
   row: number;
   col: number;
@@ -111,6 +137,7 @@ export interface ZoneSummary {
   area_cm2: number;
   weight_g: number;
   weight_kg: number;
+  weight_interval_kg?: WeightInterval;
 }
 
 export interface LabelBreakdown {
@@ -120,6 +147,12 @@ export interface LabelBreakdown {
   weight_g: number;
 }
 
+export interface WeightInterval {
+  low: number;
+  median: number;
+  high: number;
+}
+
 export interface DashboardSummary {
   total_annotations: number;
   total_area_cm2: number;
@@ -128,7 +161,9 @@ export interface DashboardSummary {
   total_weight_kg: number;
   avg_density_g_per_cm2: number;
   avg_density_g_per_m2: number;
-  buried_estimate_kg: { low: number; high: number };
+  weight_interval_kg: WeightInterval;
+  buried_estimate_kg: WeightInterval;
+  confidence: number;
   hotspot_count: number;
   image_count: number;
   annotation_count: number;